@@ -9,8 +9,18 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 
 import os
 
+from channels.routing import ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Radkan.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# the consumers use the models, they are imported once the apps are loaded
+from employer.consumers import JWTQueryStringAuthMiddleware  # noqa: E402
+from employer.routing import websocket_urlpatterns  # noqa: E402
+
+application = ProtocolTypeRouter({
+    "http": django_application,
+    "websocket": JWTQueryStringAuthMiddleware(URLRouter(websocket_urlpatterns)),
+})
@@ -72,7 +72,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'employer.authentication.ClaimsJWTAuthentication',
     )
 }
 SIMPLE_JWT = {
@@ -84,6 +84,8 @@ SIMPLE_JWT = {
     # 'SLIDING_TOKEN_LIFETIME_LATE_USER': timedelta(days=30),
     "ACCESS_TOKEN_LIFETIME": timedelta(days=60),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=200),
+    "TOKEN_OBTAIN_SERIALIZER": "employer.authentication.ClaimsTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "employer.authentication.ClaimsTokenRefreshSerializer",
 }
 ADMINS = [("Masoud Najafzadeh", "masoudnk2@gmail.com"), ]
 DEFAULT_FROM_EMAIL = 'masoud@radkan.com'
@@ -146,6 +148,15 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'Radkan.wsgi.application'
+ASGI_APPLICATION = 'Radkan.asgi.application'
+
+# dashboard events only reach the websockets of the same process with the in-memory layer,
+# deployments with several asgi processes need channels_redis.core.RedisChannelLayer here
+CHANNEL_LAYERS = {
+    "default": {
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+    },
+}
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
@@ -170,6 +181,16 @@ DATABASES = {
     }
 }
 
+# shared by every process, authorization contexts, token claims and workplace indexes are only kept with a shared cache
+# since a process private one (the LocMem default) never sees what other processes invalidate. the table is made by
+# `manage.py createcachetable`, django.core.cache.backends.redis.RedisCache is the faster choice where redis is available
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "radkan_cache",
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -205,3 +226,47 @@ MEDIA_URL = '/media/'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# threads of each web process running report jobs, 0 leaves them to `manage.py run_report_jobs`
+REPORT_JOB_WORKERS = 0
+# seconds after which a running job is taken for abandoned by a crashed worker, it is run again up to REPORT_JOB_ATTEMPTS times
+REPORT_JOB_TIMEOUT = 60 * 60
+REPORT_JOB_ATTEMPTS = 2
+
+# processes computing daily statuses of bulk reports, employees are sent to them REPORT_PROCESS_CHUNK_SIZE at a time
+REPORT_PROCESSES = os.cpu_count() or 1
+REPORT_PROCESS_CHUNK_SIZE = 250
+
+# seconds an employer dashboard is served from the cache, roll calls of the employer invalidate it earlier
+DASHBOARD_CACHE_SECONDS = 10
+# a worker thread of each process refreshes the summaries of days with written roll calls, False refreshes them at commit
+SUMMARY_REFRESH_WORKER = True
+
+# seconds the employer, manager and permissions of a user are served from the cache, changes to them invalidate it earlier
+AUTH_CONTEXT_CACHE_SECONDS = 5 * 60
+
+# "database" writes audit entries as LogEntry rows, "file" appends them as json lines to AUDIT_LOG_FILE
+AUDIT_LOG_BACKEND = "database"
+AUDIT_LOG_FILE = os.path.join(BASE_DIR, "audit.log")
+# a worker thread of each process writes the audit entries, False writes them when their transaction commits
+AUDIT_LOG_WORKER = True
+AUDIT_BATCH_SIZE = 500
+# writes of a batch before it is appended to AUDIT_LOG_FILE instead
+AUDIT_WRITE_ATTEMPTS = 2
+# log the changed fields of every save of a loaded object
+AUDIT_CHANGES = True
+
+# roll calls accepted by one request of the batch endpoints
+ROLL_CALL_BATCH_LIMIT = 1000
+
+# seconds a process trusts the versions of the shared cache it read, invalidations of other processes (workplace
+# imports, revoked permissions) take this long at most to show
+SHARED_VERSION_SECONDS = 5
+
+# punches are accepted up to this many meters outside the radius of a workplace, for the gps error of phones
+GEOFENCE_TOLERANCE = 0
+
+# jalali years of roll call partitions created ahead of the current one (postgresql only)
+ROLL_CALL_PARTITION_YEARS_AHEAD = 1
+# where `manage.py archive_roll_calls` writes the roll calls of closed years
+ROLL_CALL_ARCHIVE_DIR = os.path.join(BASE_DIR, "archives")
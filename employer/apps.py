@@ -1,4 +1,15 @@
 from django.apps import AppConfig
+from django.core import checks
+
+
+def check_shared_cache(app_configs, **kwargs):
+    from employer.utilities import is_cache_shared
+    if is_cache_shared():
+        return []
+    return [checks.Warning("the default cache is private to each process",
+                           hint="authorization contexts, token claims and workplace indexes are read from the database on every request, "
+                                "configure a shared cache such as DatabaseCache or RedisCache",
+                           id="employer.W001")]
 
 
 class EmployerConfig(AppConfig):
@@ -7,5 +18,8 @@ class EmployerConfig(AppConfig):
 
     def ready(self):
         import employer.signals
+        checks.register(check_shared_cache, checks.Tags.caches)
+
+
 def get_this_app_name():
-    return EmployerConfig.name
\ No newline at end of file
+    return EmployerConfig.name
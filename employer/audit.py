@@ -0,0 +1,130 @@
+"""
+audit entries of the app are captured by the signals as plain tuples and written in batches off the request: events of a
+transaction are queued once it commits (rolled back changes are never logged), and a single worker thread of the process
+writes everything queued meanwhile with one bulk_create of LogEntry rows, or appends it as json lines to AUDIT_LOG_FILE
+when AUDIT_LOG_BACKEND is "file". a batch the database rejects is retried, then appended to the file. without the worker, AUDIT_LOG_WORKER = False, queued events are written at commit.
+changes are logged as {attname: [old, new]} of the changed fields only, AUDIT_CHANGES = False leaves them out
+"""
+import atexit
+import copy
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.admin.models import LogEntry, DELETION
+from django.contrib.contenttypes.models import ContentType
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction, connection
+from django.utils.timezone import now
+
+AUDIT_LOG_BACKEND = getattr(settings, "AUDIT_LOG_BACKEND", "database")
+AUDIT_LOG_FILE = getattr(settings, "AUDIT_LOG_FILE", "audit.log")
+AUDIT_LOG_WORKER = getattr(settings, "AUDIT_LOG_WORKER", True)
+AUDIT_BATCH_SIZE = getattr(settings, "AUDIT_BATCH_SIZE", 500)
+AUDIT_CHANGES = getattr(settings, "AUDIT_CHANGES", True)
+AUDIT_WRITE_ATTEMPTS = getattr(settings, "AUDIT_WRITE_ATTEMPTS", 2)
+OBJECT_REPR_LENGTH = LogEntry._meta.get_field("object_repr").max_length
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audit_log") if AUDIT_LOG_WORKER else None
+lock = threading.Lock()
+pending = []
+scheduled = False
+
+
+def get_change_message(action_flag, instance, change_message):
+    # deleted objects are serialized by the worker from the copy taken before the delete, in the format of serializers.serialize
+    if action_flag == DELETION:
+        untracked = getattr(instance, "untracked_fields", ())
+        fields = [field.name for field in instance._meta.concrete_fields if not field.primary_key and field.attname not in untracked]
+        return "deleted:" + serializers.serialize("json", [instance], fields=fields)
+    if isinstance(change_message, dict):
+        # jalali dates and times have no json form of their own
+        return json.dumps(change_message, default=str, ensure_ascii=False)
+    return change_message if isinstance(change_message, str) else str(change_message)
+
+
+def write_database(events):
+    LogEntry.objects.bulk_create([
+        LogEntry(action_time=action_time, user_id=user_id, content_type=ContentType.objects.get_for_model(model), object_id=str(object_id),
+                 object_repr=object_repr, action_flag=action_flag, change_message=get_change_message(action_flag, instance, change_message))
+        for action_time, user_id, model, object_id, object_repr, action_flag, instance, change_message in events], batch_size=AUDIT_BATCH_SIZE)
+
+
+def write_file(events):
+    with open(AUDIT_LOG_FILE, "a", encoding="utf-8") as file:
+        for action_time, user_id, model, object_id, object_repr, action_flag, instance, change_message in events:
+            file.write(json.dumps({"action_time": action_time, "user_id": user_id, "model": model._meta.label_lower, "object_id": object_id,
+                                   "object_repr": object_repr, "action_flag": action_flag,
+                                   "change_message": get_change_message(action_flag, instance, change_message)}, cls=DjangoJSONEncoder, ensure_ascii=False) + "\n")
+
+
+def flush_audit_log():
+    """writes every queued event, AUDIT_BATCH_SIZE at a time"""
+    global scheduled
+    write = write_file if AUDIT_LOG_BACKEND == "file" else write_database
+    while True:
+        with lock:
+            events = pending[:AUDIT_BATCH_SIZE]
+            del pending[:AUDIT_BATCH_SIZE]
+            if not events:
+                scheduled = False
+                return
+        write_batch(write, events)
+
+
+def write_batch(write, events):
+    # tried AUDIT_WRITE_ATTEMPTS times, then appended to AUDIT_LOG_FILE. a batch nothing could write is only in the error log
+    for attempt in range(AUDIT_WRITE_ATTEMPTS):
+        try:
+            return write(events)
+        except Exception:
+            logger.exception("writing %s audit events failed, attempt %s", len(events), attempt + 1)
+            # a broken connection is opened again for the next attempt, one in a transaction is left to its owner
+            if write is write_database and not connection.in_atomic_block:
+                connection.close()
+    if write is not write_file:
+        try:
+            return write_file(events)
+        except Exception:
+            logger.exception("writing %s audit events to %s failed", len(events), AUDIT_LOG_FILE)
+    logger.error("%s audit events lost", len(events))
+
+
+def run_audit_worker():
+    try:
+        flush_audit_log()
+    finally:
+        connection.close()
+
+
+def queue_audit_events(events):
+    global scheduled
+    with lock:
+        pending.extend(events)
+        submit = executor is not None and not scheduled
+        scheduled = scheduled or submit
+    if submit:
+        executor.submit(run_audit_worker)
+    elif executor is None:
+        flush_audit_log()
+
+
+def record_audit_event(user_id, instance, action_flag, change_message=None):
+    """
+    captures an entry for instance, ids and the repr are read now and deleted objects copied since their pk is cleared
+    by the delete. nothing is written before the transaction commits
+    """
+    if action_flag == DELETION:
+        instance = copy.copy(instance)
+    event = (now(), user_id, type(instance), instance.pk, str(instance)[:OBJECT_REPR_LENGTH], action_flag, instance, change_message)
+    # run at once outside transactions, dropped with the savepoint it was recorded in
+    transaction.on_commit(lambda: queue_audit_events([event]))
+
+
+# events still queued when the process exits
+atexit.register(flush_audit_log)
@@ -0,0 +1,43 @@
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.tokens import AccessToken
+
+from employer.authorization import get_auth_context, set_token_claims, get_token_auth_context
+from employer.models import User
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+
+    @classmethod
+    def get_token(cls, user):
+        # the access token copies the claims of the refresh token
+        return set_token_claims(super().get_token(user), get_auth_context(user.id))
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+
+    def validate(self, attrs):
+        # claims are issued again from the current context, not copied from the refresh token
+        data = super().validate(attrs)
+        access = AccessToken(data["access"])
+        data["access"] = str(set_token_claims(access, get_auth_context(int(access["user_id"]))))
+        return data
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    trusts the claims of tokens issued under the current auth version of their user, the request then costs a signature
+    check and, once every SHARED_VERSION_SECONDS per user and process, a cache read. the user is a stub with only its id loaded, other fields are read from the database on access.
+    stale tokens, and every token when the cache is private to the process, fall back to loading the user and its context
+    """
+
+    def get_user(self, validated_token):
+        context = get_token_auth_context(validated_token)
+        if context is None:
+            user = super().get_user(validated_token)
+            user.auth_context = get_auth_context(user.id)
+            return user
+        user = User.from_db(DEFAULT_DB_ALIAS, ["id", "is_active", "is_superuser"], [context.user_id, True, context.is_superuser])
+        user.auth_context = context
+        return user
@@ -0,0 +1,191 @@
+"""
+the employer, manager and permissions of a user resolved once and cached per user, check_user_permission reads them
+from the request instead of querying the employer and manager tables and the permissions on every call. contexts are
+cached under the auth version of the user, which signals drop in the shared cache whenever the user, its manager or
+employer row, its permissions or its groups change. with a cache private to the process nothing is kept between requests.
+access tokens carry the context as claims along with the auth version of the user at the time they were issued,
+ClaimsJWTAuthentication trusts them for as long as that version is current in the shared cache, which every process
+reads once every SHARED_VERSION_SECONDS per user.
+permissions of this app are held as bitsets, bit n for the permission with id n, and tested against the permission
+catalogue every process keeps in memory until the catalogue version in the cache changes, checked every SHARED_VERSION_SECONDS
+"""
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils.timezone import now
+
+from employer.apps import get_this_app_name
+from employer.models import User
+from employer.utilities import get_shared_version, invalidate_shared_versions, SHARED_VERSION_SECONDS
+
+AUTH_CONTEXT_CACHE_SECONDS = getattr(settings, "AUTH_CONTEXT_CACHE_SECONDS", 5 * 60)
+
+
+USER_TYPE_EMPLOYER = "employer"
+USER_TYPE_MANAGER = "manager"
+USER_TYPE_EMPLOYEE = "employee"
+
+
+class PermissionCatalogue:
+    """the permissions of this app by id and by full name, with their content types"""
+
+    def __init__(self, permissions):
+        self.permissions = {perm.id: perm for perm in permissions}
+        self.ids = {"{}.{}".format(perm.content_type.app_label, perm.codename): perm.id for perm in self.permissions.values()}
+
+    def has_perm(self, permission_bits, perm):
+        bit = self.ids.get(perm)
+        return bit is not None and permission_bits >> bit & 1 == 1
+
+    def get_permissions(self, permission_bits):
+        return [perm for bit, perm in self.permissions.items() if permission_bits >> bit & 1]
+
+
+_catalogue = None
+
+
+def get_permission_catalogue_version():
+    # read from the cache every SHARED_VERSION_SECONDS at most, not on every check
+    return get_shared_version("permission_catalogue_version", SHARED_VERSION_SECONDS)
+
+
+def invalidate_permission_catalogue():
+    # a cache private to the process has no version, the catalogue of this process is dropped along
+    global _catalogue
+    _catalogue = None
+    invalidate_shared_versions("permission_catalogue_version")
+
+
+def get_permission_catalogue():
+    # permissions only change with migrations, the catalogue is not worth a cache read and unpickling on every check
+    global _catalogue
+    version = get_permission_catalogue_version()
+    if _catalogue is None or _catalogue[0] != version:
+        permissions = Permission.objects.filter(content_type__app_label=get_this_app_name()).select_related("content_type")
+        _catalogue = version, PermissionCatalogue(permissions)
+    return _catalogue[1]
+
+
+def to_permission_bits(permission_ids):
+    bits = 0
+    for permission_id in permission_ids:
+        bits |= 1 << permission_id
+    return bits
+
+
+class AuthContext:
+    """
+    employer_id is None for users that are neither an active employer nor a manager. permission_bits are the assigned
+    ones even for inactive users, is_authorized tells whether they count
+    """
+
+    def __init__(self, user_id, user_type, is_superuser, employer_id, manager_id, expiration_date, permission_bits):
+        self.user_id = user_id
+        self.user_type = user_type
+        self.is_superuser = is_superuser
+        self.employer_id = employer_id
+        self.manager_id = manager_id
+        self.expiration_date = expiration_date
+        self.permission_bits = permission_bits
+
+    def is_authorized(self):
+        # a manager expires while its context is still cached
+        return self.employer_id is not None and (self.expiration_date is None or self.expiration_date >= now())
+
+    def has_perms(self, perms):
+        catalogue = get_permission_catalogue()
+        return self.is_superuser or all(catalogue.has_perm(self.permission_bits, perm) for perm in perms)
+
+    def get_permissions(self):
+        return get_permission_catalogue().get_permissions(self.permission_bits)
+
+
+def get_auth_context_cache_key(user_id, version):
+    return "auth_context_{}_{}".format(user_id, version)
+
+
+def get_auth_version_cache_key(user_id):
+    return "auth_version_{}".format(user_id)
+
+
+def get_auth_version(user_id):
+    """
+    a version lost with the cache comes back as a new one and never matches old tokens, None without a shared cache.
+    read from the cache every SHARED_VERSION_SECONDS at most, a revocation in another process shows after that long
+    """
+    return get_shared_version(get_auth_version_cache_key(user_id), SHARED_VERSION_SECONDS)
+
+
+def invalidate_auth_context(*user_ids):
+    # contexts cached under the dropped versions are never read again and expire
+    invalidate_shared_versions(*(get_auth_version_cache_key(user_id) for user_id in user_ids))
+
+
+def create_auth_context(user_id):
+    # one join of the user with its employer and manager rows and one query of its own and group permissions
+    permission_bits = to_permission_bits(Permission.objects.filter(Q(user__id=user_id) | Q(group__user__id=user_id), content_type__app_label=get_this_app_name())
+                                         .values_list("id", flat=True).distinct())
+    user = User.objects.filter(id=user_id, is_active=True).values("is_superuser", "employer__user_ptr_id", "manager__user_ptr_id", "manager__employer_id",
+                                                                   "manager__expiration_date", "employee__user_ptr_id").first()
+    if user is None:
+        return AuthContext(user_id, None, False, None, None, None, permission_bits)
+    user_type, employer_id, manager_id, expiration_date = None, None, None, None
+    if user["employer__user_ptr_id"] is not None:
+        user_type, employer_id = USER_TYPE_EMPLOYER, user["employer__user_ptr_id"]
+    elif user["manager__user_ptr_id"] is not None:
+        user_type, employer_id, manager_id = USER_TYPE_MANAGER, user["manager__employer_id"], user["manager__user_ptr_id"]
+        expiration_date = user["manager__expiration_date"].togregorian()
+    elif user["employee__user_ptr_id"] is not None:
+        user_type = USER_TYPE_EMPLOYEE
+    return AuthContext(user_id, user_type, user["is_superuser"], employer_id, manager_id, expiration_date, permission_bits)
+
+
+def get_auth_context(user_id):
+    version = get_auth_version(user_id)
+    if version is None:
+        return create_auth_context(user_id)
+    key = get_auth_context_cache_key(user_id, version)
+    context = cache.get(key)
+    if context is None:
+        context = create_auth_context(user_id)
+        cache.set(key, context, AUTH_CONTEXT_CACHE_SECONDS)
+    return context
+
+
+def get_request_auth_context(request):
+    # resolved once per request, nested checks and the view itself reuse it. users of ClaimsJWTAuthentication bring their own
+    context = getattr(request, "auth_context", None) or getattr(request.user, "auth_context", None)
+    if context is None:
+        context = get_auth_context(request.user.id) if request.user.is_authenticated else AuthContext(None, None, False, None, None, None, 0)
+        request.auth_context = context
+    return context
+
+
+def set_token_claims(token, context):
+    # permission bits as hex, a number of more than 53 bits does not survive json parsers of javascript clients
+    token["user_type"] = context.user_type
+    token["is_superuser"] = context.is_superuser
+    token["employer_id"] = context.employer_id
+    token["manager_id"] = context.manager_id
+    token["manager_expiration"] = None if context.expiration_date is None else int(context.expiration_date.timestamp())
+    token["permissions"] = format(context.permission_bits, "x")
+    token["auth_version"] = get_auth_version(context.user_id)
+    return token
+
+
+def get_token_auth_context(token):
+    """
+    the context of the claims of a token, None unless they were issued under the current auth version of the user. claims
+    are never trusted without a shared cache, a revocation in another process would not change the version seen here
+    """
+    user_id = int(token["user_id"])
+    # tokens listing permission codenames predate the bitsets
+    version = get_auth_version(user_id)
+    if version is None or token.get("auth_version") != version or not isinstance(token["permissions"], str):
+        return None
+    expiration_date = None if token["manager_expiration"] is None else datetime.fromtimestamp(token["manager_expiration"], timezone.utc)
+    return AuthContext(user_id, token["user_type"], token["is_superuser"], token["employer_id"], token["manager_id"], expiration_date,
+                       int(token["permissions"], 16))
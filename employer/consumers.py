@@ -0,0 +1,91 @@
+from urllib.parse import parse_qs
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from employer.apps import get_this_app_name
+from employer.authorization import get_auth_context
+from employer.models import User, Employee
+from employer.report_views import get_cached_employer_dashboard
+from employer.serializers import AttendeesSerializer
+from employer.utilities import DASHBOARD_PERMISSION_STR
+from employer.views import VIEW_PERMISSION_STR
+
+
+def get_dashboard_group(employer_id):
+    return "dashboard_{}".format(employer_id)
+
+
+def publish_roll_call(roll_call, employee=None):
+    """
+    sends the arrival or departure of a saved roll call to the dashboards of its employer once the transaction commits,
+    employee is loaded unless given, its workplaces are read unless prefetched
+    """
+    if employee is None:
+        employee = Employee.objects.prefetch_related("workplace").get(id=roll_call.employee_id)
+    employee.arrival = roll_call.arrival if roll_call.departure is None else roll_call.departure
+    event = {"type": "dashboard.event", "event": "arrival" if roll_call.departure is None else "departure", "employee_id": employee.id}
+    event.update(AttendeesSerializer(employee).data)
+    transaction.on_commit(lambda: async_to_sync(get_channel_layer().group_send)(get_dashboard_group(employee.employer_id), event))
+
+
+def get_dashboard_employer_id(user):
+    # the same rules as check_user_permission(VIEW_PERMISSION_STR, DASHBOARD_PERMISSION_STR)
+    if not user.is_authenticated:
+        return None
+    context = get_auth_context(user.id)
+    if not context.is_authorized() or not context.has_perms(("{}.{}_{}".format(get_this_app_name(), VIEW_PERMISSION_STR, DASHBOARD_PERMISSION_STR),)):
+        return None
+    return context.employer_id
+
+
+@database_sync_to_async
+def get_token_user(token):
+    try:
+        user_id = AccessToken(token)["user_id"]
+    except (TokenError, KeyError):
+        return AnonymousUser()
+    return User.objects.filter(id=user_id, is_active=True).first() or AnonymousUser()
+
+
+class JWTQueryStringAuthMiddleware:
+    """websockets can not send headers from browsers, the access token comes as ?token= instead"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        token = parse_qs(scope.get("query_string", b"").decode()).get("token", [None])[0]
+        scope = dict(scope, user=await get_token_user(token) if token else AnonymousUser())
+        return await self.app(scope, receive, send)
+
+
+class DashboardConsumer(AsyncJsonWebsocketConsumer):
+    """
+    sends the dashboard of the employer once on connect, then only the arrivals and departures published by publish_roll_call,
+    the client applies them to its attendee and absentee lists instead of polling get_employer_dashboard
+    """
+
+    async def connect(self):
+        self.employer_id = await database_sync_to_async(get_dashboard_employer_id)(self.scope["user"])
+        if self.employer_id is None:
+            await self.close()
+            return
+        self.group_name = get_dashboard_group(self.employer_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        dashboard = await database_sync_to_async(get_cached_employer_dashboard)(self.employer_id)
+        await self.send_json({"event": "dashboard", "dashboard": dashboard})
+
+    async def disconnect(self, code):
+        if getattr(self, "group_name", None):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def dashboard_event(self, event):
+        await self.send_json({key: value for key, value in event.items() if key != "type"})
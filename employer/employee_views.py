@@ -1,28 +1,162 @@
+import jdatetime
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.utils.timezone import localdate
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 
+from employer.consumers import publish_roll_call
 from employer.models import Employee, EmployeeRequest, RollCall, RadkanMessage, RadkanMessageViewInfo
-from employer.report_views import create_employee_total_report
+from employer.report_views import create_employees_total_report, queue_attendance_summaries, invalidate_employer_dashboard
 from employer.serializers import EmployeeDashboardSerializer, RollCallSerializer, EmployeeRequestOutputSerializer, WorkShiftPlanOutputSerializer, RollCallOutputSerializer, \
-    RadkanMessageSerializer, RollCallDepartureSerializer
-from employer.views import manage_and_create_employee_request, POST_METHOD_STR
+    RadkanMessageSerializer, RollCallDepartureSerializer, RollCallBatchSerializer
+from employer.utilities import ADD_PERMISSION_STR
+from employer.views import manage_and_create_employee_request, POST_METHOD_STR, check_user_permission
+
+ROLL_CALL_BATCH_LIMIT = getattr(settings, "ROLL_CALL_BATCH_LIMIT", 1000)
+
+
+def get_open_roll_call(employee_id, date):
+    # the employee comes along for the geofence of the departure, only the roll call is locked
+    return RollCall.objects.select_for_update(of=("self",)).select_related("employee").filter(employee_id=employee_id, date=date, arrival__isnull=False, departure__isnull=True).first()
+
+
+def close_roll_call(roll_call, data):
+    ser = RollCallDepartureSerializer(data=data, instance=roll_call, partial=True)
+    ser.is_valid(raise_exception=True)
+    return ser.save()
 
 
 @api_view([POST_METHOD_STR])
 def create_roll_call(request):
+    # a punch closes the open roll call of the day or opens a new one, decided and written under the lock of that roll call
     cpy_data = request.data.copy()
     cpy_data["employee"] = request.user.id
-    roll_calls = RollCall.objects.filter(employee_id=request.user.id, date=request.data['date'])
-    if roll_calls.exists() and roll_calls.last().departure is None:
-        ser = RollCallDepartureSerializer(data=request.data, instance=roll_calls.last(), partial=True)
-    else:
-        ser = RollCallSerializer(data=cpy_data, context={'request': request})
-    if ser.is_valid(raise_exception=True):
-        r = ser.save()
-        return Response(RollCallOutputSerializer(r).data, status=status.HTTP_201_CREATED)
-    return Response(ser.errors, status=status.HTTP_400_BAD_REQUEST)
+    with transaction.atomic():
+        open_roll_call = get_open_roll_call(request.user.id, request.data.get('date'))
+        if open_roll_call is not None:
+            r = close_roll_call(open_roll_call, request.data)
+        else:
+            ser = RollCallSerializer(data=cpy_data, context={'request': request})
+            ser.is_valid(raise_exception=True)
+            try:
+                with transaction.atomic():
+                    r = ser.save()
+            except IntegrityError:
+                # a concurrent punch opened the roll call first (unique_open_roll_call), this one is its departure
+                r = close_roll_call(get_open_roll_call(request.user.id, request.data.get('date')), request.data)
+        # backdated and corrected punches are not news for the live dashboard
+        if r.date == jdatetime.date.fromgregorian(date=localdate()):
+            publish_roll_call(r, r.employee)
+    return Response(RollCallOutputSerializer(r).data, status=status.HTTP_201_CREATED)
+
+
+def create_roll_calls_one_by_one(created, results):
+    """
+    writes the (index, roll call) pairs each in its own savepoint, the open ones a concurrent punch got ahead of are
+    answered as conflicts instead of failing the batch. returns the written pairs
+    """
+    written = []
+    for index, roll_call in created:
+        try:
+            with transaction.atomic():
+                RollCall.objects.bulk_create([roll_call])
+            written.append((index, roll_call))
+        except IntegrityError:
+            results[index] = {"index": index, "status": "conflict", "errors": {"arrival": ["another punch opened the roll call of this day meanwhile"]}}
+    return written
+
+
+def ingest_roll_calls(items, employees):
+    """
+    replays punches in the given order the way create_roll_call would, items are raw RollCallBatchSerializer data and
+    employees the ones the caller may punch for. punches are paired in memory against the open roll calls read once,
+    written with one bulk_create and one bulk_update, and answered with one result per item
+    """
+    employees = {employee.id: employee for employee in employees}
+    results = [None] * len(items)
+    punches = []
+    for index, item in enumerate(items):
+        ser = RollCallBatchSerializer(data=item, context={"employees": employees})
+        if not ser.is_valid():
+            results[index] = {"index": index, "status": "error", "errors": ser.errors}
+        elif ser.validated_data.get("employee_id") not in employees:
+            results[index] = {"index": index, "status": "error", "errors": {"employee": ["employee not found"]}}
+        else:
+            punches.append((index, ser.validated_data))
+    if not punches:
+        return results
+    with transaction.atomic():
+        open_roll_calls = {}
+        for roll_call in RollCall.objects.select_for_update().filter(employee_id__in={data["employee_id"] for _, data in punches},
+                                                                     date__in={data["date"] for _, data in punches}, arrival__isnull=False, departure__isnull=True):
+            open_roll_calls[(roll_call.employee_id, roll_call.date)] = roll_call
+        created, updated = [], {}
+        for index, data in punches:
+            key = (data["employee_id"], data["date"])
+            open_roll_call = open_roll_calls.get(key)
+            if open_roll_call is None:
+                roll_call = RollCall(employer_id=employees[data["employee_id"]].employer_id, **data)
+                created.append((index, roll_call))
+                if roll_call.arrival is not None and roll_call.departure is None:
+                    open_roll_calls[key] = roll_call
+            elif data.get("departure") is None:
+                results[index] = {"index": index, "status": "error", "errors": {"departure": ["the open roll call of this day needs a departure"]}}
+            else:
+                for field in ("departure", "departure_latitude", "departure_longitude"):
+                    if field in data:
+                        setattr(open_roll_call, field, data[field])
+                if open_roll_call.workplace_id is None:
+                    open_roll_call.workplace_id = data.get("workplace_id")
+                del open_roll_calls[key]
+                results[index] = {"index": index, "status": "departure", "roll_call": open_roll_call}
+                if open_roll_call.pk is not None:
+                    updated[open_roll_call.pk] = open_roll_call
+        try:
+            with transaction.atomic():
+                RollCall.objects.bulk_create([roll_call for _, roll_call in created])
+        except IntegrityError:
+            # a single punch racing the batch opened a roll call of one of its days first (unique_open_roll_call)
+            created = create_roll_calls_one_by_one(created, results)
+        RollCall.objects.bulk_update(updated.values(), ["departure", "departure_latitude", "departure_longitude", "workplace"])
+        for index, roll_call in created:
+            results[index] = {"index": index, "status": "arrival" if roll_call.arrival is not None else "departure", "roll_call": roll_call}
+        # bulk writes send no signals, the summaries and the dashboards are updated here once for the batch
+        written = [roll_call for _, roll_call in created] + list(updated.values())
+        queue_attendance_summaries({r.employee_id for r in written}, {r.date for r in written})
+        today = jdatetime.date.fromgregorian(date=localdate())
+        for employer_id in {employees[r.employee_id].employer_id for r in written}:
+            invalidate_employer_dashboard(employer_id)
+        for roll_call in written:
+            if roll_call.date == today:
+                publish_roll_call(roll_call, employees[roll_call.employee_id])
+    for result in results:
+        if "roll_call" in result:
+            result["roll_call"] = RollCallOutputSerializer(result["roll_call"]).data
+    return results
+
+
+@api_view([POST_METHOD_STR])
+def create_roll_calls_batch(request):
+    # punches the app kept while offline, in the order they were taken
+    if not isinstance(request.data, list) or len(request.data) > ROLL_CALL_BATCH_LIMIT:
+        return Response({"msg": "a list of at most {} roll calls is expected".format(ROLL_CALL_BATCH_LIMIT)}, status=status.HTTP_400_BAD_REQUEST)
+    items = [dict(item, employee=request.user.id) if isinstance(item, dict) else item for item in request.data]
+    employees = Employee.objects.filter(id=request.user.id).prefetch_related("workplace")
+    return Response(ingest_roll_calls(items, employees), status=status.HTTP_200_OK)
+
+
+@api_view([POST_METHOD_STR])
+@check_user_permission(ADD_PERMISSION_STR, RollCall)
+def create_employees_roll_calls_batch(request, **kwargs):
+    # punches attendance devices of the employer kept while offline, for any of its employees
+    if not isinstance(request.data, list) or len(request.data) > ROLL_CALL_BATCH_LIMIT:
+        return Response({"msg": "a list of at most {} roll calls is expected".format(ROLL_CALL_BATCH_LIMIT)}, status=status.HTTP_400_BAD_REQUEST)
+    employee_ids = {int(item["employee"]) for item in request.data if isinstance(item, dict) and str(item.get("employee")).isdigit()}
+    employees = Employee.objects.filter(employer_id=kwargs["employer"], id__in=employee_ids).prefetch_related("workplace")
+    return Response(ingest_roll_calls(request.data, employees), status=status.HTTP_200_OK)
 
 
 @api_view()
@@ -59,7 +193,7 @@ def get_employee_requests_list(request, year, month):
 @api_view()
 def get_employee_report_for_employees(request):
     employee = get_object_or_404(Employee, id=request.user.id)
-    report = create_employee_total_report(employee,request.GET)
+    report = create_employees_total_report([employee], request.GET)[0]
     return Response(report, status=status.HTTP_200_OK)
 
 
@@ -0,0 +1,185 @@
+"""
+workplaces of an employer as float coordinates in a grid of GEOFENCE_CELL_DEGREES cells. every workplace is listed in
+the cells its circle touches, so a punch is checked with a few haversine distances against the sites of its own cell.
+nearest and within distance queries walk a k-d tree of the workplace centers as unit vectors, whose straight line
+distances order the same as distances on the earth. the index also holds the workplaces of every employee. every
+process keeps the index of an employer in memory for as long as the version of it in the shared cache is unchanged,
+workplace changes drop the version and the next punch of any process rebuilds it. punches take the version a process
+read less than SHARED_VERSION_SECONDS ago without a cache read, the punches of other processes see a change after that
+long at most. with a cache private to the process the index is built for every punch
+"""
+from collections import defaultdict
+from math import radians, sin, cos, asin, sqrt, floor, degrees, pi
+
+from django.conf import settings
+
+from employer.models import Workplace, Employee
+from employer.utilities import get_shared_version, invalidate_shared_versions, SHARED_VERSION_SECONDS
+
+EARTH_RADIUS = 6371008.8
+GEOFENCE_CELL_DEGREES = getattr(settings, "GEOFENCE_CELL_DEGREES", 0.01)
+GEOFENCE_TOLERANCE = getattr(settings, "GEOFENCE_TOLERANCE", 0)
+
+
+def haversine(latitude1, longitude1, latitude2, longitude2):
+    # radians in, meters out
+    a = sin((latitude2 - latitude1) / 2) ** 2 + cos(latitude1) * cos(latitude2) * sin((longitude2 - longitude1) / 2) ** 2
+    return 2 * EARTH_RADIUS * asin(min(1.0, sqrt(a)))
+
+
+def get_cell(latitude, longitude):
+    # degrees in
+    return floor(latitude / GEOFENCE_CELL_DEGREES), floor(longitude / GEOFENCE_CELL_DEGREES)
+
+
+def get_cells(latitude, longitude, distance):
+    # cells of the bounding box of a circle, longitude degrees shrink with the cosine of the latitude
+    reach = degrees(distance / EARTH_RADIUS)
+    low = get_cell(latitude - reach, longitude - reach / max(cos(radians(latitude)), 0.01))
+    high = get_cell(latitude + reach, longitude + reach / max(cos(radians(latitude)), 0.01))
+    return [(row, column) for row in range(low[0], high[0] + 1) for column in range(low[1], high[1] + 1)]
+
+
+def to_vector(latitude, longitude):
+    # radians in, a point of the unit sphere out
+    return cos(latitude) * cos(longitude), cos(latitude) * sin(longitude), sin(latitude)
+
+
+def to_chord(distance):
+    # meters on the earth to the straight line distance of the unit sphere
+    return 2 * sin(min(distance / EARTH_RADIUS, pi) / 2)
+
+
+def build_tree(items, depth=0):
+    # items are (vector, workplace id), nodes (vector, workplace id, axis, left, right)
+    if not items:
+        return None
+    axis = depth % 3
+    items.sort(key=lambda item: item[0][axis])
+    middle = len(items) // 2
+    return items[middle][0], items[middle][1], axis, build_tree(items[:middle], depth + 1), build_tree(items[middle + 1:], depth + 1)
+
+
+def search_nearest(node, vector, workplace_ids, best):
+    # best is [squared chord, workplace id]
+    if node is None:
+        return
+    center, workplace_id, axis, left, right = node
+    if workplace_ids is None or workplace_id in workplace_ids:
+        chord = (center[0] - vector[0]) ** 2 + (center[1] - vector[1]) ** 2 + (center[2] - vector[2]) ** 2
+        if chord < best[0]:
+            best[0], best[1] = chord, workplace_id
+    difference = vector[axis] - center[axis]
+    near, far = (left, right) if difference < 0 else (right, left)
+    search_nearest(near, vector, workplace_ids, best)
+    if difference * difference < best[0]:
+        search_nearest(far, vector, workplace_ids, best)
+
+
+def search_within(node, vector, chord, workplace_ids, result):
+    if node is None:
+        return
+    center, workplace_id, axis, left, right = node
+    if (workplace_ids is None or workplace_id in workplace_ids) and \
+            (center[0] - vector[0]) ** 2 + (center[1] - vector[1]) ** 2 + (center[2] - vector[2]) ** 2 <= chord * chord:
+        result.append(workplace_id)
+    difference = vector[axis] - center[axis]
+    if difference - chord <= 0:
+        search_within(left, vector, chord, workplace_ids, result)
+    if difference + chord >= 0:
+        search_within(right, vector, chord, workplace_ids, result)
+
+
+class WorkplaceIndex:
+    """workplaces are (id, latitude, longitude, radius) and employee_workplaces (employee id, workplace id) pairs"""
+
+    def __init__(self, workplaces, employee_workplaces):
+        self.workplaces = {}
+        self.cells = defaultdict(list)
+        for workplace_id, latitude, longitude, radius in workplaces:
+            latitude, longitude = float(latitude), float(longitude)
+            self.workplaces[workplace_id] = (radians(latitude), radians(longitude), radius + GEOFENCE_TOLERANCE)
+            for cell in get_cells(latitude, longitude, radius + GEOFENCE_TOLERANCE):
+                self.cells[cell].append(workplace_id)
+        self.cells = dict(self.cells)
+        self.tree = build_tree([(to_vector(latitude, longitude), workplace_id) for workplace_id, (latitude, longitude, _) in self.workplaces.items()])
+        self.employee_workplaces = defaultdict(set)
+        for employee_id, workplace_id in employee_workplaces:
+            self.employee_workplaces[employee_id].add(workplace_id)
+        self.employee_workplaces = {employee_id: frozenset(ids) for employee_id, ids in self.employee_workplaces.items()}
+
+    def covering(self, latitude, longitude, workplace_ids=None):
+        # ids of the workplaces whose circle holds the point, among workplace_ids when given
+        point = radians(float(latitude)), radians(float(longitude))
+        result = []
+        for workplace_id in self.cells.get(get_cell(float(latitude), float(longitude)), ()):
+            if workplace_ids is not None and workplace_id not in workplace_ids:
+                continue
+            workplace_latitude, workplace_longitude, radius = self.workplaces[workplace_id]
+            if haversine(point[0], point[1], workplace_latitude, workplace_longitude) <= radius:
+                result.append(workplace_id)
+        return result
+
+    def distance(self, workplace_id, latitude, longitude):
+        # meters from the center of the workplace, the point in radians
+        workplace_latitude, workplace_longitude, _ = self.workplaces[workplace_id]
+        return haversine(latitude, longitude, workplace_latitude, workplace_longitude)
+
+    def nearest(self, latitude, longitude, workplace_ids=None):
+        # (id, meters) of the workplace with the closest center among workplace_ids, None without one
+        point = radians(float(latitude)), radians(float(longitude))
+        best = [float("inf"), None]
+        search_nearest(self.tree, to_vector(*point), workplace_ids, best)
+        return None if best[1] is None else (best[1], self.distance(best[1], *point))
+
+    def within(self, latitude, longitude, distance, workplace_ids=None):
+        # (id, meters) of the workplaces whose center is at most distance meters away, closest first
+        point = radians(float(latitude)), radians(float(longitude))
+        found = []
+        search_within(self.tree, to_vector(*point), to_chord(distance), workplace_ids, found)
+        return sorted(((workplace_id, self.distance(workplace_id, *point)) for workplace_id in found), key=lambda item: item[1])
+
+    def locate(self, employee_id, latitude, longitude):
+        # the workplace a punch belongs to, the closest of the employee's (or of all without any) whose circle holds it
+        point = radians(float(latitude)), radians(float(longitude))
+        return min(self.covering(latitude, longitude, self.employee_workplaces.get(employee_id)), key=lambda workplace_id: self.distance(workplace_id, *point),
+                   default=None)
+
+
+def get_workplace_index_version_cache_key(employer_id):
+    return "workplace_index_version_{}".format(employer_id)
+
+
+def invalidate_workplace_index(*employer_ids):
+    invalidate_shared_versions(*(get_workplace_index_version_cache_key(employer_id) for employer_id in employer_ids))
+
+
+def create_workplace_index(employer_id):
+    return WorkplaceIndex(Workplace.objects.filter(employer_id=employer_id).values_list("id", "latitude", "longitude", "radius"),
+                          Employee.workplace.through.objects.filter(employee__employer_id=employer_id).values_list("employee_id", "workplace_id"))
+
+
+# employer id: (version, index) of this process, pickling the index in and out of the cache costs more than a punch
+_workplace_indexes = {}
+
+
+def get_workplace_index(employer_id):
+    version = get_shared_version(get_workplace_index_version_cache_key(employer_id), SHARED_VERSION_SECONDS)
+    if version is None:
+        return create_workplace_index(employer_id)
+    cached = _workplace_indexes.get(employer_id)
+    if cached is None or cached[0] != version:
+        cached = _workplace_indexes[employer_id] = version, create_workplace_index(employer_id)
+    return cached[1]
+
+
+def locate_punch(employee, latitude, longitude):
+    """
+    (allowed, workplace id) of punch coordinates, employees without workplaces may punch anywhere and are only
+    tagged with a workplace of their employer. punches without coordinates (attendance devices, manual entries) are not checked
+    """
+    if latitude is None or longitude is None:
+        return True, None
+    index = get_workplace_index(employee.employer_id)
+    workplace_id = index.locate(employee.id, latitude, longitude)
+    return workplace_id is not None or employee.id not in index.employee_workplaces, workplace_id
@@ -0,0 +1,69 @@
+import csv
+import gzip
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from employer.models import RollCall
+from employer.partitions import get_year_bounds, get_current_year, detach_partition, is_partitioned, get_partition_years, get_partition_name
+
+ARCHIVED_FIELDS = ("id", "employee_id", "employer_id", "date", "arrival", "departure", "arrival_latitude", "arrival_longitude", "departure_latitude",
+                   "departure_longitude", "workplace_id")
+
+
+class Command(BaseCommand):
+    help = "writes the roll calls of closed jalali years to gzipped csv files, then detaches their postgresql partitions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("years", type=int, nargs="+")
+        parser.add_argument("--directory", default=getattr(settings, "ROLL_CALL_ARCHIVE_DIR", "archives"))
+        parser.add_argument("--drop", action="store_true", help="drop the detached partitions instead of keeping them as plain tables")
+
+    def handle(self, *args, **options):
+        current = get_current_year()
+        if any(year >= current for year in options["years"]):
+            raise CommandError("only years before %s are closed" % current)
+        os.makedirs(options["directory"], exist_ok=True)
+        for year in options["years"]:
+            path = os.path.join(options["directory"], "roll_calls_{}.csv.gz".format(year))
+            # the file is only put in place once the partition is detached, a failed year leaves neither behind
+            try:
+                with transaction.atomic():
+                    count = self.archive(year, path + ".part", options["drop"])
+            except BaseException:
+                if os.path.exists(path + ".part"):
+                    os.remove(path + ".part")
+                raise
+            os.replace(path + ".part", path)
+            self.stdout.write("{}: {} roll calls written to {}".format(year, count, path))
+            if connection.vendor != "postgresql":
+                self.stdout.write("{}: kept in the table, detaching partitions needs postgresql".format(year))
+            else:
+                self.stdout.write("{}: partition {}".format(year, "dropped" if options["drop"] else "detached"))
+
+    def archive(self, year, path, drop):
+        """writes the roll calls of year to path and detaches their partition, in the transaction of the caller"""
+        partitioned = connection.vendor == "postgresql"
+        if partitioned:
+            with connection.cursor() as cursor:
+                if not is_partitioned(cursor):
+                    raise CommandError("employer_rollcall is not partitioned, run the migrations first")
+                if year not in get_partition_years(cursor):
+                    raise CommandError("{} has no partition of its own, its rows are in the default partition".format(year))
+                # no roll call of the year changes between the export and the detach
+                cursor.execute("LOCK TABLE {} IN SHARE MODE".format(get_partition_name(year)))
+        start, end = get_year_bounds(year)
+        rows = RollCall.objects.filter(date__gte=start, date__lt=end).order_by("id").values_list(*ARCHIVED_FIELDS)
+        count = 0
+        with gzip.open(path, "wt", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(ARCHIVED_FIELDS)
+            for row in rows.iterator(chunk_size=5000):
+                writer.writerow(row)
+                count += 1
+        if partitioned:
+            with connection.cursor() as cursor:
+                detach_partition(cursor, year, drop)
+        return count
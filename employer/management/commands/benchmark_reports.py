@@ -0,0 +1,164 @@
+import json
+import platform
+import re
+import statistics
+import time
+import tracemalloc
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from employer import report_views
+from employer.models import Employer, Employee, RollCall, WorkShiftPlan, EmployeeRequest
+from employer.populate import populate_benchmark_data
+from employer.utilities import get_month_dates, DATE_FORMAT_STR
+
+
+def call_report(view, user, params, oid=None):
+    request = APIRequestFactory().get("/", params)
+    force_authenticate(request, user=user)
+    response = view(request, oid=oid) if oid is not None else view(request)
+    if response.status_code != 200:
+        raise CommandError("{} answered {}: {}".format(view.__name__, response.status_code, response.data))
+    return response
+
+
+def measure_report(view, user, params, oid=None, repeat=3):
+    """the first call fills the attendance summaries, it is kept apart from the warm calls"""
+    runs = []
+    for _ in range(repeat + 1):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            call_report(view, user, params, oid)
+            runs.append((time.perf_counter() - start, len(queries)))
+    tracemalloc.start()
+    call_report(view, user, params, oid)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    warm = runs[1:]
+    return {
+        "cold_wall_time": runs[0][0],
+        "cold_queries": runs[0][1],
+        "wall_time": statistics.median(wall_time for wall_time, _ in warm),
+        "min_wall_time": min(wall_time for wall_time, _ in warm),
+        "queries": warm[-1][1],
+        "peak_memory": peak_memory,
+    }
+
+
+def get_plan_queries(employer, employee, dates):
+    """the hot query shapes of reports, punches and request lists, each has to be answered from an index"""
+    employees = Employee.objects.filter(employer_id=employer.id)
+    employee_ids = list(employees.values_list("id", flat=True))
+    work_shift_ids = set(employees.values_list("work_shift_id", flat=True))
+    return {
+        "report_roll_calls": RollCall.objects.filter(employee_id__in=employee_ids, date__in=dates),
+        "open_roll_call": RollCall.objects.filter(employee_id=employee.id, date=dates[-1], arrival__isnull=False, departure__isnull=True),
+        "report_plans": WorkShiftPlan.objects.filter(work_shift_id__in=work_shift_ids, date__in=dates),
+        "approved_requests": EmployeeRequest.objects.filter(Q(date__in=dates) | Q(end_date__in=dates), employee_id__in=employee_ids,
+                                                           status=EmployeeRequest.STATUS_APPROVED),
+        "employer_requests": EmployeeRequest.objects.filter(employer_id=employer.id, date__gte=dates[0]),
+    }
+
+
+def is_sequential_scan(plan, table):
+    if connection.vendor == "postgresql":
+        return "Seq Scan on {}".format(table) in plan
+    return re.search(r"\bSCAN {}\b(?! USING)".format(table), plan) is not None
+
+
+def explain_query(queryset):
+    # the planner of postgres prefers sequential scans on small tables, it is asked whether an index can serve the query at all
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = queryset.explain()
+    return {"plan": plan, "sequential_scan": is_sequential_scan(plan, queryset.model._meta.db_table)}
+
+
+class Command(BaseCommand):
+    help = "seeds synthetic employers and times the attendance and leave reports on them, results are written as json"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--employer", type=int, help="benchmark an existing employer instead of seeding new data")
+        parser.add_argument("--employers", type=int, default=1)
+        parser.add_argument("--employees", type=int, default=50, help="employees of each seeded employer")
+        parser.add_argument("--year", type=int, default=1403)
+        parser.add_argument("--month", type=int, default=1)
+        parser.add_argument("--months", type=int, default=1, help="jalali months planned and reported from --month on")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--repeat", type=int, default=3, help="warm calls of each report")
+        parser.add_argument("--output", default="benchmark_reports.json")
+        parser.add_argument("--baseline", help="an earlier output, reports slower than it by more than --tolerance fail the command")
+        parser.add_argument("--tolerance", type=float, default=0.2)
+
+    def handle(self, *args, **options):
+        if options["employer"]:
+            employer = Employer.objects.get(id=options["employer"])
+        else:
+            started = time.perf_counter()
+            employer = populate_benchmark_data(options["employers"], options["employees"], options["year"], options["month"], options["months"],
+                                               options["seed"])[0]
+            self.stdout.write("seeded in %.1fs" % (time.perf_counter() - started))
+        last_month = options["month"] + options["months"] - 1
+        start = get_month_dates(options["year"], options["month"])[0]
+        end = get_month_dates(options["year"] + (last_month - 1) // 12, (last_month - 1) % 12 + 1)[-1]
+        period = {"start": start.strftime(DATE_FORMAT_STR), "end": end.strftime(DATE_FORMAT_STR)}
+        leave_month = {"year": options["year"], "month": options["month"]}
+        employee = Employee.objects.filter(employer_id=employer.id).order_by("id").first()
+        reports = {
+            "report_employees_function": (report_views.report_employees_function, period, None),
+            "get_employee_report": (report_views.get_employee_report, period, employee.id),
+            "report_employee_traffic": (report_views.report_employee_traffic, period, employee.id),
+            "report_employees_leave": (report_views.report_employees_leave, leave_month, None),
+            "report_employee_leave": (report_views.report_employee_leave, leave_month, employee.id),
+        }
+        results = {}
+        for name, (view, params, oid) in reports.items():
+            results[name] = measure_report(view, employer, params, oid, options["repeat"])
+            self.stdout.write("{}: {wall_time:.3f}s {queries} queries, cold {cold_wall_time:.3f}s {cold_queries} queries, peak {peak_memory} bytes".format(
+                name, **results[name]))
+        plans = {}
+        if connection.vendor in ("postgresql", "sqlite"):
+            for name, queryset in get_plan_queries(employer, employee, get_month_dates(options["year"], options["month"])).items():
+                plans[name] = explain_query(queryset)
+                self.stdout.write("{}: {}".format(name, "sequential scan" if plans[name]["sequential_scan"] else "index"))
+        output = {
+            "date": now().isoformat(),
+            "parameters": {key: options[key] for key in ("employers", "employees", "year", "month", "months", "seed", "repeat")},
+            "employer": employer.id,
+            "employees": Employee.objects.filter(employer_id=employer.id).count(),
+            "environment": {"python": platform.python_version(), "django": django.get_version(), "database": connection.vendor,
+                            "report_processes": report_views.REPORT_PROCESSES, "debug": settings.DEBUG},
+            "results": results,
+            "plans": plans,
+        }
+        with open(options["output"], "w") as f:
+            json.dump(output, f, indent=2)
+        self.stdout.write("written to %s" % options["output"])
+        if options["baseline"]:
+            self.compare(results, options["baseline"], options["tolerance"])
+        scans = [name for name, plan in plans.items() if plan["sequential_scan"]]
+        if scans:
+            raise CommandError("sequential scans: " + ", ".join(scans))
+
+    def compare(self, results, baseline, tolerance):
+        with open(baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            ratio = result["wall_time"] / baseline[name]["wall_time"] if baseline[name]["wall_time"] else 1
+            self.stdout.write("{}: x{:.2f} wall time, {:+d} queries".format(name, ratio, result["queries"] - baseline[name]["queries"]))
+            if ratio > 1 + tolerance or result["queries"] > baseline[name]["queries"]:
+                regressions.append(name)
+        if regressions:
+            raise CommandError("slower than the baseline: " + ", ".join(regressions))
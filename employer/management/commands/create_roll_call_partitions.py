@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from employer.partitions import ensure_partitions, is_partitioned, ROLL_CALL_PARTITION_YEARS_AHEAD
+
+
+class Command(BaseCommand):
+    help = "creates the roll call partitions of the current and the coming jalali years, meant to run from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--years-ahead", type=int, default=ROLL_CALL_PARTITION_YEARS_AHEAD)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("roll calls are only partitioned on postgresql")
+        with transaction.atomic(), connection.cursor() as cursor:
+            if not is_partitioned(cursor):
+                raise CommandError("employer_rollcall is not partitioned, run the migrations first")
+            created = ensure_partitions(cursor, options["years_ahead"])
+        self.stdout.write("created: %s" % (", ".join(map(str, created)) or "nothing"))
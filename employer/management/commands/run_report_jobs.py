@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from employer.report_jobs import run_pending_report_jobs
+from employer.report_views import build_report_job_rows
+
+
+class Command(BaseCommand):
+    help = "runs pending report jobs, keeps polling the queue unless --once is given"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="exit when the queue is empty")
+        parser.add_argument("--interval", type=float, default=5, help="seconds between polls")
+
+    def handle(self, *args, **options):
+        while True:
+            run_pending_report_jobs(build_report_job_rows)
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:22
+
+import django.db.models.deletion
+import django_jalali.db.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employer', '0017_alter_rollcall_arrival_alter_rollcall_date_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyAttendanceSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', django_jalali.db.models.jDateField()),
+                ('attend', models.IntegerField(default=0, help_text='minutes')),
+                ('absent', models.IntegerField(default=0, help_text='minutes')),
+                ('overtime', models.IntegerField(default=0, help_text='minutes')),
+                ('middle_overtime', models.IntegerField(default=0, help_text='minutes')),
+                ('first_period_early_arrival', models.IntegerField(default=0, help_text='minutes')),
+                ('first_period_late_arrival', models.IntegerField(default=0, help_text='minutes')),
+                ('first_period_early_departure', models.IntegerField(default=0, help_text='minutes')),
+                ('first_period_late_departure', models.IntegerField(default=0, help_text='minutes')),
+                ('second_period_early_arrival', models.IntegerField(default=0, help_text='minutes')),
+                ('second_period_late_arrival', models.IntegerField(default=0, help_text='minutes')),
+                ('second_period_early_departure', models.IntegerField(default=0, help_text='minutes')),
+                ('second_period_late_departure', models.IntegerField(default=0, help_text='minutes')),
+                ('burned_out', models.JSONField(default=dict)),
+                ('total_burned_out', models.IntegerField(default=0, help_text='minutes')),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='employer.employee')),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='employer.workshiftplan')),
+            ],
+            options={
+                'unique_together': {('employee', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employer', '0018_dailyattendancesummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyAttendanceSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('attend', models.IntegerField(default=0, help_text='minutes')),
+                ('absent', models.IntegerField(default=0, help_text='minutes')),
+                ('overtime', models.IntegerField(default=0, help_text='minutes')),
+                ('burned_out', models.IntegerField(default=0, help_text='minutes')),
+                ('mission', models.IntegerField(default=0, help_text='minutes')),
+                ('earned_leave', models.IntegerField(default=0, help_text='minutes')),
+                ('sick_leave', models.IntegerField(default=0, help_text='minutes')),
+                ('unpaid_leave', models.IntegerField(default=0, help_text='minutes')),
+                ('leave_count', models.PositiveIntegerField(default=0)),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='employer.employee')),
+            ],
+            options={
+                'unique_together': {('employee', 'year', 'month')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:29
+
+import django.db.models.deletion
+import django_jalali.db.models
+import employer.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employer', '0019_monthlyattendancesummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.PositiveSmallIntegerField(choices=[(1, 'گزارش کارکرد'), (2, 'گزارش تردد'), (3, 'گزارش مرخصی')])),
+                ('file_format', models.CharField(choices=[('excel', 'excel'), ('csv', 'csv'), ('json', 'json')], default='excel', max_length=10)),
+                ('parameters', models.JSONField(blank=True, default=dict)),
+                ('status', models.PositiveSmallIntegerField(choices=[(1, 'در صف'), (2, 'در حال اجرا'), (3, 'آماده'), (4, 'ناموفق')], default=1)),
+                ('file', models.FileField(blank=True, max_length=200, null=True, upload_to=employer.models.get_file_path)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('registration_date', django_jalali.db.models.jDateTimeField(auto_now_add=True)),
+                ('finish_date', django_jalali.db.models.jDateTimeField(blank=True, null=True)),
+                ('employer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='employer.employer')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='report_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employer', '0020_reportjob'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='rollcall',
+            constraint=models.UniqueConstraint(condition=models.Q(('arrival__isnull', False), ('departure__isnull', True)), fields=('employee', 'date'), name='unique_open_roll_call'),
+        ),
+    ]
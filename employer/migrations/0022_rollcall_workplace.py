@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employer', '0021_rollcall_unique_open_roll_call'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollcall',
+            name='workplace',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='employer.workplace'),
+        ),
+    ]
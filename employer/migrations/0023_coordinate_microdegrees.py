@@ -0,0 +1,57 @@
+import employer.models
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Cast, Round
+
+# (model, field, nullable) of every coordinate moved from DecimalField(17, 14) to microdegree integers
+COORDINATES = [
+    ('employeerequest', 'latitude', True),
+    ('employeerequest', 'longitude', True),
+    ('rollcall', 'arrival_latitude', True),
+    ('rollcall', 'arrival_longitude', True),
+    ('rollcall', 'departure_latitude', True),
+    ('rollcall', 'departure_longitude', True),
+    ('workplace', 'latitude', False),
+    ('workplace', 'longitude', False),
+]
+VERBOSE_NAMES = {'latitude': 'عرض جغرافیایی', 'longitude': 'طول جغرافیایی'}
+
+
+def get_verbose_name(name):
+    return VERBOSE_NAMES[name.split('_')[-1]]
+
+
+def to_microdegrees(apps, schema_editor):
+    # altering the column type in place would round the decimal degrees to whole numbers, they are copied in one update per model
+    for model_name in sorted({model_name for model_name, _, _ in COORDINATES}):
+        fields = [name for m, name, _ in COORDINATES if m == model_name]
+        apps.get_model('employer', model_name).objects.update(
+            **{name: Cast(Round(F('decimal_' + name) * employer.models.CoordinateField.MICRODEGREES), models.IntegerField()) for name in fields})
+
+
+def to_decimal_degrees(apps, schema_editor):
+    for model_name in sorted({model_name for model_name, _, _ in COORDINATES}):
+        fields = [name for m, name, _ in COORDINATES if m == model_name]
+        apps.get_model('employer', model_name).objects.update(
+            **{'decimal_' + name: Cast(F(name), models.FloatField()) / float(employer.models.CoordinateField.MICRODEGREES) for name in fields})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employer', '0022_rollcall_workplace'),
+    ]
+
+    operations = [
+        *[migrations.RenameField(model_name=model_name, old_name=name, new_name='decimal_' + name) for model_name, name, _ in COORDINATES],
+        # nullable while both columns exist, so the migration can also run backwards on filled tables
+        *[migrations.AlterField(model_name=model_name, name='decimal_' + name,
+                                field=models.DecimalField(blank=True, decimal_places=14, max_digits=17, null=True, verbose_name=get_verbose_name(name)))
+          for model_name, name, nullable in COORDINATES if not nullable],
+        *[migrations.AddField(model_name=model_name, name=name, field=employer.models.CoordinateField(blank=True, null=True, verbose_name=get_verbose_name(name)))
+          for model_name, name, _ in COORDINATES],
+        migrations.RunPython(to_microdegrees, to_decimal_degrees),
+        *[migrations.RemoveField(model_name=model_name, name='decimal_' + name) for model_name, name, _ in COORDINATES],
+        *[migrations.AlterField(model_name=model_name, name=name, field=employer.models.CoordinateField(verbose_name=get_verbose_name(name)))
+          for model_name, name, nullable in COORDINATES if not nullable],
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employer', '0023_coordinate_microdegrees'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='employeerequest',
+            index=models.Index(condition=models.Q(('status', 2)), fields=['employee', 'date'], name='approved_request_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employeerequest',
+            index=models.Index(condition=models.Q(('status', 2)), fields=['employee', 'end_date'], name='approved_request_end_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employeerequest',
+            index=models.Index(fields=['employer', 'date'], name='request_employer_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rollcall',
+            index=models.Index(fields=['employee', 'date'], name='rollcall_employee_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workshiftplan',
+            index=models.Index(fields=['work_shift', 'date'], name='workshiftplan_shift_date_idx'),
+        ),
+        # the employee index of rollcall is dropped only once rollcall_employee_date_idx can take its place
+        migrations.AlterField(
+            model_name='rollcall',
+            name='employee',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='employer.employee'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+
+from employer.partitions import partition_roll_calls
+
+
+def partition(apps, schema_editor):
+    # range partitions are a postgresql feature, other databases keep the plain table
+    if schema_editor.connection.vendor == 'postgresql':
+        partition_roll_calls(schema_editor, apps.get_model('employer', 'RollCall'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employer', '0024_alter_rollcall_employee_and_more'),
+    ]
+
+    operations = [
+        # the partitioned table serves the earlier schema as well, going back leaves it in place
+        migrations.RunPython(partition, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_employer_keys(apps, schema_editor):
+    # one update per table, every row takes the employer of its employee
+    employers = apps.get_model('employer', 'Employee').objects.filter(id=OuterRef('employee_id')).values('employer_id')[:1]
+    for model_name in ('RollCall', 'EmployeeRequest'):
+        apps.get_model('employer', model_name).objects.update(employer_id=Subquery(employers))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employer', '0025_partition_rollcall'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollcall',
+            name='employer',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='employer.employer'),
+        ),
+        migrations.AlterField(
+            model_name='employeerequest',
+            name='employer',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='employer.employer'),
+        ),
+        migrations.RunPython(copy_employer_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='rollcall',
+            index=models.Index(fields=['employer', 'date'], name='rollcall_employer_date_idx'),
+        ),
+    ]
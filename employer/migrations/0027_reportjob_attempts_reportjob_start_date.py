@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:35
+
+import django_jalali.db.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employer', '0026_rollcall_employer_alter_employeerequest_employer_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportjob',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='reportjob',
+            name='start_date',
+            field=django_jalali.db.models.jDateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,21 +1,104 @@
+import copy
 import os
 import uuid
 
 from django.contrib.auth.models import BaseUserManager, AbstractBaseUser, PermissionsMixin, _user_has_perm, _user_has_module_perms
+from django import forms
 from django.contrib.auth.models import Permission
 from django.core.exceptions import ValidationError
-from django.core.validators import MinLengthValidator, int_list_validator, MaxValueValidator
+from django.core.validators import MinLengthValidator, int_list_validator, MaxValueValidator, MinValueValidator
 from django.db import models
 from django.db.models import Q
+from django.db.models.lookups import GreaterThanOrEqual, LessThan
 from django_jalali.db import models as jmodels
 from jdatetime import timedelta
 from mptt.fields import TreeForeignKey
 from mptt.models import MPTTModel
 from phonenumber_field.modelfields import PhoneNumberField
 
+from employer.apps import get_this_app_name
 from employer.utilities import get_random_int_code, national_code_validation, mobile_validator, time_is_passed_validator, date_is_not_future_validator
 
 
+class CoordinateField(models.IntegerField):
+    """
+    latitude or longitude in float degrees, stored as a 4 byte integer of microdegrees (about 11cm on the ground)
+    instead of a 17 digit decimal
+    """
+    MICRODEGREES = 1000000
+    default_validators = [MinValueValidator(-180), MaxValueValidator(180)]
+    default_error_messages = {"invalid": "“%(value)s” value must be a number."}
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else value / self.MICRODEGREES
+
+    def to_python(self, value):
+        if value is None:
+            return value
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise ValidationError(self.error_messages["invalid"], code="invalid", params={"value": value})
+
+    def get_prep_value(self, value):
+        value = models.Field.get_prep_value(self, value)
+        return None if value is None else round(float(value) * self.MICRODEGREES)
+
+    def formfield(self, **kwargs):
+        return super().formfield(**{"form_class": forms.FloatField, **kwargs})
+
+
+# the integer field versions round float bounds up to whole numbers before get_prep_value
+CoordinateField.register_lookup(GreaterThanOrEqual)
+CoordinateField.register_lookup(LessThan)
+
+
+def get_snapshot_value(value):
+    # json values are changed in place, the snapshot keeps a copy of its own
+    return copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+
+
+class ChangeTrackingMixin:
+    """
+    keeps the values of the fields a row was loaded with, so a save can tell what changed without reading the row again.
+    fields loaded later (deferred ones, refresh_from_db) are added when they load and saves take their values as the new base.
+    only the models whose changes are audited use it, rows written in bulk (roll calls, messages, tickets) are not worth
+    a copy of every loaded value. untracked_fields are secrets, never snapshotted nor written to the audit log
+    """
+    untracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # field_names are the attnames of the loaded columns, in the order of values
+        instance = super().from_db(db, field_names, values)
+        instance._field_snapshot = {attname: get_snapshot_value(value) for attname, value in zip(field_names, values) if attname not in cls.untracked_fields}
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self.snapshot_fields(fields)
+
+    def get_attnames(self, field_names):
+        return {self._meta.get_field(name).attname for name in field_names}
+
+    def snapshot_fields(self, field_names=None):
+        attnames = None if field_names is None else self.get_attnames(field_names)
+        snapshot = self.__dict__.setdefault("_field_snapshot", {})
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__ and field.attname not in self.untracked_fields and (attnames is None or field.attname in attnames):
+                snapshot[field.attname] = get_snapshot_value(self.__dict__[field.attname])
+
+    def get_loaded_value(self, attname, default=None):
+        # the value attname was loaded or last saved with
+        return self.__dict__.get("_field_snapshot", {}).get(attname, default)
+
+    def get_field_changes(self, field_names=None):
+        """{attname: [old, new]} of the fields changed since they were loaded or saved, among field_names when given"""
+        attnames = None if field_names is None else self.get_attnames(field_names)
+        return {attname: [old, self.__dict__[attname]] for attname, old in self.__dict__.get("_field_snapshot", {}).items()
+                if attname in self.__dict__ and self.__dict__[attname] != old and (attnames is None or attname in attnames)}
+
+
 class LegalEntityType(models.Model):
     name = models.CharField(max_length=250)
 
@@ -32,6 +115,8 @@ def get_file_path(instance, filename, ):
         main_folder = 'EmployeeImage/'
     elif isinstance(instance, EmployeeRequest):
         main_folder = 'SickLeaveRequestFiles/'
+    elif isinstance(instance, ReportJob):
+        main_folder = 'ReportFiles/'
     else:
         raise Exception("unhandled model type used get_file_path() method")
     return os.path.join(main_folder + subfolder, filename)
@@ -61,7 +146,8 @@ class CustomUserManager(BaseUserManager):
         return user
 
 
-class User(AbstractBaseUser, PermissionsMixin):
+class User(ChangeTrackingMixin, AbstractBaseUser, PermissionsMixin):
+    untracked_fields = ("password",)
     # fixme password wont hash if inserted from simple-admins
     # email = models.EmailField(
     #     verbose_name='email address',
@@ -90,6 +176,10 @@ class User(AbstractBaseUser, PermissionsMixin):
     def has_perm(self, perm, obj=None):
         if self.is_active and self.is_superuser:
             return True
+        if obj is None and perm.startswith(get_this_app_name() + "."):
+            # a bit test on the cached context instead of loading every permission of the user
+            from employer.authorization import get_auth_context
+            return self.is_active and get_auth_context(self.id).has_perms((perm,))
         return _user_has_perm(self, perm, obj)
 
     def has_module_perms(self, app_label):
@@ -158,7 +248,8 @@ class Employer(User):
     #     permissions = [("","")]
 
 
-class MelliSMSInfo(models.Model):
+class MelliSMSInfo(ChangeTrackingMixin, models.Model):
+    untracked_fields = ("melli_sms_password",)
     employer = models.OneToOneField(Employer, on_delete=models.CASCADE)
     melli_sms_username = models.CharField(max_length=250)
     melli_sms_password = models.CharField(max_length=250)
@@ -187,17 +278,19 @@ class MelliSMSInfo(models.Model):
 #     is_online = models.BooleanField(null=True, blank=True, default=True, choices=STATUS_CHOICES, verbose_name='وضعیت دستگاه')
 
 
-class Workplace(models.Model):
+class Workplace(ChangeTrackingMixin, models.Model):
     employer = models.ForeignKey(Employer, on_delete=models.PROTECT)
     name = models.CharField(max_length=250)
     city = models.CharField(max_length=250)
     address = models.TextField(null=True, blank=True, )
     radius = models.PositiveSmallIntegerField(default=50, verbose_name="شعاع(متر)")
-    latitude = models.DecimalField(max_digits=17, decimal_places=14, verbose_name='عرض جغرافیایی')
-    longitude = models.DecimalField(max_digits=17, decimal_places=14, verbose_name='طول جغرافیایی')
+    latitude = CoordinateField(verbose_name='عرض جغرافیایی')
+    longitude = CoordinateField(verbose_name='طول جغرافیایی')
 
 
-class RTSP(models.Model):
+class RTSP(ChangeTrackingMixin, models.Model):
+    # the link carries the camera credentials
+    untracked_fields = ("rtsp_link",)
     employer = models.ForeignKey(Employer, on_delete=models.PROTECT)
     workplace = models.ForeignKey(Workplace, on_delete=models.PROTECT)
     rtsp_link = models.TextField()
@@ -212,7 +305,7 @@ class RTSP(models.Model):
     traffic_type = models.PositiveSmallIntegerField(choices=TRAFFIC_CHOICES)
 
 
-class WorkPolicy(models.Model):
+class WorkPolicy(ChangeTrackingMixin, models.Model):
     employer = models.ForeignKey(Employer, on_delete=models.PROTECT)
     name = models.CharField(max_length=250)
     description = models.TextField(null=True, blank=True)
@@ -221,7 +314,7 @@ class WorkPolicy(models.Model):
         return self.name
 
 
-class BasePolicy(models.Model):
+class BasePolicy(ChangeTrackingMixin, models.Model):
     work_policy = models.OneToOneField(WorkPolicy, on_delete=models.CASCADE)
     maximum_hour_per_year = models.PositiveSmallIntegerField(help_text="minutes")
     maximum_minute_per_year = models.PositiveSmallIntegerField(help_text="minutes", validators=[MaxValueValidator(59)])
@@ -232,7 +325,7 @@ class BasePolicy(models.Model):
         abstract = True
 
 
-class ManualTrafficPolicy(models.Model):
+class ManualTrafficPolicy(ChangeTrackingMixin, models.Model):
     employer = models.ForeignKey(Employer, on_delete=models.PROTECT)
     work_policy = models.OneToOneField(WorkPolicy, on_delete=models.PROTECT)
     maximum_per_year = models.PositiveSmallIntegerField()
@@ -292,7 +385,7 @@ class WorkMissionPolicy(LeavePolicy):
     employer = models.ForeignKey(Employer, on_delete=models.PROTECT)
 
 
-class Holiday(models.Model):
+class Holiday(ChangeTrackingMixin, models.Model):
     employer = models.ForeignKey(Employer, on_delete=models.PROTECT)
     name = models.CharField(max_length=250)
     date = jmodels.jDateField()
@@ -304,7 +397,7 @@ class Holiday(models.Model):
         unique_together = (("employer", "date"),)
 
 
-class WorkShift(models.Model):
+class WorkShift(ChangeTrackingMixin, models.Model):
     employer = models.ForeignKey(Employer, on_delete=models.PROTECT)
     name = models.CharField(max_length=250)
     maximum_shiftless_day_overtime = models.PositiveSmallIntegerField(help_text="minutes")
@@ -315,7 +408,7 @@ class WorkShift(models.Model):
         permissions = (("view_report", "Can view report"),)
 
 
-class WorkShiftPlan(models.Model):
+class WorkShiftPlan(ChangeTrackingMixin, models.Model):
     employer = models.ForeignKey(Employer, on_delete=models.PROTECT)
     work_shift = models.ForeignKey(WorkShift, on_delete=models.CASCADE)
     date = jmodels.jDateField()
@@ -349,6 +442,12 @@ class WorkShiftPlan(models.Model):
     # class Meta:
     #     unique_together=("work_shift", "date")
 
+    class Meta:
+        indexes = [
+            # plans of the work shifts of a report period, and the dashboard plans of today
+            models.Index(fields=("work_shift", "date"), name="workshiftplan_shift_date_idx"),
+        ]
+
 
 class Employee(User):
     employer_id = models.PositiveIntegerField()
@@ -379,8 +478,13 @@ class Employee(User):
 #     name = models.CharField(max_length=250)
 
 
-class EmployeeRequest(models.Model):
-    employer = models.ForeignKey(Employer, on_delete=models.PROTECT, null=True, blank=True)
+# the Meta of EmployeeRequest can not see the constants of its class body, its partial indexes name this one
+EMPLOYEE_REQUEST_STATUS_APPROVED = 2
+
+
+class EmployeeRequest(ChangeTrackingMixin, models.Model):
+    # copied from the employee on save so employer lists scan this table alone, request_employer_date_idx leads with it
+    employer = models.ForeignKey(Employer, on_delete=models.PROTECT, null=True, blank=True, db_index=False)
     CATEGORY_MANUAL_TRAFFIC = 1
     CATEGORY_HOURLY_EARNED_LEAVE = 2
     CATEGORY_DAILY_EARNED_LEAVE = 3
@@ -395,6 +499,8 @@ class EmployeeRequest(models.Model):
     CATEGORY_SHIFT_ROTATION = 12
     HOURLY_REQUESTS_LIST = [CATEGORY_HOURLY_MISSION, CATEGORY_HOURLY_EARNED_LEAVE, CATEGORY_HOURLY_UNPAID_LEAVE, CATEGORY_HOURLY_SICK_LEAVE, ]
     DAILY_REQUESTS_LIST = [CATEGORY_DAILY_EARNED_LEAVE, CATEGORY_DAILY_MISSION, CATEGORY_DAILY_SICK_LEAVE, CATEGORY_DAILY_UNPAID_LEAVE]
+    LEAVE_REQUESTS_LIST = [CATEGORY_HOURLY_EARNED_LEAVE, CATEGORY_DAILY_EARNED_LEAVE, CATEGORY_HOURLY_SICK_LEAVE, CATEGORY_DAILY_SICK_LEAVE,
+                           CATEGORY_HOURLY_UNPAID_LEAVE, CATEGORY_DAILY_UNPAID_LEAVE, ]
 
     CATEGORY_CHOICES = {
         CATEGORY_MANUAL_TRAFFIC: "تردد دستی",
@@ -417,7 +523,7 @@ class EmployeeRequest(models.Model):
     registration_date = jmodels.jDateField(auto_now_add=True)
 
     STATUS_UNDER_REVIEW = 1
-    STATUS_APPROVED = 2
+    STATUS_APPROVED = EMPLOYEE_REQUEST_STATUS_APPROVED
     STATUS_REJECTED = 3
     STATUS_CHOICES = {
         STATUS_UNDER_REVIEW: "در دست بررسی",
@@ -438,12 +544,21 @@ class EmployeeRequest(models.Model):
     # from_time = models.TimeField(null=True, blank=True)
     manual_traffic_type = models.PositiveSmallIntegerField(choices=TRAFFIC_CHOICES, null=True, blank=True)
     to_time = models.TimeField(null=True, blank=True)
-    latitude = models.DecimalField(max_digits=17, decimal_places=14, verbose_name='عرض جغرافیایی', null=True, blank=True)
-    longitude = models.DecimalField(max_digits=17, decimal_places=14, verbose_name='طول جغرافیایی', null=True, blank=True)
+    latitude = CoordinateField(verbose_name='عرض جغرافیایی', null=True, blank=True)
+    longitude = CoordinateField(verbose_name='طول جغرافیایی', null=True, blank=True)
     attachment = models.FileField(upload_to=get_file_path, max_length=200, null=True, blank=True)
     project = models.ForeignKey("Project", on_delete=models.PROTECT, null=True, blank=True)
     other_employee = models.ForeignKey("Employee", related_name="other_employee", on_delete=models.PROTECT, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # reports only read approved requests, by the day they start or end in the period
+            models.Index(fields=("employee", "date"), condition=Q(status=EMPLOYEE_REQUEST_STATUS_APPROVED), name="approved_request_date_idx"),
+            models.Index(fields=("employee", "end_date"), condition=Q(status=EMPLOYEE_REQUEST_STATUS_APPROVED), name="approved_request_end_date_idx"),
+            # request lists of an employer filtered by period
+            models.Index(fields=("employer", "date"), name="request_employer_date_idx"),
+        ]
+
     def clean(self):
         # todo add CATEGORY_PROJECT_MANUAL_TRAFFIC validations
         if self.category == self.CATEGORY_MANUAL_TRAFFIC:
@@ -495,14 +610,14 @@ class EmployeeRequest(models.Model):
 
 
 
-class Project(models.Model):
+class Project(ChangeTrackingMixin, models.Model):
     employer = models.ForeignKey(Employer, on_delete=models.PROTECT)
     name = models.CharField(max_length=250)
     status = models.BooleanField()
     employees = models.ManyToManyField(Employee)
 
 
-class WorkCategory(MPTTModel):
+class WorkCategory(ChangeTrackingMixin, MPTTModel):
     employer = models.ForeignKey(Employer, on_delete=models.PROTECT)
     name = models.CharField(max_length=250)
     parent = TreeForeignKey("self", related_name='children', on_delete=models.PROTECT, null=True, blank=True)
@@ -512,7 +627,7 @@ class WorkCategory(MPTTModel):
         order_insertion_by = ['name']
 
 
-class RadkanMessage(models.Model):
+class RadkanMessage(ChangeTrackingMixin, models.Model):
     employer = models.ForeignKey(Employer, on_delete=models.PROTECT)
     title = models.CharField(max_length=250)
     description = models.TextField()
@@ -587,11 +702,115 @@ class TicketConversation(models.Model):
 
 
 class RollCall(models.Model):
-    employee = models.ForeignKey(Employee, on_delete=models.PROTECT)
+    # rollcall_employee_date_idx leads with the employee, a separate index on it would only grow the largest table
+    employee = models.ForeignKey(Employee, on_delete=models.PROTECT, db_index=False)
+    # copied from the employee on save like EmployeeRequest.employer
+    employer = models.ForeignKey(Employer, on_delete=models.PROTECT, null=True, blank=True, db_index=False)
     date = jmodels.jDateField(validators=[date_is_not_future_validator])
     arrival = models.TimeField(null=True, blank=True, validators=[time_is_passed_validator, ])
     departure = models.TimeField(null=True, blank=True, validators=[time_is_passed_validator, ])
-    arrival_latitude = models.DecimalField(max_digits=17, decimal_places=14, verbose_name='عرض جغرافیایی', null=True, blank=True)
-    arrival_longitude = models.DecimalField(max_digits=17, decimal_places=14, verbose_name='طول جغرافیایی', null=True, blank=True)
-    departure_latitude = models.DecimalField(max_digits=17, decimal_places=14, verbose_name='عرض جغرافیایی', null=True, blank=True)
-    departure_longitude = models.DecimalField(max_digits=17, decimal_places=14, verbose_name='طول جغرافیایی', null=True, blank=True)
+    arrival_latitude = CoordinateField(verbose_name='عرض جغرافیایی', null=True, blank=True)
+    arrival_longitude = CoordinateField(verbose_name='طول جغرافیایی', null=True, blank=True)
+    departure_latitude = CoordinateField(verbose_name='عرض جغرافیایی', null=True, blank=True)
+    departure_longitude = CoordinateField(verbose_name='طول جغرافیایی', null=True, blank=True)
+    # the site the punch was tagged with, deleting a workplace keeps the history of its roll calls
+    workplace = models.ForeignKey(Workplace, on_delete=models.SET_NULL, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # the punch of an employee with an open roll call is its departure, two concurrent punches must not open two of them
+            models.UniqueConstraint(fields=("employee", "date"), condition=Q(arrival__isnull=False, departure__isnull=True), name="unique_open_roll_call"),
+        ]
+        # open roll calls of a punch or the dashboard are found through the partial unique_open_roll_call index
+        indexes = [
+            models.Index(fields=("employee", "date"), name="rollcall_employee_date_idx"),
+            models.Index(fields=("employer", "date"), name="rollcall_employer_date_idx"),
+        ]
+
+
+class DailyAttendanceSummary(models.Model):
+    # stored DailyStatus of one employee day, refreshed by signals when its roll calls, requests or plan change
+    STATUS_FIELDS = ("attend", "absent", "overtime", "middle_overtime",
+                     "first_period_early_arrival", "first_period_late_arrival", "first_period_early_departure", "first_period_late_departure",
+                     "second_period_early_arrival", "second_period_late_arrival", "second_period_early_departure", "second_period_late_departure",
+                     "burned_out", "total_burned_out",)
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE)
+    plan = models.ForeignKey(WorkShiftPlan, on_delete=models.CASCADE)
+    date = jmodels.jDateField()
+    attend = models.IntegerField(default=0, help_text="minutes")
+    absent = models.IntegerField(default=0, help_text="minutes")
+    overtime = models.IntegerField(default=0, help_text="minutes")
+    middle_overtime = models.IntegerField(default=0, help_text="minutes")
+    first_period_early_arrival = models.IntegerField(default=0, help_text="minutes")
+    first_period_late_arrival = models.IntegerField(default=0, help_text="minutes")
+    first_period_early_departure = models.IntegerField(default=0, help_text="minutes")
+    first_period_late_departure = models.IntegerField(default=0, help_text="minutes")
+    second_period_early_arrival = models.IntegerField(default=0, help_text="minutes")
+    second_period_late_arrival = models.IntegerField(default=0, help_text="minutes")
+    second_period_early_departure = models.IntegerField(default=0, help_text="minutes")
+    second_period_late_departure = models.IntegerField(default=0, help_text="minutes")
+    burned_out = models.JSONField(default=dict)
+    total_burned_out = models.IntegerField(default=0, help_text="minutes")
+
+    class Meta:
+        unique_together = (("employee", "date"),)
+
+
+class MonthlyAttendanceSummary(models.Model):
+    # per Jalali month rollup of DailyAttendanceSummary and approved requests, yearly figures are a sum of at most 12 rows
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE)
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    attend = models.IntegerField(default=0, help_text="minutes")
+    absent = models.IntegerField(default=0, help_text="minutes")
+    overtime = models.IntegerField(default=0, help_text="minutes")
+    burned_out = models.IntegerField(default=0, help_text="minutes")
+    mission = models.IntegerField(default=0, help_text="minutes")
+    earned_leave = models.IntegerField(default=0, help_text="minutes")
+    sick_leave = models.IntegerField(default=0, help_text="minutes")
+    unpaid_leave = models.IntegerField(default=0, help_text="minutes")
+    leave_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (("employee", "year", "month"),)
+
+
+class ReportJob(models.Model):
+    employer = models.ForeignKey(Employer, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="report_jobs")
+    CATEGORY_FUNCTION = 1
+    CATEGORY_TRAFFIC = 2
+    CATEGORY_LEAVE = 3
+    CATEGORY_CHOICES = {
+        CATEGORY_FUNCTION: "گزارش کارکرد",
+        CATEGORY_TRAFFIC: "گزارش تردد",
+        CATEGORY_LEAVE: "گزارش مرخصی",
+    }
+    category = models.PositiveSmallIntegerField(choices=CATEGORY_CHOICES, )
+    FORMAT_CHOICES = {
+        "excel": "excel",
+        "csv": "csv",
+        "json": "json",
+    }
+    file_format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default="excel")
+    parameters = models.JSONField(default=dict, blank=True)
+    STATUS_PENDING = 1
+    STATUS_RUNNING = 2
+    STATUS_DONE = 3
+    STATUS_FAILED = 4
+    STATUS_CHOICES = {
+        STATUS_PENDING: "در صف",
+        STATUS_RUNNING: "در حال اجرا",
+        STATUS_DONE: "آماده",
+        STATUS_FAILED: "ناموفق",
+    }
+    status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES, default=STATUS_PENDING)
+    file = models.FileField(upload_to=get_file_path, max_length=200, null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    registration_date = jmodels.jDateTimeField(auto_now_add=True)
+    start_date = jmodels.jDateTimeField(null=True, blank=True)
+    finish_date = jmodels.jDateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return "{} {}".format(self.get_category_display(), self.registration_date)
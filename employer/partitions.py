@@ -0,0 +1,129 @@
+"""
+on postgresql employer_rollcall is range partitioned by jalali year on its date column, one table per year plus a
+default partition for the rows of years nobody created a partition for yet. partitions of the coming years are created
+after every migrate and by `manage.py create_roll_call_partitions` from cron, which also move rows out of the default
+partition. reports prune to the partitions of their period, vacuum works on the current year only and closed years can
+be detached by `manage.py archive_roll_calls`. other databases keep the plain table
+"""
+import jdatetime
+from django.conf import settings
+from django.utils.timezone import localdate
+
+ROLL_CALL_TABLE = "employer_rollcall"
+DEFAULT_PARTITION = ROLL_CALL_TABLE + "_default"
+ROLL_CALL_PARTITION_YEARS_AHEAD = getattr(settings, "ROLL_CALL_PARTITION_YEARS_AHEAD", 1)
+
+
+def get_partition_name(year):
+    return "{}_{}".format(ROLL_CALL_TABLE, year)
+
+
+def get_year_bounds(year):
+    # the gregorian dates stored in the column, a jalali year runs up to farvardin 1 of the next one
+    return jdatetime.date(year, 1, 1).togregorian(), jdatetime.date(year + 1, 1, 1).togregorian()
+
+
+def get_current_year():
+    return jdatetime.date.fromgregorian(date=localdate()).year
+
+
+def is_partitioned(cursor):
+    cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s AND relkind IN ('r', 'p')", [ROLL_CALL_TABLE])
+    row = cursor.fetchone()
+    return row is not None and row[0] == "p"
+
+
+def get_partition_years(cursor):
+    cursor.execute("SELECT child.relname FROM pg_inherits JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                   "JOIN pg_class child ON child.oid = pg_inherits.inhrelid WHERE parent.relname = %s", [ROLL_CALL_TABLE])
+    return sorted(int(name.rsplit("_", 1)[1]) for name, in cursor.fetchall() if name != DEFAULT_PARTITION)
+
+
+def create_partition(cursor, year):
+    """
+    attaches the partition of a jalali year, rows the default partition took for it meanwhile are moved in first.
+    the default partition stays locked until the transaction ends so no new row of the year slips into it
+    """
+    start, end = get_year_bounds(year)
+    name = get_partition_name(year)
+    cursor.execute("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE".format(DEFAULT_PARTITION))
+    cursor.execute("CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)".format(name, ROLL_CALL_TABLE))
+    cursor.execute("WITH moved AS (DELETE FROM {} WHERE date >= %s AND date < %s RETURNING *) INSERT INTO {} SELECT * FROM moved".format(DEFAULT_PARTITION, name),
+                   [start, end])
+    # bounds are dates formatted here, ddl does not take bound parameters on every driver
+    cursor.execute("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM ('{}') TO ('{}')".format(ROLL_CALL_TABLE, name, start.isoformat(), end.isoformat()))
+
+
+def get_default_partition_years(cursor):
+    # jalali years of the rows that landed in the default partition
+    cursor.execute("SELECT min(date), max(date) FROM {}".format(DEFAULT_PARTITION))
+    first, last = cursor.fetchone()
+    if first is None:
+        return []
+    return list(range(jdatetime.date.fromgregorian(date=first).year, jdatetime.date.fromgregorian(date=last).year + 1))
+
+
+def ensure_partitions(cursor, years_ahead=ROLL_CALL_PARTITION_YEARS_AHEAD):
+    """
+    partitions of the current jalali year, the next years_ahead ones and of every year with rows in the default
+    partition, whose rows are moved in. returns the created years
+    """
+    existing = set(get_partition_years(cursor))
+    current = get_current_year()
+    years = set(range(current, current + years_ahead + 1)) | set(get_default_partition_years(cursor))
+    created = sorted(year for year in years if year not in existing)
+    for year in created:
+        create_partition(cursor, year)
+    return created
+
+
+def detach_partition(cursor, year, drop=False):
+    name = get_partition_name(year)
+    if year not in get_partition_years(cursor):
+        raise ValueError("{} has no partition of its own".format(year))
+    cursor.execute("ALTER TABLE {} DETACH PARTITION {}".format(ROLL_CALL_TABLE, name))
+    if drop:
+        cursor.execute("DROP TABLE {}".format(name))
+
+
+def partition_roll_calls(schema_editor, model):
+    """
+    rebuilds the plain employer_rollcall as a partitioned table, with a partition for every jalali year from its first
+    roll call on. the primary key becomes (id, date) since postgresql needs the partition key in every unique index,
+    ids keep coming from one sequence so they stay unique on their own
+    """
+    with schema_editor.connection.cursor() as cursor:
+        if is_partitioned(cursor):
+            return
+        cursor.execute("SELECT min(date) FROM {}".format(ROLL_CALL_TABLE))
+        first = cursor.fetchone()[0]
+    current = get_current_year()
+    first_year = jdatetime.date.fromgregorian(date=first).year if first else current
+    old_table = ROLL_CALL_TABLE + "_unpartitioned"
+    schema_editor.execute("ALTER TABLE {} RENAME TO {}".format(ROLL_CALL_TABLE, old_table))
+    schema_editor.execute("CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE (date)".format(ROLL_CALL_TABLE, old_table))
+    schema_editor.execute("CREATE TABLE {} PARTITION OF {} DEFAULT".format(DEFAULT_PARTITION, ROLL_CALL_TABLE))
+    for year in range(first_year, current + ROLL_CALL_PARTITION_YEARS_AHEAD + 1):
+        start, end = get_year_bounds(year)
+        schema_editor.execute("CREATE TABLE {} PARTITION OF {} FOR VALUES FROM ('{}') TO ('{}')".format(
+            get_partition_name(year), ROLL_CALL_TABLE, start.isoformat(), end.isoformat()))
+    schema_editor.execute("INSERT INTO {} SELECT * FROM {}".format(ROLL_CALL_TABLE, old_table))
+    # the old identity sequence, indexes and foreign keys go with the old table and are created again on the new one
+    schema_editor.execute("DROP TABLE {}".format(old_table))
+    sequence = ROLL_CALL_TABLE + "_id_seq"
+    schema_editor.execute("CREATE SEQUENCE {} OWNED BY {}.id".format(sequence, ROLL_CALL_TABLE))
+    schema_editor.execute("SELECT setval('{}', COALESCE((SELECT max(id) FROM {}), 0) + 1, false)".format(sequence, ROLL_CALL_TABLE))
+    schema_editor.execute("ALTER TABLE {} ALTER COLUMN id SET DEFAULT nextval('{}')".format(ROLL_CALL_TABLE, sequence))
+    schema_editor.execute("ALTER TABLE {} ADD CONSTRAINT {}_pkey PRIMARY KEY (id, date)".format(ROLL_CALL_TABLE, ROLL_CALL_TABLE))
+    for field in model._meta.concrete_fields:
+        if field.remote_field is not None:
+            target = field.target_field
+            schema_editor.execute("ALTER TABLE {table} ADD CONSTRAINT {table}_{column}_fk FOREIGN KEY ({column}) REFERENCES {target_table} ({target_column}) "
+                                  "DEFERRABLE INITIALLY DEFERRED".format(table=ROLL_CALL_TABLE, column=field.column, target_table=target.model._meta.db_table,
+                                                                         target_column=target.column))
+            if field.db_index:
+                schema_editor.execute("CREATE INDEX {table}_{column}_idx ON {table} ({column})".format(table=ROLL_CALL_TABLE, column=field.column))
+    for index in model._meta.indexes:
+        schema_editor.add_index(model, index)
+    for constraint in model._meta.constraints:
+        schema_editor.add_constraint(model, constraint)
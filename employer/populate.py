@@ -4,19 +4,21 @@ from datetime import timedelta
 
 from django.utils.timezone import now
 
-from employer.models import RollCall
+from employer.models import RollCall, Employer, WorkPolicy, EarnedLeavePolicy, WorkShift, WorkShiftPlan, Employee, EmployeeRequest, User
 from employer.serializers import WorkShiftPlanUpdateSerializer
-from employer.utilities import DATE_FORMAT_STR
+from employer.utilities import DATE_FORMAT_STR, get_month_dates
 
 
 def populate_roll_call(employee_id):
     samples = []
     klas = RollCall
+    employer_id = Employee.objects.values_list("employer_id", flat=True).get(id=employee_id)
     first_date = now().date()
     for i in range(3):
         hour = 8 + random.randint(1, 4)
         minute = random.randint(1, 50)
         samples.append(klas(
+            employer_id=employer_id,
             employee_id=employee_id,
             date=first_date + timedelta(days=i),
             arrival=datetime.time(hour, minute, 0),
@@ -68,3 +70,103 @@ def populate_shift_plans(request, workshift_id=1):
         ser.save()
     else:
         print(ser.errors)
+
+
+BENCHMARK_USERNAME = "benchmark"
+BULK_CREATE_BATCH_SIZE = 2000
+# (name, plan fields) of the synthetic work shifts, employees are spread over them in turn
+BENCHMARK_SHIFTS = (
+    ("one period", dict(first_period_start=datetime.time(8), first_period_end=datetime.time(16), beginning_overtime=30, ending_overtime=60)),
+    ("two periods", dict(first_period_start=datetime.time(8), first_period_end=datetime.time(12), second_period_start=datetime.time(13),
+                         second_period_end=datetime.time(17), beginning_overtime=30, middle_overtime=20, ending_overtime=60)),
+    ("floating", dict(plan_type=WorkShiftPlan.FLOATING_PLAN_TYPE, daily_duty_duration=480)),
+    # periods that cross midnight are not calculated by the reports yet, night plans end before it
+    ("night", dict(is_night_shift=True, first_period_start=datetime.time(15), first_period_end=datetime.time(23), ending_overtime=30)),
+)
+
+
+def shift_time(time, minutes):
+    minute = min(max(time.hour * 60 + time.minute + minutes, 0), 24 * 60 - 1)
+    return datetime.time(minute // 60, minute % 60)
+
+
+def populate_benchmark_roll_calls(rnd, employee, plan, roll_calls, requests):
+    if plan.plan_type == WorkShiftPlan.FLOATING_PLAN_TYPE:
+        arrival = datetime.time(rnd.randint(7, 10), rnd.randint(0, 59))
+        periods = [(arrival, shift_time(arrival, plan.daily_duty_duration))]
+    else:
+        periods = [(plan.first_period_start, plan.first_period_end)]
+        if plan.second_period_start is not None:
+            periods.append((plan.second_period_start, plan.second_period_end))
+    for start, end in periods:
+        arrival = shift_time(start, rnd.randint(-30, 20))
+        departure = shift_time(end, rnd.randint(-20, 60))
+        if rnd.random() < 0.03 and (start, end) == periods[-1]:
+            # a forgotten departure completed by a manual traffic request, a day has one open roll call at most
+            roll_calls.append(RollCall(employer_id=employee.employer_id, employee=employee, date=plan.date, arrival=arrival))
+            requests.append(EmployeeRequest(employer_id=employee.employer_id, employee=employee, category=EmployeeRequest.CATEGORY_MANUAL_TRAFFIC,
+                                            status=EmployeeRequest.STATUS_APPROVED, date=plan.date, time=departure, manual_traffic_type=EmployeeRequest.Logout))
+        elif rnd.random() < 0.1:
+            # a short leave in the middle of the period
+            leave = shift_time(arrival, rnd.randint(60, 120))
+            roll_calls.append(RollCall(employer_id=employee.employer_id, employee=employee, date=plan.date, arrival=arrival, departure=leave))
+            roll_calls.append(RollCall(employer_id=employee.employer_id, employee=employee, date=plan.date, arrival=shift_time(leave, rnd.randint(10, 60)), departure=departure))
+        else:
+            roll_calls.append(RollCall(employer_id=employee.employer_id, employee=employee, date=plan.date, arrival=arrival, departure=departure))
+
+
+def populate_benchmark_requests(rnd, employee, plan, requests):
+    status = EmployeeRequest.STATUS_APPROVED if rnd.random() < 0.8 else EmployeeRequest.STATUS_UNDER_REVIEW
+    if rnd.random() < 0.5 and plan.first_period_start is not None:
+        time = shift_time(plan.first_period_start, rnd.randint(60, 180))
+        requests.append(EmployeeRequest(employer_id=employee.employer_id, employee=employee, category=rnd.choice(EmployeeRequest.HOURLY_REQUESTS_LIST),
+                                        status=status, date=plan.date, time=time, to_time=shift_time(time, rnd.randint(30, 120))))
+    else:
+        requests.append(EmployeeRequest(employer_id=employee.employer_id, employee=employee, category=rnd.choice(EmployeeRequest.DAILY_REQUESTS_LIST),
+                                        status=status, date=plan.date, end_date=plan.date + timedelta(days=rnd.randint(0, 2))))
+
+
+def populate_benchmark_data(employers=1, employees=50, year=1403, month=1, months=1, seed=0):
+    """
+    synthetic employers for the report benchmark, each with one period, two period, floating and night work shifts planned
+    for every non friday day of the given jalali months, roll calls on most of those days and hourly, daily and manual
+    traffic requests on some of them. returns the created employers
+    """
+    rnd = random.Random(seed)
+    dates = [date for i in range(months) for date in get_month_dates(year + (month + i - 1) // 12, (month + i - 1) % 12 + 1)]
+    work_days = [date for date in dates if date.weekday() != 6]
+    # user ids only grow, numbering the mobiles after the last one keeps them unique across runs
+    mobile = (User.objects.order_by("-id").values_list("id", flat=True).first() or 0) + 1
+    created = []
+    for _ in range(employers):
+        employer = Employer.objects.create(mobile="0990%07d" % mobile, email="benchmark%d@radkan.ir" % mobile, username=BENCHMARK_USERNAME)
+        work_policy = WorkPolicy.objects.create(employer=employer, name=BENCHMARK_USERNAME)
+        EarnedLeavePolicy.objects.create(employer=employer, work_policy=work_policy, year=year, maximum_hour_per_year=240, maximum_minute_per_year=0,
+                                         maximum_hour_per_month=20, maximum_minute_per_month=0, maximum_daily_request_per_year=30, maximum_daily_request_per_month=3,
+                                         maximum_hourly_request_per_year=100, maximum_hourly_request_per_month=10, acceptable_daily_registration_type=EarnedLeavePolicy.BEFORE,
+                                         acceptable_daily_registration_days=1, acceptable_hourly_registration_type=EarnedLeavePolicy.BEFORE,
+                                         acceptable_hourly_registration_days=1, maximum_earned_leave_for_next_year_hour=0, maximum_earned_leave_for_next_year_minutes=0)
+        plans = {}
+        for name, fields in BENCHMARK_SHIFTS:
+            work_shift = WorkShift.objects.create(employer=employer, name=name, maximum_shiftless_day_overtime=0, year=year)
+            plans[work_shift] = WorkShiftPlan.objects.bulk_create(
+                [WorkShiftPlan(employer=employer, work_shift=work_shift, date=date, modifier=employer, daily_overtime_limit=120, permitted_delay=10,
+                               permitted_acceleration=10, floating_time=15, **fields) for date in work_days])
+        work_shifts = list(plans)
+        roll_calls = []
+        requests = []
+        for i in range(employees):
+            work_shift = work_shifts[i % len(work_shifts)]
+            employee = Employee.objects.create(mobile="0990%07d" % (mobile + i + 1), employer_id=employer.id, first_name="benchmark", last_name=str(i),
+                                               personnel_code=str(i), work_policy=work_policy, work_shift=work_shift, shift_start_date=dates[0])
+            for plan in plans[work_shift]:
+                if rnd.random() < 0.05:
+                    continue
+                populate_benchmark_roll_calls(rnd, employee, plan, roll_calls, requests)
+                if rnd.random() < 0.08:
+                    populate_benchmark_requests(rnd, employee, plan, requests)
+        RollCall.objects.bulk_create(roll_calls, batch_size=BULK_CREATE_BATCH_SIZE)
+        EmployeeRequest.objects.bulk_create(requests, batch_size=BULK_CREATE_BATCH_SIZE)
+        created.append(employer)
+        mobile += employees + 1
+    return created
@@ -0,0 +1,73 @@
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction, connection
+from django.utils.timezone import now
+
+from employer.models import ReportJob
+from employer.utilities import FILE_FORMATS
+
+# ReportJob rows are the queue, they are drained by `manage.py run_report_jobs` and by this pool of the web process when enabled
+REPORT_JOB_WORKERS = getattr(settings, "REPORT_JOB_WORKERS", 0)
+REPORT_JOB_TIMEOUT = getattr(settings, "REPORT_JOB_TIMEOUT", 60 * 60)
+REPORT_JOB_ATTEMPTS = getattr(settings, "REPORT_JOB_ATTEMPTS", 2)
+executor = ThreadPoolExecutor(max_workers=REPORT_JOB_WORKERS, thread_name_prefix="report_job") if REPORT_JOB_WORKERS else None
+
+logger = logging.getLogger(__name__)
+
+
+def recover_stale_report_jobs():
+    """jobs left running by a worker that died are queued again, or failed once they were tried REPORT_JOB_ATTEMPTS times"""
+    stale = ReportJob.objects.filter(status=ReportJob.STATUS_RUNNING, start_date__lt=now() - timedelta(seconds=REPORT_JOB_TIMEOUT))
+    failed = stale.filter(attempts__gte=REPORT_JOB_ATTEMPTS).update(status=ReportJob.STATUS_FAILED, error="interrupted", finish_date=now())
+    queued = stale.update(status=ReportJob.STATUS_PENDING)
+    if failed or queued:
+        logger.warning("recovered stale report jobs: %s queued again, %s failed", queued, failed)
+
+
+def claim_report_job():
+    with transaction.atomic():
+        job = ReportJob.objects.select_for_update(skip_locked=True).filter(status=ReportJob.STATUS_PENDING).order_by("id").first()
+        if job:
+            job.status = ReportJob.STATUS_RUNNING
+            job.start_date = now()
+            job.attempts += 1
+            job.save(update_fields=["status", "start_date", "attempts"])
+    return job
+
+
+def run_report_job(job, build_rows):
+    """build_rows(job) returns the rows of the report and a base name for its file"""
+    try:
+        rows, file_name = build_rows(job)
+        stream, extension, content_type = FILE_FORMATS[job.file_format]
+        with tempfile.TemporaryFile() as file:
+            for chunk in stream(rows):
+                file.write(chunk.encode() if isinstance(chunk, str) else chunk)
+            job.file.save("{}.{}".format(file_name, extension), File(file), save=False)
+        job.status = ReportJob.STATUS_DONE
+    except Exception as e:
+        logger.exception("report job %s failed", job.id)
+        job.status = ReportJob.STATUS_FAILED
+        job.error = str(e)
+    job.finish_date = now()
+    job.save(update_fields=["status", "file", "error", "finish_date"])
+
+
+def run_pending_report_jobs(build_rows):
+    try:
+        recover_stale_report_jobs()
+        while job := claim_report_job():
+            run_report_job(job, build_rows)
+    finally:
+        connection.close()
+
+
+def enqueue_report_job(job, build_rows):
+    # without in-process workers the job waits for `manage.py run_report_jobs`
+    if executor:
+        transaction.on_commit(lambda: executor.submit(run_pending_report_jobs, build_rows))
@@ -1,26 +1,60 @@
+import logging
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from operator import attrgetter
+
+import django
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db.models import Q, QuerySet
-from django.utils.timezone import now
+from django.db import transaction, connection
+from django.core.cache import cache
+from django.db.models import Q, Sum, Count, F, ExpressionWrapper, DurationField, Exists, OuterRef, Subquery
+from django.http import FileResponse
+from django.utils.timezone import localtime
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 
-from employer.models import Employee, RollCall, WorkShiftPlan, EmployeeRequest
-from employer.serializers import AttendeesSerializer, AbsenteesSerializer, DailyStatusSerializer
-from employer.utilities import subtract_times, calculate_roll_call_query_duration, calculate_daily_shift_duration, total_minute_to_hour_and_minutes, send_response_file, \
-    REPORT_PERMISSION_STR, calculate_hourly_request_duration, calculate_daily_request_duration, DASHBOARD_PERMISSION_STR, positive_only
+from employer.models import Employee, RollCall, WorkShiftPlan, EmployeeRequest, DailyAttendanceSummary, MonthlyAttendanceSummary, ReportJob
+from employer.report_jobs import enqueue_report_job
+from employer.serializers import AttendeesSerializer, AbsenteesSerializer, ReportJobSerializer, ReportJobOutputSerializer
+from employer.utilities import subtract_times, calculate_roll_calls_duration, calculate_daily_shift_duration, total_minute_to_hour_and_minutes, send_response_file, \
+    REPORT_PERMISSION_STR, calculate_hourly_request_duration, calculate_daily_request_duration, DASHBOARD_PERMISSION_STR, positive_only, \
+    str_to_date, get_month_dates, get_period_dates, EXPORT_CHUNK_SIZE, FILE_FORMATS, POST_METHOD_STR
 from employer.views import DATE_FORMAT_STR, check_user_permission, VIEW_PERMISSION_STR
 
+REPORT_PROCESSES = getattr(settings, "REPORT_PROCESSES", os.cpu_count() or 1)
+REPORT_PROCESS_CHUNK_SIZE = getattr(settings, "REPORT_PROCESS_CHUNK_SIZE", 250)
+DASHBOARD_CACHE_SECONDS = getattr(settings, "DASHBOARD_CACHE_SECONDS", 10)
+SUMMARY_REFRESH_WORKER = getattr(settings, "SUMMARY_REFRESH_WORKER", True)
+
+logger = logging.getLogger(__name__)
 
-class DailyStatus:
-    middle_overtime = attend = overtime = absent = 0
-    first_period_early_arrival = first_period_late_arrival = first_period_early_departure = first_period_late_departure = 0
-    second_period_early_arrival = second_period_late_arrival = second_period_early_departure = second_period_late_departure = 0
 
-    def __init__(self, plan: WorkShiftPlan):
-        self.plan: WorkShiftPlan = plan
-        self.burned_out = {}
+class DailyStatus:
+    """
+    result of one plan day, a yearly report holds one of these per employee and day so it is kept to a slotted
+    record of integers, the plan is a PlanSnapshot and burned out minutes have one counter per kind
+    """
+    STATUS_FIELDS = DailyAttendanceSummary.STATUS_FIELDS[:-2]
+    # in the order the calculators fill them, burned_out keeps that order
+    BURNED_OUT_FIELDS = ("pre_shift_overtime", "middle_shift_overtime", "past_shift_overtime", "ending_overtime", "beginning_overtime", "middle_overtime",
+                         "floating_shift_overtime")
+    __slots__ = ("plan",) + STATUS_FIELDS + tuple("burned_out_" + field for field in BURNED_OUT_FIELDS)
+    STATUS_GETTER = attrgetter(*STATUS_FIELDS)
+    BURNED_OUT_GETTER = attrgetter(*__slots__[len(STATUS_FIELDS) + 1:])
+
+    def __init__(self, plan: "PlanSnapshot"):
+        self.plan = plan
+        self.middle_overtime = self.attend = self.overtime = self.absent = 0
+        self.first_period_early_arrival = self.first_period_late_arrival = self.first_period_early_departure = self.first_period_late_departure = 0
+        self.second_period_early_arrival = self.second_period_late_arrival = self.second_period_early_departure = self.second_period_late_departure = 0
+        self.burned_out_pre_shift_overtime = self.burned_out_middle_shift_overtime = self.burned_out_past_shift_overtime = 0
+        self.burned_out_ending_overtime = self.burned_out_beginning_overtime = self.burned_out_middle_overtime = self.burned_out_floating_shift_overtime = 0
 
     def deduct_absence_from_overtimes(self):
         if self.absent > 0 and self.first_period_early_arrival + self.first_period_late_departure + self.second_period_early_arrival + self.second_period_late_departure > 0:
@@ -59,6 +93,33 @@ class DailyStatus:
     def get_weekday(self):
         return self.plan.date.jweekday()
 
+    def burn_out(self, field, minutes):
+        setattr(self, "burned_out_" + field, minutes)
+
+    @property
+    def burned_out(self):
+        return {field: minutes for field, minutes in zip(self.BURNED_OUT_FIELDS, self.BURNED_OUT_GETTER(self)) if minutes}
+
+    @property
+    def total_burned_out(self):
+        return sum(self.BURNED_OUT_GETTER(self))
+
+    def get_values(self):
+        values = dict(zip(self.STATUS_FIELDS, self.STATUS_GETTER(self)))
+        values["burned_out"] = burned_out = self.burned_out
+        values["total_burned_out"] = sum(burned_out.values())
+        return values
+
+    def get_data(self):
+        """same output as DailyStatusSerializer without going through the serializer fields"""
+        data = {"date": self.get_date(), "weekday": str(self.get_weekday())}
+        data.update(zip(self.STATUS_FIELDS, self.STATUS_GETTER(self)))
+        data["burned_out"] = self.burned_out
+        return data
+
+    def get_summary(self, employee_id):
+        return DailyAttendanceSummary(employee_id=employee_id, plan_id=self.plan.id, date=self.plan.date, **self.get_values())
+
     @positive_only
     def add_attend(self, attended):
         self.attend += attended
@@ -107,7 +168,7 @@ class DailyStatus:
             ending_overtime = min(self.second_period_late_departure, self.plan.ending_overtime)
             self.overtime += ending_overtime
             if self.second_period_late_departure - ending_overtime > 0:
-                self.burned_out["ending_overtime"] = self.second_period_late_departure - ending_overtime
+                self.burn_out("ending_overtime", self.second_period_late_departure - ending_overtime)
 
     def calculate_beginning_overtime(self):
         if self.first_period_early_arrival > 0:
@@ -115,7 +176,7 @@ class DailyStatus:
                 beginning_overtime = min(self.first_period_early_arrival, self.plan.beginning_overtime)
                 self.overtime += beginning_overtime
                 if self.first_period_early_arrival - beginning_overtime > 0:
-                    self.burned_out["beginning_overtime"] = self.first_period_early_arrival - beginning_overtime
+                    self.burn_out("beginning_overtime", self.first_period_early_arrival - beginning_overtime)
 
     def calculate_middle_overtime(self):
         if self.plan.second_period_start is not None:
@@ -125,7 +186,7 @@ class DailyStatus:
                 self.overtime += middle_overtime
                 burn_out = combined - middle_overtime
                 if burn_out > 0:
-                    self.burned_out["middle_overtime"] = burn_out
+                    self.burn_out("middle_overtime", burn_out)
 
     def calculate_all_overtimes(self):
         self.recalculate_floating_time()
@@ -141,33 +202,172 @@ class DailyStatus:
     #         self.middle_overtime += min(self.second_period_early_arrival, acceptable_overtime)
 
 
+def group_by_date(items):
+    grouped = {}
+    for item in items:
+        grouped.setdefault(item.date, []).append(item)
+    return grouped
+
+
 class ReportCrucial:
+    """
+    loads the employee rows of the report period once and indexes them by date,
+    the per day calculations only read these lists and never go back to the database
+    """
+
     def __init__(self, employee: Employee, kwargs):
-        self.date_period = [kwargs["start"], kwargs["end"]]
-        self.requests = employee.employeerequest_set.filter(Q(date__in=self.date_period) | Q(end_date__in=self.date_period), status=EmployeeRequest.STATUS_APPROVED, )
-        self.roll_calls = employee.rollcall_set.filter(~(Q(departure__isnull=True) | Q(arrival__isnull=True)), date__in=self.date_period).order_by("date")
-        self.plans = employee.work_shift.workshiftplan_set.filter(date__in=self.date_period).order_by("date")
-        self.imperfect_roll_calls = employee.rollcall_set.filter(Q(departure__isnull=True) | Q(arrival__isnull=True), date__in=self.date_period).order_by("date")
+        self.employee = employee
+        self.date_period = get_period_dates(kwargs["start"], kwargs["end"])
+        self.requests = list(employee.employeerequest_set.filter(Q(date__in=self.date_period) | Q(end_date__in=self.date_period), status=EmployeeRequest.STATUS_APPROVED, ))
+        self.plans = load_plan_snapshots(employee.work_shift.workshiftplan_set.filter(date__in=self.date_period).order_by("date"))
+        self.roll_calls = []
+        self.imperfect_roll_calls = []
+        for roll_call in employee.rollcall_set.filter(date__in=self.date_period).order_by("date", "arrival"):
+            if roll_call.arrival is None or roll_call.departure is None:
+                self.imperfect_roll_calls.append(roll_call)
+            else:
+                self.roll_calls.append(roll_call)
+        self.daily_roll_calls = group_by_date(self.roll_calls)
+        self.daily_imperfect_roll_calls = group_by_date(self.imperfect_roll_calls)
+        self.daily_requests = group_by_date(self.requests)
+
+    def get_plan_day(self, plan: WorkShiftPlan):
+        return (self.daily_roll_calls.get(plan.date, []),
+                self.daily_imperfect_roll_calls.get(plan.date, []),
+                self.daily_requests.get(plan.date, []))
+
+    def get_timeline_days(self):
+        """(plan, roll_calls, hourly_requests) of every plan day, the arguments of create_employee_daily_report"""
+        for plan in self.plans:
+            plan_roll_calls, imperfect_roll_calls, plan_requests = self.get_plan_day(plan)
+            plan_traffics = filter_requests(plan_requests, EmployeeRequest.CATEGORY_MANUAL_TRAFFIC)
+            plan_roll_calls = plan_roll_calls + calculate_total_roll_calls_and_traffics(imperfect_roll_calls, plan_traffics)
+            today_hourly_employee_requests = filter_requests(plan_requests, *EmployeeRequest.HOURLY_REQUESTS_LIST)
+            yield plan, plan_roll_calls, today_hourly_employee_requests
 
     def get_employee_timeline(self):
-        timetable = []
-        for plan in self.plans:
-            plan_roll_calls = self.roll_calls.filter(date=plan.date).order_by("arrival")
-            plan_traffics = self.requests.filter(date=plan.date, category=EmployeeRequest.CATEGORY_MANUAL_TRAFFIC)
-            plan_roll_calls = list(plan_roll_calls).extend(
-                calculate_total_roll_calls_and_traffics(self.imperfect_roll_calls.filter(date=plan.date).order_by("arrival"), plan_traffics))
-            today_hourly_employee_requests = self.requests.filter(category__in=EmployeeRequest.HOURLY_REQUESTS_LIST)
-            stat = create_employee_daily_report(plan, plan_roll_calls, today_hourly_employee_requests)
-            timetable.append(stat)
-        return timetable
+        return [create_employee_daily_report(*day) for day in self.get_timeline_days()]
+
+
+class EmployeesReportCrucial:
+    """
+    loads plans, roll calls and approved requests of all given employees with a fixed number of queries
+    and groups them by (employee, date), so the report cost does not grow with the number of employees
+    """
+
+    def __init__(self, employees, kwargs, date_period=None):
+        self.date_period = date_period or get_period_dates(kwargs["start"], kwargs["end"])
+        self.employees = list(employees)
+        employee_ids = [employee.id for employee in self.employees]
+        self.plans = {}
+        plans = WorkShiftPlan.objects.filter(work_shift_id__in={employee.work_shift_id for employee in self.employees}, date__in=self.date_period).order_by("date")
+        for plan in load_plan_snapshots(plans):
+            self.plans.setdefault(plan.work_shift_id, []).append(plan)
+        self.roll_calls = {}
+        self.imperfect_roll_calls = {}
+        self.daily_roll_calls = {}
+        self.daily_imperfect_roll_calls = {}
+        roll_calls = RollCall.objects.filter(employee_id__in=employee_ids, date__in=self.date_period).order_by("date", "arrival")
+        for roll_call in roll_calls:
+            key = (roll_call.employee_id, roll_call.date)
+            if roll_call.arrival is None or roll_call.departure is None:
+                self.imperfect_roll_calls.setdefault(roll_call.employee_id, []).append(roll_call)
+                self.daily_imperfect_roll_calls.setdefault(key, []).append(roll_call)
+            else:
+                self.roll_calls.setdefault(roll_call.employee_id, []).append(roll_call)
+                self.daily_roll_calls.setdefault(key, []).append(roll_call)
+        self.requests = {}
+        self.daily_requests = {}
+        requests = EmployeeRequest.objects.filter(Q(date__in=self.date_period) | Q(end_date__in=self.date_period), employee_id__in=employee_ids,
+                                                  status=EmployeeRequest.STATUS_APPROVED, )
+        for req in requests:
+            self.requests.setdefault(req.employee_id, []).append(req)
+            self.daily_requests.setdefault((req.employee_id, req.date), []).append(req)
+
+    def get_report_crucial(self, employee: Employee):
+        return PreloadedReportCrucial(self, employee)
+
+    def get_snapshot(self, employee: Employee):
+        """plain data of one employee, SnapshotReportCrucial rebuilds the report from it in another process"""
+        return (employee.id,
+                self.plans.get(employee.work_shift_id, []),
+                [take_snapshot(RollCallSnapshot, roll_call) for roll_call in self.roll_calls.get(employee.id, [])],
+                [take_snapshot(RollCallSnapshot, roll_call) for roll_call in self.imperfect_roll_calls.get(employee.id, [])],
+                [take_snapshot(RequestSnapshot, req) for req in self.requests.get(employee.id, [])])
+
+
+class PreloadedReportCrucial(ReportCrucial):
+    """ReportCrucial of one employee which reads the rows already loaded by EmployeesReportCrucial instead of querying"""
+
+    def __init__(self, employees_report: EmployeesReportCrucial, employee: Employee):
+        self.employees_report = employees_report
+        self.employee = employee
+        self.date_period = employees_report.date_period
+        self.requests = employees_report.requests.get(employee.id, [])
+        self.roll_calls = employees_report.roll_calls.get(employee.id, [])
+        self.plans = employees_report.plans.get(employee.work_shift_id, [])
+
+    def get_plan_day(self, plan: WorkShiftPlan):
+        key = (self.employee.id, plan.date)
+        return (self.employees_report.daily_roll_calls.get(key, []),
+                self.employees_report.daily_imperfect_roll_calls.get(key, []),
+                self.employees_report.daily_requests.get(key, []))
+
+
+PlanSnapshot = namedtuple("PlanSnapshot", ("id", "work_shift_id", "date", "plan_type", "daily_duty_duration", "floating_time", "daily_overtime_limit",
+                                           "beginning_overtime", "middle_overtime", "ending_overtime", "permitted_delay", "permitted_acceleration",
+                                           "first_period_start", "first_period_end", "second_period_start", "second_period_end"))
+RollCallSnapshot = namedtuple("RollCallSnapshot", ("id", "employee_id", "date", "arrival", "departure"))
+RequestSnapshot = namedtuple("RequestSnapshot", ("id", "employee_id", "category", "date", "end_date", "time", "to_time", "manual_traffic_type"))
+
+
+def take_snapshot(snapshot_class, obj):
+    return snapshot_class(*(getattr(obj, field) for field in snapshot_class._fields))
 
 
-def calculate_total_roll_calls_and_traffics(roll_calls: QuerySet[RollCall], traffics: QuerySet[EmployeeRequest]):
+def load_plan_snapshots(plans):
+    # reads the plan columns without building WorkShiftPlan instances
+    return [PlanSnapshot(*row) for row in plans.values_list(*PlanSnapshot._fields)]
+
+
+class SnapshotReportCrucial(ReportCrucial):
+    """ReportCrucial of EmployeesReportCrucial.get_snapshot, needs neither model instances nor the database"""
+
+    def __init__(self, snapshot):
+        self.employee_id, self.plans, self.roll_calls, self.imperfect_roll_calls, self.requests = snapshot
+        self.daily_roll_calls = group_by_date(self.roll_calls)
+        self.daily_imperfect_roll_calls = group_by_date(self.imperfect_roll_calls)
+        self.daily_requests = group_by_date(self.requests)
+
+
+def calculate_snapshot_summaries(snapshots):
+    # runs in the report processes, only plain data goes in and out
+    return [[(stat.plan.id, stat.plan.date, stat.get_values()) for stat in SnapshotReportCrucial(snapshot).get_employee_timeline()]
+            for snapshot in snapshots]
+
+
+def map_in_report_processes(func, items):
+    """func(chunk) -> list, the items are split into chunks computed on a process pool and the results are merged in order"""
+    chunks = [items[i:i + REPORT_PROCESS_CHUNK_SIZE] for i in range(0, len(items), REPORT_PROCESS_CHUNK_SIZE)]
+    if len(chunks) < 2 or REPORT_PROCESSES < 2:
+        return [result for chunk in chunks for result in func(chunk)]
+    with ProcessPoolExecutor(max_workers=min(REPORT_PROCESSES, len(chunks)), initializer=django.setup) as executor:
+        return [result for results in executor.map(func, chunks) for result in results]
+
+
+def filter_requests(employee_requests, *categories):
+    return [req for req in employee_requests if req.category in categories]
+
+
+def calculate_total_roll_calls_and_traffics(roll_calls: list[RollCall], traffics: list[EmployeeRequest]):
     calculated_roll_calls = []
     arrives = []
     departs = []
-    employee = roll_calls[0].employee
-    date = roll_calls[0].date
+    if not roll_calls and not traffics:
+        return calculated_roll_calls
+    first = roll_calls[0] if roll_calls else traffics[0]
+    employee_id = first.employee_id
+    date = first.date
     for r in roll_calls:
         if r.arrival:
             arrives.append(r.arrival)
@@ -196,7 +396,7 @@ def calculate_total_roll_calls_and_traffics(roll_calls: QuerySet[RollCall], traf
                 nearest_departure = d
         if nearest_departure is not None:
             calculated_roll_calls.append(RollCall(
-                employee=employee,
+                employee_id=employee_id,
                 date=date,
                 arrival=a,
                 departure=nearest_departure,
@@ -205,43 +405,59 @@ def calculate_total_roll_calls_and_traffics(roll_calls: QuerySet[RollCall], traf
     return calculated_roll_calls
 
 
+def get_dashboard_cache_key(employer_id):
+    return "employer_dashboard_{}".format(employer_id)
+
+
+def invalidate_employer_dashboard(employer_id):
+    cache.delete(get_dashboard_cache_key(employer_id))
+
+
+def create_employer_dashboard(employer_id):
+    current = localtime()
+    today = current.date()
+    open_roll_calls = RollCall.objects.filter(employee=OuterRef("pk"), date=today, arrival__lte=current.time(), departure__isnull=True)
+    employees = list(Employee.objects.filter(Exists(WorkShiftPlan.objects.filter(employer_id=employer_id, work_shift=OuterRef("work_shift"), date=today)),
+                                             employer_id=employer_id)
+                     .annotate(present=Exists(open_roll_calls), arrival=Subquery(open_roll_calls.order_by("-arrival").values("arrival")[:1]))
+                     .only("id", "personnel_code", "first_name", "last_name").prefetch_related("workplace").order_by("id"))
+    attendees = [employee for employee in employees if employee.present]
+    absentees = [employee for employee in employees if not employee.present]
+    return {"attendees": AttendeesSerializer(attendees, many=True).data, "absentees": AbsenteesSerializer(absentees, many=True).data,
+            "attendees_count": len(attendees), "absentees_count": len(absentees), "total_employees_count": len(employees)}
+
+
+def get_cached_employer_dashboard(employer_id):
+    # every manager of an employer watches the same numbers, they are computed once per DASHBOARD_CACHE_SECONDS
+    key = get_dashboard_cache_key(employer_id)
+    dashboard = cache.get(key)
+    if dashboard is None:
+        dashboard = create_employer_dashboard(employer_id)
+        cache.set(key, dashboard, DASHBOARD_CACHE_SECONDS)
+    return dashboard
+
+
 @api_view()
 @check_user_permission(VIEW_PERMISSION_STR, DASHBOARD_PERMISSION_STR)
 def get_employer_dashboard(request, **kwargs):
-    shifts = WorkShiftPlan.objects.filter(date=now()).values_list("work_shift", flat=True)
-    employees = Employee.objects.filter(work_shift__in=shifts).distinct()
-    today_roll_calls = RollCall.objects.filter(arrival__lte=now(), date=now(), employee__in=employees, departure__isnull=True, ).distinct("employee")
-    attendees = []
-    absentees = []
-    for emp in employees:
-        if today_roll_calls.filter(employee=emp).exists():
-            attendees.append(emp)
-        else:
-            absentees.append(emp)
-    # attendees = today_roll_calls.filter(departure__isnull=True, )
-    # absentees = today_roll_calls.filter(departure__isnull=False, )
-
-    attendees_ser = AttendeesSerializer(attendees, many=True)
-    absentees_ser = AbsenteesSerializer(absentees, many=True)
-    return Response({"attendees": attendees_ser.data, "absentees": absentees_ser.data, "attendees_count": len(attendees), "absentees_count": len(absentees),
-                     "total_employees_count": employees.count()}, status=status.HTTP_200_OK)
+    return Response(get_cached_employer_dashboard(kwargs["employer"]), status=status.HTTP_200_OK)
 
 
 def calculate_employee_requests(employee_requests, plans, kwargs):
-    hourly_missions = employee_requests.filter(category=EmployeeRequest.CATEGORY_HOURLY_MISSION)
-    daily_missions = employee_requests.filter(category=EmployeeRequest.CATEGORY_DAILY_MISSION)
+    hourly_missions = filter_requests(employee_requests, EmployeeRequest.CATEGORY_HOURLY_MISSION)
+    daily_missions = filter_requests(employee_requests, EmployeeRequest.CATEGORY_DAILY_MISSION)
     missions = calculate_hourly_request_duration(hourly_missions) + calculate_daily_request_duration(daily_missions, plans, kwargs)
 
-    hourly_earned_leave = employee_requests.filter(category=EmployeeRequest.CATEGORY_HOURLY_EARNED_LEAVE)
-    daily_earned_leave = employee_requests.filter(category=EmployeeRequest.CATEGORY_DAILY_EARNED_LEAVE)
+    hourly_earned_leave = filter_requests(employee_requests, EmployeeRequest.CATEGORY_HOURLY_EARNED_LEAVE)
+    daily_earned_leave = filter_requests(employee_requests, EmployeeRequest.CATEGORY_DAILY_EARNED_LEAVE)
     earned_leave = calculate_daily_request_duration(daily_earned_leave, plans, kwargs) + calculate_hourly_request_duration(hourly_earned_leave)
 
-    hourly_sick_leave = employee_requests.filter(category=EmployeeRequest.CATEGORY_HOURLY_SICK_LEAVE)
-    daily_sick_leave = employee_requests.filter(category=EmployeeRequest.CATEGORY_DAILY_SICK_LEAVE)
+    hourly_sick_leave = filter_requests(employee_requests, EmployeeRequest.CATEGORY_HOURLY_SICK_LEAVE)
+    daily_sick_leave = filter_requests(employee_requests, EmployeeRequest.CATEGORY_DAILY_SICK_LEAVE)
     sick_leave = calculate_daily_request_duration(daily_sick_leave, plans, kwargs) + calculate_hourly_request_duration(hourly_sick_leave)
 
-    hourly_unpaid_leave = employee_requests.filter(category=EmployeeRequest.CATEGORY_HOURLY_UNPAID_LEAVE)
-    daily_unpaid_leave = employee_requests.filter(category=EmployeeRequest.CATEGORY_DAILY_UNPAID_LEAVE)
+    hourly_unpaid_leave = filter_requests(employee_requests, EmployeeRequest.CATEGORY_HOURLY_UNPAID_LEAVE)
+    daily_unpaid_leave = filter_requests(employee_requests, EmployeeRequest.CATEGORY_DAILY_UNPAID_LEAVE)
     unpaid_leave = calculate_hourly_request_duration(hourly_unpaid_leave) + calculate_daily_request_duration(daily_unpaid_leave, plans, kwargs)
 
     return {"missions": total_minute_to_hour_and_minutes(missions), "earned_leave": total_minute_to_hour_and_minutes(earned_leave),
@@ -305,7 +521,7 @@ def one_period_one_roll_call(plan, arrival, departure, daily_status=None):
             b = min(daily_status.first_period_early_arrival, plan.beginning_overtime)
             daily_status.overtime += b
             if daily_status.first_period_early_arrival - b > 0:
-                daily_status.burned_out["pre_shift_overtime"] = daily_status.first_period_early_arrival - b
+                daily_status.burn_out("pre_shift_overtime", daily_status.first_period_early_arrival - b)
     if daily_status.first_period_late_arrival > 0:
         daily_status.absent += daily_status.first_period_late_arrival
 
@@ -317,20 +533,20 @@ def one_period_one_roll_call(plan, arrival, departure, daily_status=None):
                 o = min(daily_status.first_period_late_departure, plan.middle_overtime)
                 daily_status.overtime += o
                 if daily_status.first_period_late_departure - o > 0:
-                    daily_status.burned_out["middle_shift_overtime"] = daily_status.first_period_late_departure - o
+                    daily_status.burn_out("middle_shift_overtime", daily_status.first_period_late_departure - o)
 
         elif plan.ending_overtime is not None and plan.ending_overtime > 0:
             e = min(daily_status.first_period_late_departure, plan.ending_overtime)
             daily_status.overtime += e
             if daily_status.first_period_late_departure - e > 0:
-                daily_status.burned_out["past_shift_overtime"] = daily_status.first_period_late_departure - e
+                daily_status.burn_out("past_shift_overtime", daily_status.first_period_late_departure - e)
     return daily_status
 
 
-def one_period_multiple_roll_calls(plan, roll_calls, ):
-    roll_calls = roll_calls.order_by('arrival')
+def one_period_multiple_roll_calls(plan: WorkShiftPlan, roll_calls: list[RollCall], ):
+    roll_calls = sorted(roll_calls, key=lambda r: r.arrival)
     folded_arrival = roll_calls[0].arrival
-    folded_departure = roll_calls.last().departure
+    folded_departure = roll_calls[-1].departure
     folded_attend = 0
     for roll_call in roll_calls:
         folded_attend += subtract_times(roll_call.arrival, roll_call.departure)
@@ -341,14 +557,13 @@ def one_period_multiple_roll_calls(plan, roll_calls, ):
     return stat
 
 
-def two_period_multiple_roll_calls(plan: WorkShiftPlan, roll_calls, ):
+def two_period_multiple_roll_calls(plan: WorkShiftPlan, roll_calls: list[RollCall], ):
     stat = DailyStatus(plan)
-    stat.add_attend(calculate_roll_call_query_duration(roll_calls)[2])
-    first_period_roll_calls = roll_calls.filter(arrival__lte=plan.first_period_end)
+    stat.add_attend(calculate_roll_calls_duration(roll_calls)[2])
+    first_period_roll_calls = sorted([r for r in roll_calls if r.arrival <= plan.first_period_end], key=lambda r: r.arrival)
     if first_period_roll_calls:
-        first_period_roll_calls = first_period_roll_calls.order_by('arrival')
         folded_arrival = first_period_roll_calls[0].arrival
-        folded_departure = first_period_roll_calls.last().departure
+        folded_departure = first_period_roll_calls[-1].departure
         folded_attend = 0
         for roll_call in first_period_roll_calls:
             folded_attend += subtract_times(roll_call.arrival, roll_call.departure)
@@ -358,12 +573,11 @@ def two_period_multiple_roll_calls(plan: WorkShiftPlan, roll_calls, ):
 
     else:
         stat.absent += subtract_times(plan.first_period_start, plan.first_period_end)
-    second_period_roll_calls = roll_calls.filter(arrival__gte=plan.first_period_end)
+    second_period_roll_calls = sorted([r for r in roll_calls if r.arrival >= plan.first_period_end], key=lambda r: r.arrival)
     # second_period_roll_calls = roll_calls.exclude(id__in=first_period_roll_calls.values_list('id', flat=True))
     if second_period_roll_calls:
-        second_period_roll_calls = second_period_roll_calls.order_by('arrival')
         folded_arrival = second_period_roll_calls[0].arrival
-        folded_departure = second_period_roll_calls.last().departure
+        folded_departure = second_period_roll_calls[-1].departure
         folded_attend = 0
         for roll_call in second_period_roll_calls:
             folded_attend += subtract_times(roll_call.arrival, roll_call.departure)
@@ -633,19 +847,19 @@ def deduct_request_time_from_absense(req: EmployeeRequest, period_start, period_
     return subtract_times(time_start, time_end)
 
 
-def create_employee_daily_report(plan, plan_roll_calls, hourly_employee_requests):
+def create_employee_daily_report(plan: WorkShiftPlan, plan_roll_calls: list[RollCall], hourly_employee_requests: list[EmployeeRequest]):
     if plan.plan_type == WorkShiftPlan.SIMPLE_PLAN_TYPE:
-        if plan_roll_calls.exists():
+        if plan_roll_calls:
             if plan.second_period_start is None and len(plan_roll_calls) == 1:
                 stat = one_period_one_roll_call(plan, plan_roll_calls[0].arrival, plan_roll_calls[0].departure)
-            elif plan.second_period_start is None and plan_roll_calls.count() > 1:
+            elif plan.second_period_start is None and len(plan_roll_calls) > 1:
                 stat = one_period_multiple_roll_calls(plan, plan_roll_calls)
             elif plan.second_period_start is not None:
                 stat = two_period_multiple_roll_calls(plan, plan_roll_calls)
             else:
                 raise Exception("unhandled plan and roll call situation")
 
-            if hourly_employee_requests.exists():
+            if hourly_employee_requests:
                 for req in hourly_employee_requests:
                     if req.time < plan.first_period_end:
                         req_time = deduct_request_time_from_absense(req, plan.first_period_start, plan.first_period_end)
@@ -659,15 +873,15 @@ def create_employee_daily_report(plan, plan_roll_calls, hourly_employee_requests
         return stat
     elif plan.plan_type == WorkShiftPlan.FLOATING_PLAN_TYPE:
         stat = DailyStatus(plan)
-        if plan_roll_calls.exists():
-            total_minutes = calculate_roll_call_query_duration(plan_roll_calls)[2]
+        if plan_roll_calls:
+            total_minutes = calculate_roll_calls_duration(plan_roll_calls)[2]
             stat.add_attend(total_minutes)
             if total_minutes > plan.daily_duty_duration:
                 this_overtime = total_minutes - plan.daily_duty_duration
                 if plan.daily_overtime_limit is not None and plan.daily_overtime_limit > 0:
                     stat.overtime += min(this_overtime, plan.daily_overtime_limit)
                     if this_overtime > plan.daily_overtime_limit:
-                        stat.burned_out["floating_shift_overtime"] = this_overtime - plan.daily_overtime_limit
+                        stat.burn_out("floating_shift_overtime", this_overtime - plan.daily_overtime_limit)
             elif total_minutes < plan.daily_duty_duration:
                 stat.add_absent(plan.daily_duty_duration - total_minutes)
 
@@ -687,25 +901,24 @@ def create_employee_traffic_report(employee: Employee, kwargs):
     report = ReportCrucial(employee, kwargs)
     timetable = []
     for plan in report.plans:
-        plan_roll_calls = report.roll_calls.filter(date=plan.date).order_by("arrival")
-        today_hourly_employee_requests = report.requests.filter(category__in=[EmployeeRequest.CATEGORY_HOURLY_MISSION, EmployeeRequest.CATEGORY_HOURLY_EARNED_LEAVE,
-                                                                              EmployeeRequest.CATEGORY_HOURLY_UNPAID_LEAVE, EmployeeRequest.CATEGORY_HOURLY_SICK_LEAVE, ],
-                                                                date=plan.date)
+        plan_roll_calls, imperfect_roll_calls, plan_requests = report.get_plan_day(plan)
+        today_hourly_employee_requests = filter_requests(plan_requests, *EmployeeRequest.HOURLY_REQUESTS_LIST)
         stat = create_employee_daily_report(plan, plan_roll_calls, today_hourly_employee_requests)
-        a = DailyStatusSerializer(stat).data
-        a["burned_out"] = sum(stat.burned_out.values())
+        a = stat.get_data()
+        a["burned_out"] = stat.total_burned_out
         b = calculate_employee_requests(today_hourly_employee_requests, report.plans, kwargs)
         b.update(a)
         timetable.append(b)
     return timetable
 
 
-def create_employee_total_report(employee: Employee, kwargs):
+def create_employee_total_report(employee: Employee, kwargs, report: ReportCrucial = None):
     # date_period = [kwargs["start"], kwargs["end"]]
     absent = {}
     overtime = {}
     burned_out = {}
-    report = ReportCrucial(employee, kwargs)
+    if report is None:
+        report = ReportCrucial(employee, kwargs)
     # employee_requests = employee.employeerequest_set.filter(Q(date__in=date_period) | Q(end_date__in=date_period), status=EmployeeRequest.STATUS_APPROVED, )
     # roll_calls = employee.rollcall_set.filter(~(Q(departure__isnull=True) | Q(arrival__isnull=True)), date__in=date_period).order_by("date")
     # plans = employee.work_shift.workshiftplan_set.filter(date__in=date_period).order_by("date")
@@ -718,16 +931,16 @@ def create_employee_total_report(employee: Employee, kwargs):
             absent[stat.get_date()] = stat.absent
         if stat.overtime > 0:
             overtime[stat.get_date()] = stat.overtime
-        total_burned_out = sum(stat.burned_out.values())
+        total_burned_out = stat.total_burned_out
         if total_burned_out > 0:
             burned_out[stat.get_date()] = total_burned_out
 
     result.update({
-        "total_attend": total_minute_to_hour_and_minutes(calculate_roll_call_query_duration(report.roll_calls)[2]),
+        "total_attend": total_minute_to_hour_and_minutes(calculate_roll_calls_duration(report.roll_calls)[2]),
         "total_absent": total_minute_to_hour_and_minutes(sum(absent.values())),
         "total_overtime": total_minute_to_hour_and_minutes(sum(overtime.values())),
         "total_burned_out": total_minute_to_hour_and_minutes(sum(burned_out.values())),
-        "days_attended": report.roll_calls.distinct("date").count(),
+        "days_attended": len({roll_call.date for roll_call in report.roll_calls}),
         "employee": employee.get_full_name(),
         "employee_id": employee.id,
         # "absent": absent,
@@ -739,14 +952,245 @@ def create_employee_total_report(employee: Employee, kwargs):
     return result
 
 
-def filter_employees_and_their_requests(request, **kwargs):  # a view request
-    employees = Employee.objects.filter(employer_id=kwargs['employer'])
+def refresh_attendance_summaries(employees, dates):
+    """recomputes the stored DailyAttendanceSummary of the given employees on the given dates"""
+    dates = list(dates)
+    employees_report = EmployeesReportCrucial(employees, None, date_period=dates)
+    snapshots = [employees_report.get_snapshot(employee) for employee in employees_report.employees]
+    summaries = {}
+    for snapshot, timeline in zip(snapshots, map_in_report_processes(calculate_snapshot_summaries, snapshots)):
+        for plan_id, date, values in timeline:
+            summaries[(snapshot[0], date)] = DailyAttendanceSummary(employee_id=snapshot[0], plan_id=plan_id, date=date, **values)
+    with transaction.atomic():
+        DailyAttendanceSummary.objects.filter(employee_id__in=[employee.id for employee in employees_report.employees], date__in=dates).delete()
+        DailyAttendanceSummary.objects.bulk_create(summaries.values())
+    refresh_monthly_attendance_summaries(employees_report.employees, {(date.year, date.month) for date in map(str_to_date, dates)})
+
+
+# (employee id, date) pairs whose daily summary waits for the worker, written roll calls, requests and plans queue them once committed
+summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="attendance_summary") if SUMMARY_REFRESH_WORKER else None
+summary_lock = threading.Lock()
+pending_summaries = set()
+summary_scheduled = False
+
+
+def refresh_pending_attendance_summaries():
+    """refreshes the queued days, employees with the same queued dates together"""
+    global summary_scheduled
+    while True:
+        with summary_lock:
+            if not pending_summaries:
+                summary_scheduled = False
+                return
+            keys = list(pending_summaries)
+            pending_summaries.clear()
+        employee_dates = {}
+        for employee_id, date in keys:
+            employee_dates.setdefault(employee_id, set()).add(date)
+        groups = {}
+        for employee_id, dates in employee_dates.items():
+            groups.setdefault(frozenset(dates), []).append(employee_id)
+        for dates, employee_ids in groups.items():
+            try:
+                refresh_attendance_summaries(Employee.objects.filter(id__in=employee_ids), sorted(dates))
+                # dashboards cached while the worker was behind
+                for employer_id in set(Employee.objects.filter(id__in=employee_ids).values_list("employer_id", flat=True)):
+                    invalidate_employer_dashboard(employer_id)
+            except Exception:
+                # the rows were discarded with the change, the next report of the days summarizes them
+                logger.exception("refreshing attendance summaries of %s employees on %s dates failed", len(employee_ids), len(dates))
+
+
+def run_summary_worker():
+    try:
+        refresh_pending_attendance_summaries()
+    finally:
+        connection.close()
+
+
+def add_pending_attendance_summaries(keys):
+    global summary_scheduled
+    with summary_lock:
+        pending_summaries.update(keys)
+        submit = summary_executor is not None and not summary_scheduled
+        summary_scheduled = summary_scheduled or submit
+    if submit:
+        summary_executor.submit(run_summary_worker)
+    elif summary_executor is None:
+        refresh_pending_attendance_summaries()
+
+
+def discard_attendance_summaries(employee_ids, dates):
+    """
+    deletes the daily summaries of the employees on the dates and the monthly ones of their months, in the transaction of
+    the change. missing rows are summarized again by the next report, a stored row is never older than its data
+    """
+    dates = {str_to_date(date) for date in dates if date}
+    if not dates:
+        return
+    months = Q()
+    for year, month in {(date.year, date.month) for date in dates}:
+        months |= Q(year=year, month=month)
+    DailyAttendanceSummary.objects.filter(employee_id__in=employee_ids, date__in=dates).delete()
+    MonthlyAttendanceSummary.objects.filter(months, employee_id__in=employee_ids).delete()
+
+
+def queue_attendance_summaries(employee_ids, dates):
+    """
+    discards the daily summaries (and so the monthly ones) of the employees on the dates, then refreshes them after the
+    transaction commits, off the request and outside the locks it held. repeated changes of a day are refreshed once,
+    refreshes lost with the process (a restart, a failure) are left to the next report
+    """
+    employee_ids = list(employee_ids)
+    keys = {(employee_id, str_to_date(date)) for employee_id in employee_ids for date in dates if date}
+    if keys:
+        discard_attendance_summaries(employee_ids, {date for _, date in keys})
+        transaction.on_commit(lambda: add_pending_attendance_summaries(keys))
+
+
+def ensure_attendance_summaries(employees, date_period):
+    # plans created with bulk_create never sent a signal, their days are summarized on the first report
+    plans = {}
+    for work_shift_id, date in WorkShiftPlan.objects.filter(work_shift_id__in={employee.work_shift_id for employee in employees},
+                                                            date__in=date_period).values_list("work_shift_id", "date"):
+        plans.setdefault(work_shift_id, set()).add(date)
+    summarized = set(DailyAttendanceSummary.objects.filter(employee__in=employees, date__in=date_period).values_list("employee_id", "date"))
+    missing_employees = []
+    missing_dates = set()
+    for employee in employees:
+        dates = {date for date in plans.get(employee.work_shift_id, ()) if (employee.id, date) not in summarized}
+        if dates:
+            missing_employees.append(employee)
+            missing_dates.update(dates)
+    if missing_employees:
+        refresh_attendance_summaries(missing_employees, missing_dates)
+
+
+def refresh_monthly_attendance_summaries(employees, months):
+    """recomputes the stored MonthlyAttendanceSummary of the given employees in the given (year, month) pairs"""
+    employees = list(employees)
+    employee_ids = [employee.id for employee in employees]
+    categories = EmployeeRequest.HOURLY_REQUESTS_LIST + EmployeeRequest.DAILY_REQUESTS_LIST
+    for year, month in months:
+        month_dates = get_month_dates(year, month)
+        summaries = DailyAttendanceSummary.objects.filter(employee_id__in=employee_ids, date__range=(month_dates[0], month_dates[-1])).values("employee_id").annotate(
+            attend=Sum("attend"),
+            absent=Sum("absent", filter=Q(absent__gt=0)),
+            overtime=Sum("overtime", filter=Q(overtime__gt=0)),
+            burned_out=Sum("total_burned_out"),
+        )
+        summaries = {row["employee_id"]: row for row in summaries}
+        requests = {}
+        last_date = month_dates[-1]
+        for req in EmployeeRequest.objects.filter(employee_id__in=employee_ids, status=EmployeeRequest.STATUS_APPROVED, category__in=categories,
+                                                  date__range=(month_dates[0], month_dates[-1])):
+            requests.setdefault(req.employee_id, []).append(req)
+            last_date = max(last_date, req.end_date or req.date)
+        plans = {}
+        if requests:
+            # daily requests are counted in the month they start in, even when they run into the next one
+            for plan in WorkShiftPlan.objects.filter(work_shift_id__in={employee.work_shift_id for employee in employees if employee.id in requests},
+                                                     date__range=(month_dates[0], last_date)).order_by("date"):
+                plans.setdefault(plan.work_shift_id, []).append(plan)
+        rollups = []
+        for employee in employees:
+            summary = summaries.get(employee.id, {})
+            employee_requests = requests.get(employee.id, [])
+            durations = calculate_employee_requests(employee_requests, plans.get(employee.work_shift_id, []), {})["integers"]
+            rollups.append(MonthlyAttendanceSummary(
+                employee_id=employee.id, year=year, month=month,
+                attend=summary.get("attend") or 0,
+                absent=summary.get("absent") or 0,
+                overtime=summary.get("overtime") or 0,
+                burned_out=summary.get("burned_out") or 0,
+                mission=durations["missions"],
+                earned_leave=durations["earned_leave"],
+                sick_leave=durations["sick_leave"],
+                unpaid_leave=durations["unpaid_leave"],
+                leave_count=len(filter_requests(employee_requests, *EmployeeRequest.LEAVE_REQUESTS_LIST)),
+            ))
+        with transaction.atomic():
+            MonthlyAttendanceSummary.objects.filter(employee_id__in=employee_ids, year=year, month=month).delete()
+            MonthlyAttendanceSummary.objects.bulk_create(rollups)
+
+
+def ensure_monthly_attendance_summaries(employees, year):
+    # months are rolled up on the first report of the year, after that the signals keep them fresh
+    summarized = set(MonthlyAttendanceSummary.objects.filter(employee__in=employees, year=year).values_list("employee_id", "month"))
+    missing_employees = []
+    missing_months = set()
+    for employee in employees:
+        months = {month for month in range(1, 13) if (employee.id, month) not in summarized}
+        if months:
+            missing_employees.append(employee)
+            missing_months.update(months)
+    if missing_employees:
+        dates = [date for month in sorted(missing_months) for date in get_month_dates(year, month)]
+        ensure_attendance_summaries(missing_employees, dates)
+        refresh_monthly_attendance_summaries(missing_employees, {(year, month) for month in missing_months})
+
+
+def create_employees_total_report(employees, kwargs):
+    """create_employee_total_report of many employees, absences and overtimes are aggregated from DailyAttendanceSummary"""
+    employees = list(employees)
+    date_period = get_period_dates(kwargs["start"], kwargs["end"])
+    employee_ids = [employee.id for employee in employees]
+    ensure_attendance_summaries(employees, date_period)
+    summaries = DailyAttendanceSummary.objects.filter(employee_id__in=employee_ids, date__in=date_period).values("employee_id").annotate(
+        total_absent=Sum("absent", filter=Q(absent__gt=0)),
+        total_overtime=Sum("overtime", filter=Q(overtime__gt=0)),
+        total_burned_out=Sum("total_burned_out"),
+    )
+    summaries = {row["employee_id"]: row for row in summaries}
+    roll_calls = RollCall.objects.filter(~(Q(departure__isnull=True) | Q(arrival__isnull=True)), employee_id__in=employee_ids, date__in=date_period).values("employee_id").annotate(
+        total_attend=Sum(ExpressionWrapper(F('departure') - F('arrival'), output_field=DurationField())),
+        days_attended=Count("date", distinct=True),
+    )
+    roll_calls = {row["employee_id"]: row for row in roll_calls}
+    plans = {}
+    for plan in WorkShiftPlan.objects.filter(work_shift_id__in={employee.work_shift_id for employee in employees}, date__in=date_period).order_by("date"):
+        plans.setdefault(plan.work_shift_id, []).append(plan)
+    requests = {}
+    for req in EmployeeRequest.objects.filter(Q(date__in=date_period) | Q(end_date__in=date_period), employee_id__in=employee_ids, status=EmployeeRequest.STATUS_APPROVED, ):
+        requests.setdefault(req.employee_id, []).append(req)
     result = []
     for employee in employees:
-        result.append(create_employee_total_report(employee, kwargs))
+        summary = summaries.get(employee.id, {})
+        attendance = roll_calls.get(employee.id, {})
+        total_attend = attendance.get("total_attend")
+        row = {"data": []}
+        row.update(calculate_employee_requests(requests.get(employee.id, []), plans.get(employee.work_shift_id, []), kwargs))
+        row.update({
+            "total_attend": total_minute_to_hour_and_minutes(int(total_attend.total_seconds()) // 60 if total_attend is not None else 0),
+            "total_absent": total_minute_to_hour_and_minutes(summary.get("total_absent") or 0),
+            "total_overtime": total_minute_to_hour_and_minutes(summary.get("total_overtime") or 0),
+            "total_burned_out": total_minute_to_hour_and_minutes(summary.get("total_burned_out") or 0),
+            "days_attended": attendance.get("days_attended", 0),
+            "employee": employee.get_full_name(),
+            "employee_id": employee.id,
+        })
+        result.append(row)
     return result
 
 
+def iter_employees_total_report(employees, kwargs):
+    # a chunk of employees at a time, exports can start sending before the whole report is computed
+    employees = employees.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    while chunk := list(islice(employees, EXPORT_CHUNK_SIZE)):
+        yield from create_employees_total_report(chunk, kwargs)
+
+
+def employees_function_report_rows(employer_id, kwargs):
+    cols = ["employee", "total_attend", "total_absent", "total_overtime", "missions", "earned_leave", "sick_leave", "unpaid_leave", "total_burned_out", "days_attended"]
+    yield ["نام", "مجموع حضور", "غیبت", "اضافه کار", "ماموریت", "مرخصی استحقاقی", "مرخصی استعلاجی", "مرخصی بی حقوق", "مازاد حضور", "روز کارکرد", ]
+    for row in iter_employees_total_report(Employee.objects.filter(employer_id=employer_id), kwargs):
+        yield [row[key] for key in cols]
+
+
+def filter_employees_and_their_requests(request, **kwargs):  # a view request
+    return create_employees_total_report(Employee.objects.filter(employer_id=kwargs['employer']), kwargs)
+
+
 @api_view()
 @check_user_permission(VIEW_PERMISSION_STR, REPORT_PERMISSION_STR)
 def report_employees_function(request, **kwargs):
@@ -757,35 +1201,18 @@ def report_employees_function(request, **kwargs):
 @api_view()
 @check_user_permission(VIEW_PERMISSION_STR, REPORT_PERMISSION_STR)
 def get_employees_function_report_excel(request, **kwargs):
-    result = filter_employees_and_their_requests(request, **kwargs)
-    cols = ["employee", "total_attend", "total_absent", "total_overtime", "missions", "earned_leave", "sick_leave", "unpaid_leave", "total_burned_out", "days_attended"]
-    data = [["نام", "مجموع حضور", "غیبت", "اضافه کار", "ماموریت", "مرخصی استحقاقی", "مرخصی استعلاجی", "مرخصی بی حقوق", "مازاد حضور", "روز کارکرد", ]]
-    for row in result:
-        data.append([row[key] for key in cols])
-    return send_response_file(data, 'employees_function_report')
+    rows = employees_function_report_rows(kwargs['employer'], kwargs)
+    return send_response_file(rows, 'employees_function_report', kwargs.get("file_format", "excel"))
 
 
 @api_view()
 @check_user_permission(VIEW_PERMISSION_STR, REPORT_PERMISSION_STR)
 def get_employee_report(request, oid, **kwargs):
     employee = get_object_or_404(Employee, id=oid, employer_id=kwargs["employer"])
-    report = create_employee_total_report(employee, kwargs)
+    report = create_employees_total_report([employee], kwargs)[0]
     return Response(report, status=status.HTTP_200_OK)
 
 
-def get_leave_requests(employee: Employee, year):
-    employee_requests = EmployeeRequest.objects.filter(
-        Q(category=EmployeeRequest.CATEGORY_DAILY_SICK_LEAVE) |
-        Q(category=EmployeeRequest.CATEGORY_HOURLY_SICK_LEAVE) |
-        Q(category=EmployeeRequest.CATEGORY_DAILY_UNPAID_LEAVE) |
-        Q(category=EmployeeRequest.CATEGORY_HOURLY_UNPAID_LEAVE) |
-        Q(category=EmployeeRequest.CATEGORY_DAILY_EARNED_LEAVE) |
-        Q(category=EmployeeRequest.CATEGORY_HOURLY_EARNED_LEAVE),
-        employee=employee, status=EmployeeRequest.STATUS_APPROVED,
-        date__year=year)
-    return employee_requests
-
-
 @api_view()
 @check_user_permission(VIEW_PERMISSION_STR, REPORT_PERMISSION_STR)
 def report_employee_traffic(request, oid, **kwargs):
@@ -798,35 +1225,52 @@ def report_employee_traffic(request, oid, **kwargs):
 @check_user_permission(VIEW_PERMISSION_STR, REPORT_PERMISSION_STR)
 def get_employee_traffic_report_excel(request, oid, **kwargs):
     emp = get_object_or_404(Employee, id=oid, employer_id=kwargs.get("employer"))
-    report = create_employee_traffic_report(emp, kwargs)
+    return send_response_file(employee_traffic_report_rows(emp, kwargs), 'employee_traffic_report', kwargs.get("file_format", "excel"))
+
+
+def employee_traffic_report_rows(employee, kwargs):
     cols = ["date", "weekday", "attend", "absent", "earned_leave", "sick_leave", "unpaid_leave", "overtime", "burned_out", "missions"]
-    data = [["تاریخ", "روز هفته", "کل حضور", "غیبت", "مرخصی استحقاقی", "مرخصی استعلاجی", "مرخصی بی حقوق", "اضافه کار", "مازاد حضور", "ماموریت", ]]
-    for row in report:
-        data.append([row[key] for key in cols])
-    return send_response_file(data, 'employee_traffic_report')
+    yield ["تاریخ", "روز هفته", "کل حضور", "غیبت", "مرخصی استحقاقی", "مرخصی استعلاجی", "مرخصی بی حقوق", "اضافه کار", "مازاد حضور", "ماموریت", ]
+    for row in create_employee_traffic_report(employee, kwargs):
+        yield [row[key] for key in cols]
 
 
-def filter_employee_and_lives(employee, kwargs):
+def filter_employees_and_lives(employees, kwargs):
     # todo filter by type
-    plans = employee.work_shift.workshiftplan_set.all().order_by("date")
-    yearly = get_leave_requests(employee, kwargs.get("year"))
-    monthly = yearly.filter(date__month=kwargs.get("month"))
-    monthly_used = sum(calculate_employee_requests(monthly, plans, kwargs)["integers"].values())
-    yearly_used = sum(calculate_employee_requests(yearly, plans, kwargs)["integers"].values())
-    lp = employee.work_policy.earnedleavepolicy
-    if lp:
-        lp_m = lp.maximum_hour_per_month * 60 + lp.maximum_minute_per_month
-        lp_y = lp.maximum_hour_per_year * 60 + lp.maximum_minute_per_year
-    else:
-        lp_m = 0
-        lp_y = 0
-    return {"monthly_used": monthly_used,
-            "yearly_used": yearly_used,
-            "monthly_count": monthly.count(),
-            "yearly_count": yearly.count(),
-            "monthly_remained": lp_m,
-            "yearly_remained": lp_y
-            }
+    employees = list(employees)
+    year = int(kwargs.get("year"))
+    month = int(kwargs.get("month"))
+    ensure_monthly_attendance_summaries(employees, year)
+    leave = F("earned_leave") + F("sick_leave") + F("unpaid_leave")
+    usages = MonthlyAttendanceSummary.objects.filter(employee__in=employees, year=year).values("employee_id").annotate(
+        monthly_used=Sum(leave, filter=Q(month=month)),
+        yearly_used=Sum(leave),
+        monthly_count=Sum("leave_count", filter=Q(month=month)),
+        yearly_count=Sum("leave_count"),
+    )
+    usages = {row["employee_id"]: row for row in usages}
+    result = []
+    for employee in employees:
+        usage = usages.get(employee.id, {})
+        lp = employee.work_policy.earnedleavepolicy
+        if lp:
+            lp_m = lp.maximum_hour_per_month * 60 + lp.maximum_minute_per_month
+            lp_y = lp.maximum_hour_per_year * 60 + lp.maximum_minute_per_year
+        else:
+            lp_m = 0
+            lp_y = 0
+        result.append({"monthly_used": usage.get("monthly_used") or 0,
+                       "yearly_used": usage.get("yearly_used") or 0,
+                       "monthly_count": usage.get("monthly_count") or 0,
+                       "yearly_count": usage.get("yearly_count") or 0,
+                       "monthly_remained": lp_m,
+                       "yearly_remained": lp_y
+                       })
+    return result
+
+
+def filter_employee_and_lives(employee, kwargs):
+    return filter_employees_and_lives([employee], kwargs)[0]
 
 
 #     return report
@@ -842,10 +1286,9 @@ def report_employee_leave(request, oid, **kwargs):
 @api_view()
 @check_user_permission(VIEW_PERMISSION_STR, REPORT_PERMISSION_STR)
 def report_employees_leave(request, **kwargs):
-    employees = Employee.objects.filter(employer_id=request.user.id)
+    employees = list(Employee.objects.filter(employer_id=request.user.id).select_related("work_policy__earnedleavepolicy"))
     result = []
-    for employee in employees:
-        row = filter_employee_and_lives(employee, kwargs)
+    for employee, row in zip(employees, filter_employees_and_lives(employees, kwargs)):
         row.update({"personnel_code": employee.personnel_code, "employee": employee.get_full_name()})
         result.append(row)
     return Response(result, status=status.HTTP_200_OK)
@@ -854,16 +1297,60 @@ def report_employees_leave(request, **kwargs):
 @api_view()
 @check_user_permission(VIEW_PERMISSION_STR, REPORT_PERMISSION_STR)
 def get_employees_leave_excel(request, **kwargs):
-    employees = Employee.objects.filter(employer_id=request.user.id)
-    result = [["کد", "نام", "استفاده ماهانه", "استفاده سالانه", "تعداد ماهانه", "تعداد سالانه", "مانده ماهانه", "مانده سالانه", ]]
-    cols = ["personnel_code", "employee", "monthly_used", "yearly_used", "monthly_count", "yearly_count", "monthly_remained", "yearly_remained", ]
-    for employee in employees:
-        data = [employee.personnel_code, employee.get_full_name()]
-        row = filter_employee_and_lives(employee, kwargs)
-        for key in cols:
-            data.append(row[key])
-        result.append(data)
-    return send_response_file(result, 'personnel_leave')
+    return send_response_file(employees_leave_report_rows(kwargs["employer"], kwargs), 'personnel_leave', kwargs.get("file_format", "excel"))
+
+
+def employees_leave_report_rows(employer_id, kwargs):
+    employees = list(Employee.objects.filter(employer_id=employer_id).select_related("work_policy__earnedleavepolicy"))
+    cols = ["monthly_used", "yearly_used", "monthly_count", "yearly_count", "monthly_remained", "yearly_remained", ]
+    yield ["کد", "نام", "استفاده ماهانه", "استفاده سالانه", "تعداد ماهانه", "تعداد سالانه", "مانده ماهانه", "مانده سالانه", ]
+    for employee, row in zip(employees, filter_employees_and_lives(employees, kwargs)):
+        yield [employee.personnel_code, employee.get_full_name()] + [row[key] for key in cols]
+
+
+def build_report_job_rows(job):
+    kwargs = dict(job.parameters, employer=job.employer_id)
+    if job.category == ReportJob.CATEGORY_FUNCTION:
+        return employees_function_report_rows(job.employer_id, kwargs), 'employees_function_report'
+    if job.category == ReportJob.CATEGORY_TRAFFIC:
+        employee = Employee.objects.get(id=kwargs["employee"], employer_id=job.employer_id)
+        return employee_traffic_report_rows(employee, kwargs), 'employee_traffic_report'
+    return employees_leave_report_rows(job.employer_id, kwargs), 'personnel_leave'
+
+
+@api_view([POST_METHOD_STR])
+@check_user_permission(VIEW_PERMISSION_STR, REPORT_PERMISSION_STR)
+def create_report_job(request, **kwargs):
+    ser = ReportJobSerializer(data=kwargs)
+    if ser.is_valid():
+        job = ser.save(user_id=request.user.id)
+        enqueue_report_job(job, build_report_job_rows)
+        return Response(ReportJobOutputSerializer(job).data, status=status.HTTP_201_CREATED)
+    return Response(ser.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view()
+@check_user_permission(VIEW_PERMISSION_STR, REPORT_PERMISSION_STR)
+def get_report_jobs(request, **kwargs):
+    jobs = ReportJob.objects.filter(employer_id=kwargs["employer"]).order_by("-id")
+    return Response(ReportJobOutputSerializer(jobs, many=True).data, status=status.HTTP_200_OK)
+
+
+@api_view()
+@check_user_permission(VIEW_PERMISSION_STR, REPORT_PERMISSION_STR)
+def get_report_job(request, oid, **kwargs):
+    job = get_object_or_404(ReportJob, id=oid, employer_id=kwargs["employer"])
+    return Response(ReportJobOutputSerializer(job).data, status=status.HTTP_200_OK)
+
+
+@api_view()
+@check_user_permission(VIEW_PERMISSION_STR, REPORT_PERMISSION_STR)
+def download_report_job(request, oid, **kwargs):
+    job = get_object_or_404(ReportJob, id=oid, employer_id=kwargs["employer"])
+    if job.status != ReportJob.STATUS_DONE:
+        return Response({"msg": "report is not ready"}, status=status.HTTP_409_CONFLICT)
+    stream, extension, content_type = FILE_FORMATS[job.file_format]
+    return FileResponse(job.file.open("rb"), as_attachment=True, filename="report_{}.{}".format(job.id, extension), content_type=content_type)
 
 
 def filter_project_traffic(request):
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from employer import consumers
+
+websocket_urlpatterns = [
+    path('ws/employer_dashboard/', consumers.DashboardConsumer.as_asgi(), name='employer_dashboard_feed'),
+]
@@ -1,12 +1,19 @@
 import django.contrib.auth.password_validation as validators
 from django.contrib.auth.hashers import make_password
 from django.core import exceptions
+from django.utils import timezone
 from django_jalali.serializers.serializerfield import JDateField
 from rest_framework import serializers
 
+from .authorization import get_auth_context
+from .geofence import locate_punch, invalidate_workplace_index
 from .models import *
 from .utilities import national_code_validation, DATE_TIME_FORMAT_STR
 
+class CoordinateModelSerializer(serializers.ModelSerializer):
+    # coordinates go over the api as float degrees, not as the microdegree integers they are stored in
+    serializer_field_mapping = {**serializers.ModelSerializer.serializer_field_mapping, CoordinateField: serializers.FloatField}
+
 
 class PermissionSerializer(serializers.ModelSerializer):
     class Meta:
@@ -205,7 +212,10 @@ class EmployerProfileOutputSerializer(serializers.ModelSerializer):
 class WorkplaceListSerializer(serializers.ListSerializer):
     def create(self, validated_data):
         books = [Workplace(**item) for item in validated_data]
-        return Workplace.objects.bulk_create(books)
+        workplaces = Workplace.objects.bulk_create(books)
+        # bulk_create sends no post_save, the geofences of the employers are dropped here
+        invalidate_workplace_index(*{workplace.employer_id for workplace in workplaces})
+        return workplaces
 
     # def update(self, instance, validated_data):
     #     # Maps for id->instance and id->data item.
@@ -219,7 +229,7 @@ class WorkplaceListSerializer(serializers.ListSerializer):
     #     return ret
 
 
-class WorkplaceSerializer(serializers.ModelSerializer):
+class WorkplaceSerializer(CoordinateModelSerializer):
     class Meta:
         model = Workplace
         exclude = ()
@@ -252,7 +262,7 @@ class HolidayOutputSerializer(serializers.ModelSerializer):
         exclude = ("employer",)
 
 
-class WorkplaceOutputSerializer(serializers.ModelSerializer):
+class WorkplaceOutputSerializer(CoordinateModelSerializer):
     class Meta:
         model = Workplace
         exclude = ("employer",)
@@ -278,15 +288,30 @@ class RadkanMessageSerializer(serializers.ModelSerializer):
         exclude = ()
 
 
-class RollCallSerializer(serializers.ModelSerializer):
+def validate_punch_location(employee, data):
+    # coordinates of a punch must fall in one of the workplaces of the employee, the roll call is tagged with the closest of them
+    for field in ("arrival", "departure"):
+        allowed, workplace_id = locate_punch(employee, data.get(field + "_latitude"), data.get(field + "_longitude"))
+        if not allowed:
+            raise serializers.ValidationError({field + "_latitude": "محل ثبت تردد خارج از محدوده محل کار است"})
+        if data.get("workplace_id") is None:
+            data["workplace_id"] = workplace_id
+
+
+class RollCallSerializer(CoordinateModelSerializer):
     date = JDateField()
 
     class Meta:
         model = RollCall
         exclude = ()
+        read_only_fields = ("workplace", "employer")
 
+    def validate(self, data):
+        validate_punch_location(data["employee"], data)
+        return data
 
-class RollCallDepartureSerializer(serializers.ModelSerializer):
+
+class RollCallDepartureSerializer(CoordinateModelSerializer):
     class Meta:
         model = RollCall
         fields = (
@@ -295,11 +320,45 @@ class RollCallDepartureSerializer(serializers.ModelSerializer):
             "departure_longitude",
         )
 
+    def validate(self, data):
+        validate_punch_location(self.instance.employee, data)
+        if self.instance.workplace_id is not None:
+            del data["workplace_id"]
+        return data
+
+
+class RollCallBatchSerializer(CoordinateModelSerializer):
+    # one punch of a batch, replayed punches are checked against their own date instead of the current time only
+    employee = serializers.IntegerField(source="employee_id", required=False)
+    date = JDateField()
+    arrival = serializers.TimeField(required=False, allow_null=True)
+    departure = serializers.TimeField(required=False, allow_null=True)
 
-class RollCallOutputSerializer(serializers.ModelSerializer):
     class Meta:
         model = RollCall
-        exclude = ("employee",)
+        fields = ("employee", "date", "arrival", "departure", "arrival_latitude", "arrival_longitude", "departure_latitude", "departure_longitude",)
+
+    def validate(self, data):
+        if data.get("arrival") is None and data.get("departure") is None:
+            raise serializers.ValidationError("arrival or departure is required")
+        current = timezone.localtime()
+        date = data["date"].togregorian()
+        if date > current.date():
+            raise serializers.ValidationError({"date": "امکان انتخاب تاریخ آینده وجود ندارد"})
+        for field in ("arrival", "departure"):
+            if date == current.date() and data.get(field) is not None and data[field] > current.time():
+                raise serializers.ValidationError({field: "امکان انتخاب زمان آینده وجود ندارد"})
+        # employees the batch may punch for, keyed by id
+        employee = self.context.get("employees", {}).get(data.get("employee_id"))
+        if employee is not None:
+            validate_punch_location(employee, data)
+        return data
+
+
+class RollCallOutputSerializer(CoordinateModelSerializer):
+    class Meta:
+        model = RollCall
+        exclude = ("employee", "employer")
 
 
 class WorkPolicySerializer(serializers.ModelSerializer):
@@ -476,13 +535,13 @@ class WorkMissionPolicyOutputSerializer(serializers.ModelSerializer):
         exclude = ("employer",)
 
 
-class EmployeeRequestSerializer(serializers.ModelSerializer):
+class EmployeeRequestSerializer(CoordinateModelSerializer):
     class Meta:
         model = EmployeeRequest
         exclude = ()
 
 
-class EmployeeRequestOutputSerializer(serializers.ModelSerializer):
+class EmployeeRequestOutputSerializer(CoordinateModelSerializer):
     category = serializers.CharField(source='get_category_display')
     status = serializers.CharField(source='get_status_display')
     manual_traffic_type_display = serializers.CharField(source='get_manual_traffic_type_display')
@@ -559,8 +618,7 @@ class ManagerOutputSerializer(serializers.ModelSerializer):
     permissions = serializers.SerializerMethodField("get_permissions")
 
     def get_permissions(self, obj):
-        permissions = obj.user_permissions.all() | Permission.objects.filter(group__user=obj)
-        return PermissionSerializer(permissions, many=True).data
+        return PermissionSerializer(get_auth_context(obj.id).get_permissions(), many=True).data
 
     class Meta:
         model = Manager
@@ -629,31 +687,34 @@ class WorkShiftPlanOutputSerializer(serializers.ModelSerializer):
 
 
 class AbsenteesSerializer(serializers.ModelSerializer):
-    full_name = serializers.CharField(source="employee.get_full_name")
-    personnel_code = serializers.CharField(source="employee.personnel_code")
+    full_name = serializers.CharField(source="get_full_name")
 
     class Meta:
-        model = RollCall
+        model = Employee
         fields = ("personnel_code", "full_name")
 
 
 class AttendeesSerializer(serializers.ModelSerializer):
-    employee_code = serializers.CharField(source="employee.personnel_code")
-    employee_name = serializers.CharField(source="employee.get_full_name")
-    employee_workplace = serializers.CharField(source="employee.workplace")
+    # employees annotated with the arrival of their open roll call by get_employer_dashboard
+    employee_code = serializers.CharField(source="personnel_code")
+    employee_name = serializers.CharField(source="get_full_name")
+    employee_workplace = serializers.SerializerMethodField()
     time = serializers.TimeField(source="arrival", format="%H:%M")
 
     class Meta:
-        model = RollCall
+        model = Employee
         fields = ("employee_code", "employee_name", "employee_workplace", "time")
 
+    def get_employee_workplace(self, obj):
+        return ", ".join(workplace.name for workplace in obj.workplace.all())
+
 
 def required(value):
     if value is None:
         raise serializers.ValidationError('This field is required')
 
 
-class EmployeeRequestBaseSerializer(serializers.ModelSerializer):
+class EmployeeRequestBaseSerializer(CoordinateModelSerializer):
     category = serializers.IntegerField(validators=[required])
     employee_id = serializers.IntegerField(validators=[required])
     description = serializers.CharField(validators=[required])
@@ -907,3 +968,38 @@ class RadkanMessageOutputSerializer(serializers.ModelSerializer):
     class Meta:
         model = RadkanMessage
         exclude = ("employer",)
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    REQUIRED_PARAMETERS = {
+        ReportJob.CATEGORY_FUNCTION: ("start", "end"),
+        ReportJob.CATEGORY_TRAFFIC: ("employee", "start", "end"),
+        ReportJob.CATEGORY_LEAVE: ("year", "month"),
+    }
+
+    def validate(self, attrs):
+        missing = [key for key in self.REQUIRED_PARAMETERS[attrs["category"]] if not attrs.get("parameters", {}).get(key)]
+        if missing:
+            raise serializers.ValidationError({"parameters": "missing {}".format(", ".join(missing))})
+        if attrs["category"] == ReportJob.CATEGORY_TRAFFIC:
+            employee = str(attrs["parameters"]["employee"])
+            if not employee.isdigit() or not Employee.objects.filter(id=employee, employer_id=attrs["employer"].id).exists():
+                raise serializers.ValidationError({"parameters": "employee not found"})
+            attrs["parameters"] = dict(attrs["parameters"], employee=int(employee))
+        return attrs
+
+    class Meta:
+        model = ReportJob
+        fields = ("employer", "category", "file_format", "parameters")
+
+
+class ReportJobOutputSerializer(serializers.ModelSerializer):
+    category_display = serializers.CharField(source='get_category_display')
+    status_display = serializers.CharField(source='get_status_display')
+    registration_date = serializers.DateTimeField(format=DATE_TIME_FORMAT_STR)
+    start_date = serializers.DateTimeField(format=DATE_TIME_FORMAT_STR)
+    finish_date = serializers.DateTimeField(format=DATE_TIME_FORMAT_STR)
+
+    class Meta:
+        model = ReportJob
+        exclude = ("employer", "user", "file")
@@ -1,20 +1,32 @@
-import json
 from pickle import FALSE
 
-from django.contrib.admin.models import LogEntry, ADDITION, CHANGE, DELETION
-from django.contrib.auth.models import Permission
-from django.contrib.contenttypes.models import ContentType
-from django.core import serializers
-from django.db.models.signals import pre_save, pre_delete, post_delete, m2m_changed, post_save
+import jdatetime
+from django.contrib.admin.models import ADDITION, CHANGE, DELETION
+from django.contrib.auth.models import Permission, Group
+from django.core.management import call_command
+from django.db.models.signals import pre_save, pre_delete, post_delete, m2m_changed, post_save, post_migrate
+from django.db import transaction, connections
+from django.db.models import Q
 from django.dispatch import receiver
+from django.utils.timezone import localdate
 
 from employer.apps import get_this_app_name
+from employer.audit import record_audit_event, AUDIT_CHANGES
+from employer.authorization import invalidate_auth_context, invalidate_permission_catalogue
+from employer.geofence import invalidate_workplace_index
 from employer.get_request import current_request, current_data
-from employer.models import Manager, Employer, MelliSMSInfo, Workplace, RTSP, WorkPolicy, ManualTrafficPolicy, OvertimePolicy, LeavePolicy, EarnedLeavePolicy, SickLeavePolicy, \
-    WorkMissionPolicy, Holiday, WorkShift, WorkShiftPlan, Employee, EmployeeRequest, Project, WorkCategory, RadkanMessage
+from employer.partitions import is_partitioned, ensure_partitions
+from employer.models import ChangeTrackingMixin, User, Manager, Employer, MelliSMSInfo, Workplace, RTSP, WorkPolicy, ManualTrafficPolicy, OvertimePolicy, LeavePolicy, EarnedLeavePolicy, SickLeavePolicy, \
+    WorkMissionPolicy, Holiday, WorkShift, WorkShiftPlan, Employee, EmployeeRequest, Project, WorkCategory, RadkanMessage, RollCall, DailyAttendanceSummary, MonthlyAttendanceSummary, \
+    ResetPasswordRequest
+from employer.report_views import invalidate_employer_dashboard, queue_attendance_summaries
 from employer.serializers import PermissionSerializer
+from employer.utilities import str_to_date
 from employer.views import get_acceptable_permissions
 
+# derived rows, recomputed from other models and not worth an audit entry, and one-time reset codes
+NOT_LOGGED_MODELS = (DailyAttendanceSummary, MonthlyAttendanceSummary, ResetPasswordRequest)
+
 
 # def receiver_with_multiple_senders(signal, senders, **kwargs):
 #     """
@@ -40,39 +52,39 @@ from employer.views import get_acceptable_permissions
           weak=FALSE,
           dispatch_uid='pre_save')
 def pre_save_signal(sender, instance, raw, using, update_fields, **kwargs):
-    if sender._meta.app_label == get_this_app_name():
-        if instance.id and FALSE:
-            old_obj = sender.objects.get(pk=instance.pk)
-            serialized_obj = serializers.serialize('json', [old_obj, instance])
-            # deserialized_obj = ast.literal_eval(serialized_obj)
-            deserialized_obj = json.loads(serialized_obj)
-            if deserialized_obj[0]['fields'] != deserialized_obj[1]['fields']:
-                if current_request() and current_request().user and current_request().user.is_authenticated:
-                    LogEntry.objects.create(
-                        user=current_request().user,
-                        content_type=ContentType.objects.get_for_model(instance),
-                        object_id=instance.id,
-                        object_repr=str(instance),
-                        action_flag=CHANGE,
-                        change_message="old:{},new:{}".format(deserialized_obj[0]['fields'], deserialized_obj[1]['fields'])
-                    )
+    # loaded objects diff against the values they were loaded with, no query
+    if AUDIT_CHANGES and isinstance(instance, ChangeTrackingMixin) and not raw and not instance._state.adding:
+        changes = instance.get_field_changes(update_fields)
+        if changes:
+            user_id = get_audit_user_id()
+            if user_id is not None:
+                record_audit_event(user_id, instance, CHANGE, changes)
+
+
+@receiver(post_save,
+          weak=FALSE,
+          dispatch_uid='change_tracking_post_save')
+def change_tracking_signal(sender, instance, raw, update_fields, **kwargs):
+    # saved values are the base of the next diff
+    if isinstance(instance, ChangeTrackingMixin) and not raw:
+        instance.snapshot_fields(update_fields)
+
+
+def get_audit_user_id():
+    request = current_request()
+    user = getattr(request, "user", None)
+    return user.id if user is not None and user.is_authenticated else None
 
 
 @receiver(post_save,
           weak=FALSE,
           dispatch_uid='post_save')
 def post_save_signal(sender, instance, created, raw, using, update_fields, **kwargs):
-    if sender._meta.app_label == get_this_app_name():
+    if sender._meta.app_label == get_this_app_name() and sender not in NOT_LOGGED_MODELS:
         if created:
-            if current_request() and current_request().user and current_request().user.is_authenticated:
-                LogEntry.objects.create(
-                    user=current_request().user,
-                    content_type=ContentType.objects.get_for_model(instance),
-                    object_id=instance.id,
-                    object_repr=str(instance),
-                    action_flag=ADDITION,
-                    change_message=current_data()
-                )
+            user_id = get_audit_user_id()
+            if user_id is not None:
+                record_audit_event(user_id, instance, ADDITION, current_data())
 
 
 @receiver(post_save,
@@ -88,16 +100,296 @@ def employer_exclusively_post_save_signal(sender, instance, created, raw, using,
           weak=FALSE,
           dispatch_uid='pre_delete')
 def pre_delete_signal(sender, instance, using, origin, **kwargs):
-    if sender._meta.app_label == get_this_app_name():
-        serialized_obj = serializers.serialize('json', [instance])
-        LogEntry.objects.create(
-            user=current_request().user,
-            content_type=ContentType.objects.get_for_model(instance),
-            object_id=instance.id,
-            object_repr=str(instance),
-            action_flag=DELETION,
-            change_message="deleted:" + serialized_obj
-        )
+    # deletes outside requests (shell, management commands) have nobody to log
+    if sender._meta.app_label == get_this_app_name() and sender not in NOT_LOGGED_MODELS:
+        user_id = get_audit_user_id()
+        if user_id is not None:
+            record_audit_event(user_id, instance, DELETION)
+
+
+@receiver(post_save,
+          sender=RollCall,
+          weak=FALSE,
+          dispatch_uid='roll_call_post_save')
+@receiver(post_delete,
+          sender=RollCall,
+          weak=FALSE,
+          dispatch_uid='roll_call_post_delete')
+def roll_call_summary_signal(sender, instance, raw=False, **kwargs):
+    # the punch commits and releases its lock before the day is summarized again
+    if not raw:
+        queue_attendance_summaries([instance.employee_id], [instance.date])
+        if instance.employer_id is not None:
+            invalidate_employer_dashboard(instance.employer_id)
+
+
+def refresh_employee_request_summaries(employee_id, category, date):
+    # only manual traffics and hourly requests take part in the daily status, daily requests in the month they start in,
+    # refreshed along with the day
+    if date and (category == EmployeeRequest.CATEGORY_MANUAL_TRAFFIC or category in EmployeeRequest.HOURLY_REQUESTS_LIST
+                 or category in EmployeeRequest.DAILY_REQUESTS_LIST):
+        queue_attendance_summaries([employee_id], [date])
+
+
+@receiver(pre_save,
+          sender=EmployeeRequest,
+          weak=FALSE,
+          dispatch_uid='employee_request_pre_save')
+def employee_request_previous_summary_signal(sender, instance, raw, **kwargs):
+    # the day the request counted in before this save, from the values it was loaded with
+    instance.previous_summary_key = None
+    if not raw and not instance._state.adding:
+        instance.previous_summary_key = (instance.get_loaded_value("employee_id", instance.employee_id), instance.get_loaded_value("category", instance.category),
+                                         instance.get_loaded_value("date", instance.date))
+
+
+@receiver(post_save,
+          sender=EmployeeRequest,
+          weak=FALSE,
+          dispatch_uid='employee_request_post_save')
+@receiver(post_delete,
+          sender=EmployeeRequest,
+          weak=FALSE,
+          dispatch_uid='employee_request_post_delete')
+def employee_request_summary_signal(sender, instance, raw=False, **kwargs):
+    # a request moved to another day, category or employee refreshes where it was counted too
+    if raw:
+        return
+    keys = {(instance.employee_id, instance.category, str_to_date(instance.date) if instance.date else None)}
+    previous = getattr(instance, "previous_summary_key", None)
+    if previous is not None:
+        keys.add((previous[0], previous[1], str_to_date(previous[2]) if previous[2] else None))
+    for employee_id, category, date in keys:
+        refresh_employee_request_summaries(employee_id, category, date)
+
+
+@receiver(post_save,
+          sender=WorkShiftPlan,
+          weak=FALSE,
+          dispatch_uid='work_shift_plan_post_save')
+def work_shift_plan_summary_signal(sender, instance, created, raw, **kwargs):
+    # the day the plan was summarized on as well, its date may have changed
+    if not raw:
+        dates = set(DailyAttendanceSummary.objects.filter(plan=instance).values_list("date", flat=True))
+        dates.add(instance.date)
+        queue_attendance_summaries(Employee.objects.filter(work_shift_id=instance.work_shift_id).values_list("id", flat=True), dates)
+
+
+@receiver(post_delete,
+          sender=WorkShiftPlan,
+          weak=FALSE,
+          dispatch_uid='work_shift_plan_post_delete')
+def work_shift_plan_delete_summary_signal(sender, instance, **kwargs):
+    # the cascade took the daily summaries of the plan, the month they were rolled up in is rolled up again
+    queue_attendance_summaries(Employee.objects.filter(work_shift_id=instance.work_shift_id).values_list("id", flat=True), [instance.date])
+
+
+@receiver(pre_save,
+          sender=Employee,
+          weak=FALSE,
+          dispatch_uid='employee_pre_save')
+def employee_previous_work_shift_signal(sender, instance, raw, **kwargs):
+    instance.previous_work_shift_id = None if raw or instance._state.adding else instance.get_loaded_value("work_shift_id", instance.work_shift_id)
+
+
+@receiver(post_save,
+          sender=Employee,
+          weak=FALSE,
+          dispatch_uid='employee_post_save')
+def employee_summary_signal(sender, instance, created, raw, update_fields, **kwargs):
+    # days summarized under the old work shift from the start of the new one (today at the latest) on are rebuilt on the next report
+    if not created and not raw and instance.work_shift_id != getattr(instance, "previous_work_shift_id", instance.work_shift_id):
+        start = min(str_to_date(instance.shift_start_date), jdatetime.date.fromgregorian(date=localdate()))
+        DailyAttendanceSummary.objects.filter(employee=instance, date__gte=start).delete()
+        MonthlyAttendanceSummary.objects.filter(Q(year__gt=start.year) | Q(year=start.year, month__gte=start.month), employee=instance).delete()
+
+
+@receiver(pre_save,
+          sender=RollCall,
+          weak=FALSE,
+          dispatch_uid='roll_call_employer_pre_save')
+@receiver(pre_save,
+          sender=EmployeeRequest,
+          weak=FALSE,
+          dispatch_uid='employee_request_employer_pre_save')
+def employer_key_signal(sender, instance, raw, **kwargs):
+    # employer lists filter these tables by their own employer key, it always follows the employee
+    if not raw and instance.employee_id is not None:
+        if sender.employee.is_cached(instance):
+            instance.employer_id = instance.employee.employer_id
+        else:
+            instance.employer_id = Employee.objects.values_list("employer_id", flat=True).get(id=instance.employee_id)
+
+
+@receiver(post_save,
+          sender=Employee,
+          weak=FALSE,
+          dispatch_uid='employee_employer_post_save')
+def employee_employer_signal(sender, instance, created, raw, update_fields, **kwargs):
+    # an employee moved to another employer takes its roll calls and requests along, previous_employer_signal read the old one
+    if not created and not raw and instance.employer_id != getattr(instance, "previous_employer_id", instance.employer_id):
+        RollCall.objects.filter(employee=instance).exclude(employer_id=instance.employer_id).update(employer_id=instance.employer_id)
+        EmployeeRequest.objects.filter(employee=instance).exclude(employer_id=instance.employer_id).update(employer_id=instance.employer_id)
+
+
+@receiver(pre_save,
+          sender=Workplace,
+          weak=FALSE,
+          dispatch_uid='workplace_pre_save')
+@receiver(pre_save,
+          sender=Employee,
+          weak=FALSE,
+          dispatch_uid='employee_workplace_index_pre_save')
+def previous_employer_signal(sender, instance, raw, **kwargs):
+    # the employer whose geofence held the workplace or the assignments of the employee before this save
+    instance.previous_employer_id = None if raw or instance._state.adding else instance.get_loaded_value("employer_id")
+
+
+@receiver(post_save,
+          sender=Workplace,
+          weak=FALSE,
+          dispatch_uid='workplace_post_save')
+@receiver(post_delete,
+          sender=Workplace,
+          weak=FALSE,
+          dispatch_uid='workplace_post_delete')
+def workplace_index_signal(sender, instance, raw=False, **kwargs):
+    # created, updated, imported, moved and deleted workplaces rebuild the geofence of their employers on the next punch
+    if not raw:
+        invalidate_workplace_index(*{instance.employer_id, getattr(instance, "previous_employer_id", None)} - {None})
+
+
+@receiver(post_save,
+          sender=Employee,
+          weak=FALSE,
+          dispatch_uid='employee_workplace_index_post_save')
+def employee_employer_index_signal(sender, instance, raw, **kwargs):
+    # the assignments of an employee are indexed under its employer, moving it changes the geofence of both
+    previous_employer_id = getattr(instance, "previous_employer_id", None)
+    if not raw and previous_employer_id is not None and previous_employer_id != instance.employer_id:
+        invalidate_workplace_index(previous_employer_id, instance.employer_id)
+
+
+@receiver(m2m_changed,
+          sender=Employee.workplace.through,
+          weak=FALSE,
+          dispatch_uid='employee_workplace_m2m_changed')
+def employee_workplace_index_signal(sender, instance, action, **kwargs):
+    # instance is the employee or, from the reverse side, the workplace, both carry the employer. dropped for every
+    # process once committed, like workplace changes
+    if action in ("post_add", "post_remove", "post_clear"):
+        invalidate_workplace_index(instance.employer_id)
+
+
+@receiver(post_save,
+          sender=User,
+          weak=FALSE,
+          dispatch_uid='user_auth_context_post_save')
+@receiver(post_save,
+          sender=Manager,
+          weak=FALSE,
+          dispatch_uid='manager_auth_context_post_save')
+@receiver(post_save,
+          sender=Employer,
+          weak=FALSE,
+          dispatch_uid='employer_auth_context_post_save')
+@receiver(post_save,
+          sender=Employee,
+          weak=FALSE,
+          dispatch_uid='employee_auth_context_post_save')
+@receiver(post_delete,
+          sender=User,
+          weak=FALSE,
+          dispatch_uid='user_auth_context_post_delete')
+@receiver(post_delete,
+          sender=Manager,
+          weak=FALSE,
+          dispatch_uid='manager_auth_context_post_delete')
+@receiver(post_delete,
+          sender=Employer,
+          weak=FALSE,
+          dispatch_uid='employer_auth_context_post_delete')
+@receiver(post_delete,
+          sender=Employee,
+          weak=FALSE,
+          dispatch_uid='employee_auth_context_post_delete')
+def auth_context_signal(sender, instance, **kwargs):
+    # activation, expiration and the employer of a manager are part of the cached context and of token claims
+    invalidate_auth_context(instance.id)
+
+
+@receiver(m2m_changed,
+          sender=User.user_permissions.through,
+          weak=FALSE,
+          dispatch_uid='user_permissions_auth_context_m2m_changed')
+@receiver(m2m_changed,
+          sender=User.groups.through,
+          weak=FALSE,
+          dispatch_uid='user_groups_auth_context_m2m_changed')
+def user_permissions_auth_context_signal(sender, instance, action, reverse, pk_set, **kwargs):
+    # from the reverse side instance is the permission or group and pk_set the users, cleared ones are read before the clear
+    if not reverse and action in ("post_add", "post_remove", "post_clear"):
+        invalidate_auth_context(instance.id)
+    elif reverse and action in ("post_add", "post_remove"):
+        invalidate_auth_context(*pk_set)
+    elif reverse and action == "pre_clear":
+        invalidate_auth_context(*instance.user_set.values_list("id", flat=True))
+
+
+@receiver(m2m_changed,
+          sender=Group.permissions.through,
+          weak=FALSE,
+          dispatch_uid='group_permissions_auth_context_m2m_changed')
+def group_permissions_auth_context_signal(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse and action in ("post_add", "post_remove", "post_clear"):
+        invalidate_auth_context(*User.objects.filter(groups=instance).values_list("id", flat=True))
+    elif reverse and action in ("post_add", "post_remove"):
+        invalidate_auth_context(*User.objects.filter(groups__in=pk_set).values_list("id", flat=True))
+    elif reverse and action == "pre_clear":
+        invalidate_auth_context(*User.objects.filter(groups__permissions=instance).values_list("id", flat=True))
+
+
+@receiver(post_migrate,
+          weak=FALSE,
+          dispatch_uid='cache_table_post_migrate')
+def cache_table_signal(sender, using, **kwargs):
+    # the DatabaseCache table comes with the migrations of this app, the signals below already write to it. other backends ignore it
+    if sender.name == get_this_app_name():
+        call_command("createcachetable", database=using, verbosity=0)
+
+
+@receiver(post_migrate,
+          weak=FALSE,
+          dispatch_uid='roll_call_partitions_post_migrate')
+def roll_call_partitions_signal(sender, using, **kwargs):
+    # every deploy creates the coming partitions as well, roll calls do not wait in the default partition for the cron job
+    connection = connections[using]
+    if sender.name == get_this_app_name() and connection.vendor == "postgresql":
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            if is_partitioned(cursor):
+                ensure_partitions(cursor)
+
+
+@receiver(post_migrate,
+          weak=FALSE,
+          dispatch_uid='permission_catalogue_post_migrate')
+def permission_catalogue_migrate_signal(sender, **kwargs):
+    # the permissions of new models are created before the post_migrate of this app, after the cache table
+    if sender.name == get_this_app_name():
+        invalidate_permission_catalogue()
+
+
+@receiver(post_save,
+          sender=Permission,
+          weak=FALSE,
+          dispatch_uid='permission_catalogue_post_save')
+@receiver(post_delete,
+          sender=Permission,
+          weak=FALSE,
+          dispatch_uid='permission_catalogue_post_delete')
+def permission_catalogue_signal(sender, **kwargs):
+    # every process reloads its catalogue on the next check
+    invalidate_permission_catalogue()
 
 
 @receiver(post_delete,
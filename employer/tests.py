@@ -1 +1,78 @@
-# Create your tests here.
+import datetime
+import io
+
+import openpyxl
+from django.contrib.auth.models import Permission
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+
+from employer.geofence import get_workplace_index
+from employer.models import Employer, Manager, Workplace
+
+
+class ClaimsRevocationTest(TestCase):
+    """access tokens carry the permissions of their user, a revoked permission must not outlive them"""
+
+    def setUp(self):
+        employer = Employer.objects.create(mobile="09120000001", email="employer@radkan.ir", username="employer")
+        self.manager = Manager.objects.create(mobile="09120000002", employer_id=employer.id, username="manager", expiration_date=now() + datetime.timedelta(days=1))
+        self.manager.set_password("Abcd1234!xyz")
+        self.manager.save()
+        self.manager.user_permissions.add(Permission.objects.get(codename="view_workplace"))
+
+    def get_access_token(self):
+        response = self.client.post("/api/v1/token/", {"mobile": self.manager.mobile, "password": "Abcd1234!xyz"})
+        self.assertEqual(response.status_code, 200)
+        return response.json()["access"]
+
+    def get_workplaces(self, access):
+        return self.client.get("/api/v1/get_workplaces_list/", HTTP_AUTHORIZATION="Bearer " + access).status_code
+
+    def test_revoked_permission(self):
+        access = self.get_access_token()
+        self.assertEqual(self.get_workplaces(access), 200)
+        self.manager.user_permissions.clear()
+        self.assertEqual(self.get_workplaces(access), 403)
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_revoked_permission_with_process_cache(self):
+        # removed without signals, as by another process whose invalidation never reaches a cache private to this one
+        access = self.get_access_token()
+        self.assertEqual(self.get_workplaces(access), 200)
+        Manager.user_permissions.through.objects.filter(user_id=self.manager.id).delete()
+        self.assertEqual(self.get_workplaces(access), 403)
+
+
+class WorkplaceImportTest(TestCase):
+    """workplaces imported from excel are bulk created without signals, punches still have to see them"""
+
+    def setUp(self):
+        self.employer = Employer.objects.create(mobile="09120000001", email="employer@radkan.ir", username="employer")
+        manager = Manager.objects.create(mobile="09120000002", employer_id=self.employer.id, username="manager", expiration_date=now() + datetime.timedelta(days=1))
+        manager.set_password("Abcd1234!xyz")
+        manager.save()
+        manager.user_permissions.add(*Permission.objects.filter(codename__in=("add_workplace", "change_workplace")))
+        response = self.client.post("/api/v1/token/", {"mobile": manager.mobile, "password": "Abcd1234!xyz"})
+        self.access = response.json()["access"]
+        Workplace.objects.create(employer=self.employer, name="old", city="tehran", radius=100, latitude=35.7, longitude=51.4)
+
+    def get_excel_file(self, *rows):
+        workbook = openpyxl.Workbook()
+        workbook.active.append(["name", "city", "address", "radius", "latitude", "longitude"])
+        for row in rows:
+            workbook.active.append(row)
+        file = io.BytesIO()
+        workbook.save(file)
+        file.seek(0)
+        file.name = "workplaces.xlsx"
+        return file
+
+    def test_imported_workplaces_are_indexed(self):
+        self.assertEqual(len(get_workplace_index(self.employer.id).workplaces), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/v1/import_work_places_excel/", {"excel_file": self.get_excel_file(["new", "tehran", None, 100, 35.8, 51.5])},
+                                        HTTP_AUTHORIZATION="Bearer " + self.access)
+        self.assertEqual(response.status_code, 200)
+        index = get_workplace_index(self.employer.id)
+        self.assertEqual(len(index.workplaces), 2)
+        self.assertEqual(index.nearest(35.8, 51.5)[0], Workplace.objects.get(name="new").id)
@@ -27,6 +27,7 @@ urlpatterns = [
     path('update_work_place/<int:oid>/', views.update_work_place, name='update_work_place'),
     path('get_workplaces_excel/', views.get_workplaces_excel, name='get_workplaces_excel'),
     path('search_workplaces/', views.search_workplaces, name='search_workplaces'),
+    path('get_nearby_workplaces/', views.get_nearby_workplaces, name='get_nearby_workplaces'),
     path('import_work_places_excel/', views.import_work_places_excel, name='import_work_places_excel'),
     path('delete_workplace/<int:oid>/', views.delete_workplace, name='delete_workplace'),
     path('get_workplace/<int:oid>/', views.get_workplace, name='get_workplace'),
@@ -111,6 +112,8 @@ urlpatterns = [
     # ----------------------------employee_views------------------------------------
     path('create_employee_request_for_employees/', employee_views.create_employee_request_for_employees, name='create_employee_request_for_employees'),
     path('create_roll_call/', employee_views.create_roll_call, name='create_roll_call'),
+    path('create_roll_calls_batch/', employee_views.create_roll_calls_batch, name='create_roll_calls_batch'),
+    path('create_employees_roll_calls_batch/', employee_views.create_employees_roll_calls_batch, name='create_employees_roll_calls_batch'),
     path('get_employee_profile/', employee_views.get_employee_profile, name='get_employee_profile'),
     path('get_employee_work_shift_plans_list/', employee_views.get_employee_work_shift_plans_list, name='get_employee_work_shift_plans_list'),
     path('get_message/<int:oid>/', employee_views.get_message, name='get_message'),
@@ -129,6 +132,10 @@ urlpatterns = [
     path('report_employees_leave/', report_views.report_employees_leave, name='report_employees_leave'),
     path('report_project_traffic/', report_views.report_project_traffic, name='report_project_traffic'),
     path('get_employees_leave_excel/', report_views.get_employees_leave_excel, name='get_employees_leave_excel'),
+    path('create_report_job/', report_views.create_report_job, name='create_report_job'),
+    path('get_report_jobs/', report_views.get_report_jobs, name='get_report_jobs'),
+    path('get_report_job/<int:oid>/', report_views.get_report_job, name='get_report_job'),
+    path('download_report_job/<int:oid>/', report_views.download_report_job, name='download_report_job'),
 
     # -------------------------------policy_views---------------------------------
     path('get_work_policies_list/', policy_views.get_work_policies_list, name='get_work_policies_list'),
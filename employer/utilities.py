@@ -1,13 +1,22 @@
+import csv
+import json
 import random
 import re
+import tempfile
 from datetime import timezone
+from time import monotonic
 
 import jdatetime
-import pandas as pd
+from django.conf import settings
+from django.core.cache import cache, caches, DEFAULT_CACHE_ALIAS
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
 from django.core.exceptions import ValidationError
-from django.db.models import ExpressionWrapper, Sum, DurationField, F, Q
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import ExpressionWrapper, Sum, DurationField, F
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils import timezone
+from openpyxl import Workbook
 
 POST_METHOD_STR = "POST"
 GET_METHOD_STR = "GET"
@@ -16,6 +25,8 @@ DELETE_METHOD_STR = "DELETE"
 DATE_FORMAT_STR = "%Y-%m-%d"
 TIME_FORMAT_STR = "%H:%M"
 DATE_TIME_FORMAT_STR = "%Y-%m-%d %H:%M"
+EXPORT_CHUNK_SIZE = 500
+FILE_CHUNK_SIZE = 64 * 1024
 
 ADD_PERMISSION_STR = "add"
 CHANGE_PERMISSION_STR = "change"
@@ -32,10 +43,61 @@ def get_random_int_code(digits=4):
     return random.randint(a, b)
 
 
+def is_cache_shared(alias=DEFAULT_CACHE_ALIAS):
+    # local memory and dummy caches are private to each process, what one process invalidates the others never see
+    return not isinstance(caches[alias], (LocMemCache, DummyCache))
+
+
+SHARED_VERSION_SECONDS = getattr(settings, "SHARED_VERSION_SECONDS", 5)
+SHARED_VERSION_LIMIT = 100000
+
+# key: (monotonic time read, version) of the versions this process read lately
+_shared_versions = {}
+
+
+def get_shared_version(key, max_age=0):
+    """
+    a random number kept in the cache under key until invalidate_shared_versions, data every process holds in memory is
+    current while its version is. a version read less than max_age seconds ago is taken without reading the cache again,
+    invalidations of other processes show after that long. None when the cache is private to the process, nothing may be kept then
+    """
+    if not is_cache_shared():
+        return None
+    read = _shared_versions.get(key)
+    if read is not None and monotonic() - read[0] < max_age:
+        return read[1]
+    version = cache.get(key)
+    if version is None:
+        # a random number instead of a counter, a version lost with the cache comes back as a new one
+        cache.add(key, random.getrandbits(31), None)
+        version = cache.get(key)
+    if len(_shared_versions) >= SHARED_VERSION_LIMIT:
+        # one key per user that signed in, read again once forgotten
+        _shared_versions.clear()
+    _shared_versions[key] = monotonic(), version
+    return version
+
+
+def forget_shared_versions(keys):
+    cache.delete_many(keys)
+    for key in keys:
+        _shared_versions.pop(key, None)
+
+
+def invalidate_shared_versions(*keys):
+    # dropped again once committed, a process that took a new version before the commit may have read the old rows
+    forget_shared_versions(keys)
+    transaction.on_commit(lambda: forget_shared_versions(keys))
+
+
 def time_to_minute(time_field):
     return time_field.hour * 60 + time_field.minute
 
 
+def time_to_second(time_field):
+    return time_to_minute(time_field) * 60 + time_field.second
+
+
 def total_minute_to_hour_and_minutes(total_minute=0):
     hours = total_minute // 60
     minutes = total_minute % 60
@@ -47,6 +109,9 @@ def subtract_times(start, end):
 
 
 def calculate_daily_shift_duration(plan):
+    if plan.first_period_start is None:
+        # floating plans have no periods, a day of them is the duty duration
+        return plan.daily_duty_duration or 0
     first_duration = subtract_times(plan.first_period_start, plan.first_period_end)
     this_duration = first_duration
     if plan.second_period_start is not None and plan.second_period_end is not None:
@@ -58,16 +123,44 @@ def str_to_time(string):
     return jdatetime.datetime.strptime(string, TIME_FORMAT_STR).time()
 
 
+def str_to_date(string):
+    if isinstance(string, jdatetime.date):
+        return string
+    return jdatetime.datetime.strptime(string, DATE_FORMAT_STR).date()
+
+
+def get_month_dates(year, month):
+    day = jdatetime.date(year, month, 1)
+    dates = []
+    while day.month == month:
+        dates.append(day)
+        day += jdatetime.timedelta(days=1)
+    return dates
+
+
+def get_period_dates(start, end):
+    # every day from start to end, reports filter on these rather than on the two ends only
+    day, end = str_to_date(start), str_to_date(end)
+    dates = []
+    while day <= end:
+        dates.append(day)
+        day += jdatetime.timedelta(days=1)
+    return dates
+
+
 def calculate_daily_request_duration(employee_requests, plans, kwargs):
+    # works on lists as well as querysets, plans are only iterated
     total_duration = 0
     for emp_req in employee_requests:
-        if emp_req.date < kwargs["start"]:
-            emp_req.date = kwargs["start"]
-        if emp_req.to_date > kwargs["end"]:
-            emp_req.to_date = kwargs["end"]
-        this_plans = plans.filter(Q(date__gte=emp_req.date) | Q(date__lte=emp_req.to_date))
-        for plan in this_plans:
-            total_duration += calculate_daily_shift_duration(plan)
+        first_date = emp_req.date
+        last_date = emp_req.end_date or emp_req.date
+        if kwargs.get("start") and first_date < str_to_date(kwargs["start"]):
+            first_date = str_to_date(kwargs["start"])
+        if kwargs.get("end") and last_date > str_to_date(kwargs["end"]):
+            last_date = str_to_date(kwargs["end"])
+        for plan in plans:
+            if first_date <= plan.date <= last_date:
+                total_duration += calculate_daily_shift_duration(plan)
     return total_duration
 
 
@@ -94,6 +187,15 @@ def calculate_roll_call_query_duration(q):
     return hours, minutes, total_minutes
 
 
+def calculate_roll_calls_duration(roll_calls):
+    # in memory counterpart of calculate_roll_call_query_duration for already loaded roll calls
+    total_seconds = 0
+    for roll_call in roll_calls:
+        total_seconds += time_to_second(roll_call.departure) - time_to_second(roll_call.arrival)
+    total_minutes = total_seconds // 60
+    return total_minutes // 60, total_minutes % 60, total_minutes
+
+
 def national_code_validation(national_code: str):
     if national_code is None:
         return
@@ -129,24 +231,53 @@ def national_code_validation(national_code: str):
         raise ValidationError(msg)
 
 
-def send_response_file(data, file_name, file_format='excel'):
-    df = pd.DataFrame(data)
-    print(file_format)
-    if file_format == 'excel':
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename={}.xlsx'.format(file_name)
-        df.to_excel(response, index=False, engine='openpyxl')
-    elif file_format == 'csv':
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename={}.csv'.format(file_name)
-        df.to_csv(response, index=False)
-    elif file_format == 'json':
-        response = HttpResponse(content_type='application/json')
-        response['Content-Disposition'] = 'attachment; filename={}.json'.format(file_name)
-        response.write(df.to_json(orient='records'))
-    else:
-        response = HttpResponse("Unsupported format", status=400)
+class Echo:
+    """pseudo buffer, csv.writer hands every written row straight back"""
+
+    def write(self, value):
+        return value
+
+
+def csv_stream(rows):
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow(row)
 
+
+def json_stream(rows):
+    yield "["
+    for i, row in enumerate(rows):
+        yield ("," if i else "") + json.dumps({str(j): value for j, value in enumerate(row)}, ensure_ascii=False, default=str)
+    yield "]"
+
+
+def excel_stream(rows):
+    # write only sheets keep appended rows in a temporary file, the finished workbook is sent in chunks
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for row in rows:
+        sheet.append(row)
+    with tempfile.TemporaryFile() as file:
+        workbook.save(file)
+        file.seek(0)
+        while chunk := file.read(FILE_CHUNK_SIZE):
+            yield chunk
+
+
+FILE_FORMATS = {
+    'excel': (excel_stream, 'xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'csv': (csv_stream, 'csv', 'text/csv'),
+    'json': (json_stream, 'json', 'application/json'),
+}
+
+
+def send_response_file(data, file_name, file_format='excel'):
+    """data is any iterable of rows, generators are consumed while the response is being sent"""
+    if file_format not in FILE_FORMATS:
+        return HttpResponse("Unsupported format", status=400)
+    stream, extension, content_type = FILE_FORMATS[file_format]
+    response = StreamingHttpResponse(stream(data), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename={}.{}'.format(file_name, extension)
     return response
 
 
@@ -179,7 +310,7 @@ def positive_only(func):
             if i < 0:
                 # print(i)
                 raise ValidationError("i is negative")
-        func(self, *args, )
+        return func(self, *args, )
         # print("After calling the function.")
 
     return wrapper
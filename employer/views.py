@@ -1,9 +1,10 @@
 from datetime import timedelta
+from itertools import chain
 
 import openpyxl
 from django.core.exceptions import PermissionDenied
 from django.db.models import ProtectedError
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404
 from django.shortcuts import get_object_or_404, get_list_or_404
 from django.utils import timezone
 from django.utils.timezone import now, make_aware
@@ -13,24 +14,27 @@ from rest_framework.decorators import authentication_classes, permission_classes
 from rest_framework.response import Response
 
 from employer.apps import get_this_app_name
+from employer.authorization import get_request_auth_context, get_permission_catalogue
+from employer.geofence import get_workplace_index
 from employer.populate import populate_roll_call, populate_shift_plans
 from employer.serializers import *
 from employer.utilities import send_response_file, POST_METHOD_STR, PUT_METHOD_STR, VIEW_PERMISSION_STR, CHANGE_PERMISSION_STR, ADD_PERMISSION_STR, \
-    DELETE_METHOD_STR, DELETE_PERMISSION_STR, DATE_FORMAT_STR, DATE_TIME_FORMAT_STR, GET_METHOD_STR, str_to_time
+    DELETE_METHOD_STR, DELETE_PERMISSION_STR, DATE_FORMAT_STR, DATE_TIME_FORMAT_STR, GET_METHOD_STR, str_to_time, EXPORT_CHUNK_SIZE
 from melipayamak import Api
 
 
 def get_acceptable_permissions(model=Manager, filters=None):
     base_list = [WorkShift, WorkShiftPlan, Workplace, Employee, Holiday, EmployeeRequest, Project, WorkCategory,
                  WorkPolicy, ManualTrafficPolicy, OvertimePolicy, LeavePolicy, EarnedLeavePolicy, SickLeavePolicy,
-                 WorkMissionPolicy, RadkanMessage]
+                 WorkMissionPolicy, RadkanMessage, RollCall]
     employer_list = [Manager, Employer, MelliSMSInfo, RTSP, ]
     if model.__name__ == Employer.__name__:
         base_list.extend(employer_list)
-    model_names = [m.__name__.lower() for m in base_list]
-    perms = Permission.objects.filter(content_type__model__in=model_names, content_type__app_label=get_this_app_name())
+    model_names = {m.__name__.lower() for m in base_list}
+    # taken from the permission catalogue, no query
+    perms = [perm for perm in get_permission_catalogue().permissions.values() if perm.content_type.model in model_names]
     if filters:
-        perms = perms.filter(codename__in=filters)
+        perms = [perm for perm in perms if perm.codename in filters]
     return perms
 
 
@@ -55,22 +59,17 @@ def test(request, key, **kwargs):
 def check_user_permission(action, model):
     def decorator(function):
         def wrapper(request, *args, **kwargs):
-            print("request.user:", request.user.id)
             # print("start o decorator:", request, args, kwargs)
             if isinstance(request.data, dict):
                 kwargs.update(request.data.copy())
             if request.method == GET_METHOD_STR:
-                kwargs.update(request.query_params.copy())
-            try:
-                employer = Employer.objects.get(id=request.user.id, is_active=True)
-                kwargs["employer"] = employer.id
-            except Employer.DoesNotExist:
-                try:
-                    manager = Manager.objects.get(id=request.user.id, is_active=True, expiration_date__gte=now())
-                    kwargs["manager"] = manager.id
-                    kwargs["employer"] = manager.employer_id
-                except Manager.DoesNotExist:
-                    return Response({"msg": "unauthorized request"}, status=status.HTTP_401_UNAUTHORIZED)
+                kwargs.update(request.query_params.dict())
+            context = get_request_auth_context(request)
+            if not context.is_authorized():
+                return Response({"msg": "unauthorized request"}, status=status.HTTP_401_UNAUTHORIZED)
+            if context.manager_id is not None:
+                kwargs["manager"] = context.manager_id
+            kwargs["employer"] = context.employer_id
             if action is not None and model is not None:
                 if isinstance(model, str):
                     model_name = model
@@ -82,7 +81,7 @@ def check_user_permission(action, model):
                     perms = (perm,)
                 else:
                     perms = perm
-                if not request.user.has_perms(perms):
+                if not context.has_perms(perms):
                     raise PermissionDenied
             # print(request, args, kwargs)
             result = function(request, *args, **kwargs)
@@ -129,8 +128,7 @@ def get_permissions(request, **kwargs):
 @api_view()
 @check_user_permission(None, None)
 def get_user_permissions(request, **kwargs):
-    permissions = request.user.user_permissions.all() | Permission.objects.filter(group__user=request.user)
-    return Response(PermissionSerializer(permissions, many=True).data, status=status.HTTP_200_OK)
+    return Response(PermissionSerializer(get_request_auth_context(request).get_permissions(), many=True).data, status=status.HTTP_200_OK)
 
 
 @api_view([POST_METHOD_STR])
@@ -353,6 +351,26 @@ def search_workplaces(request, **kwargs):
     return Response(ser.data, status=status.HTTP_200_OK)
 
 
+@api_view()
+@check_user_permission(VIEW_PERMISSION_STR, Workplace)
+def get_nearby_workplaces(request, **kwargs):
+    # workplaces with their center at most distance meters from the point closest first, only the nearest one without distance
+    try:
+        latitude, longitude = float(kwargs["latitude"]), float(kwargs["longitude"])
+        distance = float(kwargs["distance"]) if kwargs.get("distance") else None
+    except (KeyError, TypeError, ValueError):
+        return Response({"msg": "invalid parameters"}, status=status.HTTP_400_BAD_REQUEST)
+    index = get_workplace_index(kwargs["employer"])
+    if distance is None:
+        nearest = index.nearest(latitude, longitude)
+        found = [nearest] if nearest else []
+    else:
+        found = index.within(latitude, longitude, distance)
+    workplaces = Workplace.objects.in_bulk([workplace_id for workplace_id, _ in found])
+    data = [dict(WorkplaceOutputSerializer(workplaces[workplace_id]).data, distance=round(meters)) for workplace_id, meters in found if workplace_id in workplaces]
+    return Response(data, status=status.HTTP_200_OK)
+
+
 @api_view([DELETE_METHOD_STR])
 @check_user_permission(DELETE_PERMISSION_STR, Workplace)
 def delete_workplace(request, oid, **kwargs):
@@ -407,13 +425,15 @@ def delete_employee(request, oid, **kwargs):
 @api_view()
 @check_user_permission(VIEW_PERMISSION_STR, Employee)
 def get_employees_excel(request, **kwargs):
-    data_list = get_list_or_404(Employee, employer_id=kwargs["employer"])
-    data = [["mobile", "first_name", "last_name", "national_code", "personnel_code", "workplace", "work_policy", "work_shift", "shift_start_date", "shift_end_date"]]
-    for fin in data_list:
-        data.append([str(fin.mobile), fin.first_name, fin.last_name, fin.national_code, fin.personnel_code,
-                     fin.workplace.name, fin.work_policy.name, fin.work_shift.name,
-                     fin.shift_start_date.strftime(DATE_FORMAT_STR), fin.shift_end_date.strftime(DATE_FORMAT_STR)])
-    return send_response_file(data, 'employees')
+    data_list = Employee.objects.filter(employer_id=kwargs["employer"]).select_related("work_policy", "work_shift").prefetch_related("workplace")
+    if not data_list.exists():
+        raise Http404
+    header = ["mobile", "first_name", "last_name", "national_code", "personnel_code", "workplace", "work_policy", "work_shift", "shift_start_date", "shift_end_date"]
+    rows = ([str(fin.mobile), fin.first_name, fin.last_name, fin.national_code, fin.personnel_code,
+             ", ".join(workplace.name for workplace in fin.workplace.all()), fin.work_policy.name if fin.work_policy else None, fin.work_shift.name,
+             fin.shift_start_date.strftime(DATE_FORMAT_STR), fin.shift_end_date.strftime(DATE_FORMAT_STR) if fin.shift_end_date else None]
+            for fin in data_list.iterator(chunk_size=EXPORT_CHUNK_SIZE))
+    return send_response_file(chain([header], rows), 'employees', kwargs.get("file_format", "excel"))
 
 
 @api_view()
@@ -881,7 +901,7 @@ def create_employee_request(request, **kwargs):
 @api_view([PUT_METHOD_STR])
 @check_user_permission(CHANGE_PERMISSION_STR, EmployeeRequest)
 def update_employee_request_status(request, oid, **kwargs):
-    r = get_object_or_404(EmployeeRequest, id=oid, employee__employer_id=kwargs["employer"])
+    r = get_object_or_404(EmployeeRequest, id=oid, employer_id=kwargs["employer"])
     ser = EmployeeRequestSerializer(instance=r, data={"status": request.data.get("status")}, partial=True)
     if ser.is_valid():
         e = ser.save()
@@ -913,7 +933,7 @@ def employee_requests_filter(request, result):
 @api_view()
 @check_user_permission(VIEW_PERMISSION_STR, EmployeeRequest)
 def search_employee_requests(request, **kwargs):
-    result = employee_requests_filter(request, EmployeeRequest.objects.filter(employee__employer_id=kwargs["employer"]))
+    result = employee_requests_filter(request, EmployeeRequest.objects.filter(employer_id=kwargs["employer"]))
     ser = EmployeeRequestOutputSerializer(result, many=True)
     return Response(ser.data, status=status.HTTP_200_OK)
 
@@ -921,12 +941,14 @@ def search_employee_requests(request, **kwargs):
 @api_view()
 @check_user_permission(VIEW_PERMISSION_STR, EmployeeRequest)
 def get_employee_requests_excel(request, **kwargs):
-    data_list = employee_requests_filter(request, EmployeeRequest.objects.filter(employee__employer_id=kwargs["employer"]))
-    data = [["نوع", "پرسنل", "تاریخ شروع", "تاریخ پایان", "تاریخ ثبت", ]]
-    for fin in data_list:
-        data.append([fin.category.name, fin.employee.get_full_name(), fin.start_date.strftime(DATE_FORMAT_STR), fin.end_date.strftime(DATE_FORMAT_STR),
-                     fin.registration_date.strftime(DATE_FORMAT_STR), ])
-    return send_response_file(data, 'employees')
+    data_list = employee_requests_filter(request, EmployeeRequest.objects.filter(employer_id=kwargs["employer"]).select_related("employee"))
+    if isinstance(data_list, Response):
+        return data_list
+    header = ["نوع", "پرسنل", "تاریخ شروع", "تاریخ پایان", "تاریخ ثبت", ]
+    rows = ([fin.get_category_display(), fin.employee.get_full_name(), fin.date.strftime(DATE_FORMAT_STR) if fin.date else None,
+             fin.end_date.strftime(DATE_FORMAT_STR) if fin.end_date else None, fin.registration_date.strftime(DATE_FORMAT_STR), ]
+            for fin in data_list.iterator(chunk_size=EXPORT_CHUNK_SIZE))
+    return send_response_file(chain([header], rows), 'employees', kwargs.get("file_format", "excel"))
 
 
 @api_view()
@@ -934,7 +956,7 @@ def get_employee_requests_excel(request, **kwargs):
 def get_employees_requests_list(request, **kwargs):
     # employees = Employee.objects.filter(employer_id=kwargs["employer"])
     # requests_list = EmployeeRequest.objects.filter(employee_id__in=employees)
-    requests_list = employee_requests_filter(request, EmployeeRequest.objects.filter(employee__employer_id=kwargs["employer"]))
+    requests_list = employee_requests_filter(request, EmployeeRequest.objects.filter(employer_id=kwargs["employer"]))
     ser = EmployeeRequestOutputSerializer(requests_list, many=True)
     return Response(ser.data, status=status.HTTP_200_OK)
 
@@ -1063,8 +1085,7 @@ def create_manager(request, **kwargs):
     ser = RegisterManagerSerializer(data=kwargs)
     if ser.is_valid():
         e = ser.save()
-        perms = get_acceptable_permissions(filters=request.data.get("permissions")).values_list("id", flat=True)
-        e.user_permissions.add(*perms)
+        e.user_permissions.add(*get_acceptable_permissions(filters=request.data.get("permissions")))
         return Response(ManagerOutputSerializer(e).data, status=status.HTTP_201_CREATED)
     return Response(ser.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -1083,8 +1104,7 @@ def update_manager(request, oid, **kwargs):
     else:
         return Response(ser.errors, status=status.HTTP_400_BAD_REQUEST)
     if "permissions" in request.data:
-        perms = get_acceptable_permissions(filters=request.data.get("permissions")).values_list("id", flat=True)
-        mg.user_permissions.add(*perms)
+        mg.user_permissions.add(*get_acceptable_permissions(filters=request.data.get("permissions")))
     return Response(ManagerOutputSerializer(mg).data, status=status.HTTP_201_CREATED)
 
 